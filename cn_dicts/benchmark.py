@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+词库工具性能基准测试
+按指定规模（1万到1000万行）生成合成的单字编码表、词库（与zi.dict.yaml、wubi.phrase.dict.yaml格式相同）、
+词语权重表和词语列表，测量wubi.encoded.py和replace_weight.py中主要函数的耗时，
+结果写入JSON文件，可用 --compare 与其他提交的结果比较
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import datetime
+import statistics
+import subprocess
+import contextlib
+import importlib.util
+from typing import Dict, List, Optional, Callable, Iterator, Mapping
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import replace_weight  # noqa: E402
+
+# 结果文件格式版本
+RESULT_FORMAT_VERSION = 1
+DEFAULT_RESULT_FILE = "benchmark_results.json"
+DEFAULT_SIZES = "10k,100k"
+MIN_SIZE = 10_000
+MAX_SIZE = 10_000_000
+DEFAULT_REPEAT = 3
+# 与上次结果比较时，最短耗时增加超过此比例视为变慢
+REGRESSION_THRESHOLD = 0.10
+# 合成数据的随机种子，保证每次生成的数据相同
+BENCH_SEED = 20260101
+
+# 合成词语使用的汉字（基本区）和编码字母（五笔使用a~y）
+CHAR_POOL = [chr(code) for code in range(0x4E00, 0x9FA6)]
+CODE_LETTERS = "abcdefghijklmnopqrstuvwxy"
+PINYIN_SYLLABLES = ["a", "ai", "an", "ba", "bei", "chang", "de", "ge", "hao", "ji", "jiang", "le",
+                    "ma", "ni", "qing", "shi", "ta", "wo", "xue", "yi", "zhong", "zi"]
+# 词语序号到词语的映射：序号乘以与池大小平方互质的常数后取模，前两个字唯一确定一个序号
+PHRASE_SPACE = len(CHAR_POOL) ** 2
+PHRASE_SCRAMBLE = 2654435761
+# 每隔多少个词语插入一个码表中没有的字（扩展B区），用于覆盖编码失败的分支
+UNKNOWN_CHAR_INTERVAL = 50
+UNKNOWN_CHAR = "\U00020000"
+# 编码测试时每批预先生成的词语数，避免把1000万个词语同时放在内存中
+ENCODE_CHUNK_SIZE = 100_000
+# 参与测试的编码规则（规则五为手动输入编码，不参与）
+BENCH_RULES = [1, 2, 3, 4, 6]
+
+ZI_DICT_HEADER = """# Rime dictionary
+# encoding: utf-8
+---
+name: zi
+version: "bench"
+sort: by_weight
+...
+"""
+
+PHRASE_DICT_HEADER = """# Rime dictionary
+# encoding: utf-8
+---
+name: wubi.phrase
+version: "bench"
+sort: by_weight
+columns:
+  - text
+  - code
+  - weight
+  - stem
+...
+"""
+
+
+def load_wubi_module():
+    """wubi.encoded.py的文件名含点号，不能直接import，按文件路径加载"""
+    path = os.path.join(SCRIPT_DIR, "wubi.encoded.py")
+    spec = importlib.util.spec_from_file_location("wubi_encoded", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_size(text: str) -> int:
+    """解析行数，支持 k/M 后缀（如 10k、1M）"""
+    text = text.strip()
+    multiplier = 1
+    if text[-1:].lower() == 'k':
+        multiplier, text = 1000, text[:-1]
+    elif text[-1:].lower() == 'm':
+        multiplier, text = 1_000_000, text[:-1]
+    size = int(float(text) * multiplier)
+    if not MIN_SIZE <= size <= MAX_SIZE:
+        raise argparse.ArgumentTypeError(f"行数应在 {MIN_SIZE} 到 {MAX_SIZE} 之间: {text}")
+    return size
+
+
+def format_size(size: int) -> str:
+    if size % 1_000_000 == 0:
+        return f"{size // 1_000_000}M"
+    if size % 1000 == 0:
+        return f"{size // 1000}k"
+    return str(size)
+
+
+# ==================== 合成数据 ====================
+
+def phrase_for(index: int) -> str:
+    """第index个合成词语（2~5个字），不同序号得到不同词语"""
+    pool_size = len(CHAR_POOL)
+    scrambled = (index * PHRASE_SCRAMBLE) % PHRASE_SPACE
+    chars = [CHAR_POOL[scrambled // pool_size], CHAR_POOL[scrambled % pool_size]]
+    for extra in range(index % 4):
+        chars.append(CHAR_POOL[(scrambled * 31 + extra * 7919) % pool_size])
+    if index % UNKNOWN_CHAR_INTERVAL == UNKNOWN_CHAR_INTERVAL - 1:
+        chars.append(UNKNOWN_CHAR)
+    return ''.join(chars)
+
+
+def iter_phrases(start: int, count: int) -> Iterator[str]:
+    for index in range(start, start + count):
+        yield phrase_for(index)
+
+
+def _char_code(index: int, length: int = 4) -> str:
+    letters = []
+    for _ in range(length):
+        index, digit = divmod(index, len(CODE_LETTERS))
+        letters.append(CODE_LETTERS[digit])
+    return ''.join(letters)
+
+
+def _write_lines(path: str, header: str, lines: Iterator[str]) -> None:
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(header)
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= 10000:
+                f.write('\n'.join(batch) + '\n')
+                batch = []
+        if batch:
+            f.write('\n'.join(batch) + '\n')
+
+
+def write_char_table(path: str, size: int) -> None:
+    """单字编码表（与86word-8105-better.txt格式相同）：字\\t编码，超过汉字数时循环"""
+    pool_size = len(CHAR_POOL)
+    _write_lines(path, "", (f"{CHAR_POOL[i % pool_size]}\t{_char_code(i * 7 + i // pool_size)}"
+                            for i in range(size)))
+
+
+def write_zi_dict(path: str, size: int, rng: random.Random) -> None:
+    """单字词库（与zi.dict.yaml格式相同）：字\\t拼音\\t权重"""
+    pool_size = len(CHAR_POOL)
+    _write_lines(path, ZI_DICT_HEADER, (f"{CHAR_POOL[i % pool_size]}\t{rng.choice(PINYIN_SYLLABLES)}\t"
+                                        f"{rng.randint(1, 999)}" for i in range(size)))
+
+
+def write_phrase_dict(path: str, size: int, rng: random.Random) -> None:
+    """词组词库（与wubi.phrase.dict.yaml格式相同）：词组\\t编码\\t权重"""
+    _write_lines(path, PHRASE_DICT_HEADER, (f"{phrase}\t{_char_code(i)}\t{rng.randint(1, 999)}"
+                                            for i, phrase in enumerate(iter_phrases(0, size))))
+
+
+def write_phrase_weights(path: str, size: int, rng: random.Random) -> None:
+    """词语权重表（phrase_weight.txt）：词组\\t权重；与词组词库有一半词组相同"""
+    _write_lines(path, "", (f"{phrase}\t{rng.randint(1, 999)}" for phrase in iter_phrases(size // 2, size)))
+
+
+def write_phrase_list(path: str, size: int) -> None:
+    """批量编码的输入文件：每行一个词组"""
+    _write_lines(path, "", iter_phrases(0, size))
+
+
+class BenchData:
+    """某一规模的合成数据文件，首次使用时生成"""
+
+    def __init__(self, root: str, size: int):
+        self.size = size
+        self.dir = os.path.join(root, f"data_{size}")
+        self.char_table = os.path.join(self.dir, "char_table.txt")
+        self.full_char_table = os.path.join(root, "full_char_table.txt")
+        self.zi_dict = os.path.join(self.dir, "zi.dict.yaml")
+        self.phrase_dict = os.path.join(self.dir, "wubi.phrase.dict.yaml")
+        self.phrase_weights = os.path.join(self.dir, "phrase_weight.txt")
+        self.phrase_list = os.path.join(self.dir, "phrases.txt")
+
+    def generate(self) -> None:
+        if not os.path.exists(self.full_char_table):
+            write_char_table(self.full_char_table, len(CHAR_POOL))
+        if os.path.isdir(self.dir):
+            return
+        # 先写入临时目录再改名，中断后不会留下不完整的数据供下次复用
+        tmp_dir = self.dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        rng = random.Random(BENCH_SEED + self.size)
+        for name, write in ((self.char_table, lambda path: write_char_table(path, self.size)),
+                            (self.zi_dict, lambda path: write_zi_dict(path, self.size, rng)),
+                            (self.phrase_dict, lambda path: write_phrase_dict(path, self.size, rng)),
+                            (self.phrase_weights, lambda path: write_phrase_weights(path, self.size, rng)),
+                            (self.phrase_list, lambda path: write_phrase_list(path, self.size))):
+            write(os.path.join(tmp_dir, os.path.basename(name)))
+        os.replace(tmp_dir, self.dir)
+
+
+# ==================== 测试项目 ====================
+
+@contextlib.contextmanager
+def quiet():
+    """屏蔽被测函数的输出（输出本身的耗时仍计入；标准错误输出不是终端，不显示进度条）"""
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def run_dir(data: BenchData, *files: str) -> Iterator[str]:
+    """每次运行使用新的工作目录，复制会被修改的输入文件，结束后删除"""
+    path = tempfile.mkdtemp(prefix="run_", dir=os.path.dirname(data.dir))
+    try:
+        for file in files:
+            shutil.copy(file, path)
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _timed(func: Callable[[], object]) -> float:
+    with quiet():
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+
+def bench_read_single_char_codes(ctx: 'BenchContext', data: BenchData) -> float:
+    with run_dir(data, data.char_table) as path:
+        table = os.path.join(path, os.path.basename(data.char_table))
+        return _timed(lambda: ctx.wubi.read_single_char_codes(table, use_cache=False))
+
+
+def bench_read_single_char_codes_cached(ctx: 'BenchContext', data: BenchData) -> float:
+    with run_dir(data, data.char_table) as path:
+        table = os.path.join(path, os.path.basename(data.char_table))
+        _timed(lambda: ctx.wubi.read_single_char_codes(table))
+        return _timed(lambda: ctx.wubi.read_single_char_codes(table))
+
+
+def bench_read_phrase_weights(ctx: 'BenchContext', data: BenchData) -> float:
+    return _timed(lambda: ctx.wubi.read_phrase_weights(data.phrase_weights, use_cache=False))
+
+
+def bench_read_phrase_weights_cached(ctx: 'BenchContext', data: BenchData) -> float:
+    with run_dir(data, data.phrase_weights) as path:
+        weights = os.path.join(path, os.path.basename(data.phrase_weights))
+        _timed(lambda: ctx.wubi.read_phrase_weights(weights))
+        return _timed(lambda: ctx.wubi.read_phrase_weights(weights))
+
+
+def make_bench_generate_wubi_code(rule: int) -> Callable[['BenchContext', BenchData], float]:
+    def bench(ctx: 'BenchContext', data: BenchData) -> float:
+        generate_wubi_code = ctx.wubi.generate_wubi_code
+        char_codes = ctx.char_codes
+        elapsed = 0.0
+        for start in range(0, data.size, ENCODE_CHUNK_SIZE):
+            phrases = list(iter_phrases(start, min(ENCODE_CHUNK_SIZE, data.size - start)))
+            elapsed += _timed(lambda: [generate_wubi_code(phrase, char_codes, rule) for phrase in phrases])
+        return elapsed
+    return bench
+
+
+def bench_file_batch_mode(ctx: 'BenchContext', data: BenchData) -> float:
+    phrase_weights = ctx.phrase_weights(data)
+    with run_dir(data, data.phrase_list) as path:
+        old_cwd, old_record_dir = os.getcwd(), ctx.wubi.Config.RECORD_DIR
+        os.chdir(path)
+        ctx.wubi.Config.RECORD_DIR = os.path.join(path, "record")
+        added = []
+        try:
+            elapsed = _timed(lambda: added.append(ctx.wubi.file_batch_mode(
+                1, ctx.char_codes, phrase_weights, os.path.basename(data.phrase_list), workers=ctx.workers)[0]))
+        finally:
+            os.chdir(old_cwd)
+            ctx.wubi.Config.RECORD_DIR = old_record_dir
+    if not added[0]:
+        raise RuntimeError("file_batch_mode没有添加任何词组")
+    return elapsed
+
+
+def bench_load_file_with_column_detection(ctx: 'BenchContext', data: BenchData) -> float:
+    """文件头声明了columns的词组词库"""
+    return _timed(lambda: replace_weight.load_file_with_column_detection(data.phrase_dict))
+
+
+def bench_load_file_with_column_detection_sampled(ctx: 'BenchContext', data: BenchData) -> float:
+    """文件头没有columns、需要抽样检测列类型的单字词库"""
+    return _timed(lambda: replace_weight.load_file_with_column_detection(data.zi_dict))
+
+
+def _replace(ctx: 'BenchContext', data: BenchData, direction: int) -> float:
+    with run_dir(data, data.phrase_weights, data.phrase_dict) as path:
+        base_file = os.path.join(path, os.path.basename(data.phrase_weights))
+        target = os.path.join(path, os.path.basename(data.phrase_dict))
+        record_dir = os.path.join(path, "record")
+
+        def run() -> None:
+            base_index = replace_weight.BaseFileIndex(base_file, ctx.join_engine)
+            try:
+                base_index.load()
+                if direction == 1:
+                    success = replace_weight.replace_weights_direction1(target, base_index, record_dir)
+                else:
+                    success = replace_weight.replace_weights_direction2(target, base_index, record_dir)
+            finally:
+                base_index.close()
+            if not success:
+                raise RuntimeError(f"替换方向{direction}执行失败")
+
+        return _timed(run)
+
+
+def bench_replace_direction1(ctx: 'BenchContext', data: BenchData) -> float:
+    return _replace(ctx, data, 1)
+
+
+def bench_replace_direction2(ctx: 'BenchContext', data: BenchData) -> float:
+    return _replace(ctx, data, 2)
+
+
+BENCHMARKS: Dict[str, Callable[['BenchContext', BenchData], float]] = {
+    "read_single_char_codes": bench_read_single_char_codes,
+    "read_single_char_codes[cache]": bench_read_single_char_codes_cached,
+    "read_phrase_weights": bench_read_phrase_weights,
+    "read_phrase_weights[cache]": bench_read_phrase_weights_cached,
+    **{f"generate_wubi_code[rule{rule}]": make_bench_generate_wubi_code(rule) for rule in BENCH_RULES},
+    "file_batch_mode": bench_file_batch_mode,
+    "load_file_with_column_detection": bench_load_file_with_column_detection,
+    "load_file_with_column_detection[zi]": bench_load_file_with_column_detection_sampled,
+    "replace_weights_direction1": bench_replace_direction1,
+    "replace_weights_direction2": bench_replace_direction2,
+}
+
+
+class BenchContext:
+    """各测试项目共用的模块和预先读取的数据"""
+
+    def __init__(self, root: str, workers: int, join_engine: str):
+        self.root = root
+        self.workers = workers
+        self.join_engine = join_engine
+        self.wubi = load_wubi_module()
+        self.char_codes: Dict[str, str] = {}
+        self._phrase_weights: Dict[int, Mapping[str, str]] = {}
+
+    def prepare(self, data: BenchData) -> None:
+        data.generate()
+        if not self.char_codes:
+            with quiet():
+                self.char_codes = self.wubi.read_single_char_codes(data.full_char_table, use_cache=False)
+
+    def phrase_weights(self, data: BenchData) -> Mapping[str, str]:
+        if data.size not in self._phrase_weights:
+            self._phrase_weights.clear()
+            with quiet():
+                self._phrase_weights[data.size] = self.wubi.read_phrase_weights(data.phrase_weights)
+        return self._phrase_weights[data.size]
+
+
+# ==================== 运行与比较 ====================
+
+def git_commit() -> Optional[str]:
+    """当前的git提交，不在git仓库中时返回None"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def select_benchmarks(names: Optional[List[str]]) -> List[str]:
+    """按名称前缀筛选测试项目，未指定时运行全部"""
+    if not names:
+        return list(BENCHMARKS)
+    selected = [name for name in BENCHMARKS if any(name.startswith(prefix) for prefix in names)]
+    if not selected:
+        raise ValueError(f"没有匹配的测试项目: {', '.join(names)}")
+    return selected
+
+
+def run_benchmarks(sizes: List[int], names: List[str], repeat: int, data_dir: str,
+                   workers: int, join_engine: str) -> List[Dict[str, object]]:
+    """逐个规模、逐个项目运行测试，返回结果列表"""
+    ctx = BenchContext(data_dir, workers, join_engine)
+    results = []
+    for size in sizes:
+        data = BenchData(data_dir, size)
+        print(f"\n正在准备 {format_size(size)} 行的合成数据...")
+        ctx.prepare(data)
+        for name in names:
+            runs = []
+            try:
+                for _ in range(repeat):
+                    runs.append(BENCHMARKS[name](ctx, data))
+            except Exception as e:
+                print(f"  {name:<36} 出错: {e}")
+                results.append({"benchmark": name, "lines": size, "error": str(e)})
+                continue
+            best = min(runs)
+            results.append({
+                "benchmark": name,
+                "lines": size,
+                "runs": [round(t, 6) for t in runs],
+                "min": round(best, 6),
+                "median": round(statistics.median(runs), 6),
+                "lines_per_second": round(size / best) if best > 0 else None,
+            })
+            print(f"  {name:<36} 最短 {best:9.3f} 秒  中位 {statistics.median(runs):9.3f} 秒")
+    return results
+
+
+def _pypinyin_available() -> bool:
+    return importlib.util.find_spec("pypinyin") is not None
+
+
+def write_results(path: str, results: List[Dict[str, object]], repeat: int, workers: int,
+                  join_engine: str) -> None:
+    report = {
+        "format": RESULT_FORMAT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pypinyin": _pypinyin_available(),
+        "repeat": repeat,
+        "workers": workers,
+        "join_engine": join_engine,
+        "results": results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def compare_results(old_path: str, results: List[Dict[str, object]], threshold: float) -> int:
+    """
+    按最短耗时与上次的结果文件比较，打印每项的变化
+    返回变慢超过阈值的项目数
+    """
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old_report = json.load(f)
+    old_times = {(r["benchmark"], r["lines"]): r["min"] for r in old_report.get("results", []) if "min" in r}
+
+    print(f"\n与 {old_path}（提交 {old_report.get('commit') or '未知'}）比较:")
+    regressions = 0
+    for result in results:
+        key = (result["benchmark"], result["lines"])
+        if "min" not in result or key not in old_times:
+            continue
+        old, new = old_times[key], result["min"]
+        change = (new - old) / old if old > 0 else 0.0
+        mark = ""
+        if change > threshold:
+            mark = "  变慢"
+            regressions += 1
+        elif change < -threshold:
+            mark = "  变快"
+        print(f"  {result['benchmark']:<36} {format_size(result['lines']):>5}  "
+              f"{old:9.3f} -> {new:9.3f} 秒 ({change:+.1%}){mark}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="词库工具性能基准测试：生成合成词库并测量主要函数的耗时，结果写入JSON文件")
+    parser.add_argument("-s", "--sizes", default=DEFAULT_SIZES,
+                        help=f"逗号分隔的行数，支持k/M后缀，范围 {format_size(MIN_SIZE)}~{format_size(MAX_SIZE)}"
+                             f"（默认 {DEFAULT_SIZES}）")
+    parser.add_argument("-b", "--bench", action="append", metavar="NAME",
+                        help="只运行名称以NAME开头的项目，可重复指定")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"每项重复次数，结果取最短和中位耗时（默认 {DEFAULT_REPEAT}）")
+    parser.add_argument("-o", "--output", default=DEFAULT_RESULT_FILE,
+                        help=f"结果文件（默认 {DEFAULT_RESULT_FILE}）")
+    parser.add_argument("--compare", metavar="FILE", help="与此前的结果文件比较，有项目变慢时退出码为1")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help=f"比较时视为变慢的耗时增加比例（默认 {REGRESSION_THRESHOLD}）")
+    parser.add_argument("--data-dir", help="合成数据目录，指定时保留并在下次复用（默认使用临时目录）")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="file_batch_mode的并行进程数（默认 1）")
+    parser.add_argument("--join", choices=replace_weight.JOIN_ENGINES, default="auto",
+                        help="replace_weight的连接方式（默认 auto）")
+    parser.add_argument("--list", action="store_true", help="列出全部测试项目")
+    args = parser.parse_args()
+
+    if args.list:
+        for name in BENCHMARKS:
+            print(name)
+        return
+
+    try:
+        sizes = sorted({parse_size(size) for size in args.sizes.split(',') if size.strip()})
+        names = select_benchmarks(args.bench)
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        parser.error(str(e))
+    if args.repeat < 1:
+        parser.error("重复次数至少为1")
+
+    if not _pypinyin_available() and any(name.endswith("[rule6]") for name in names):
+        print("警告: pypinyin模块未安装，规则六只测量五笔编码部分")
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="rime_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+    try:
+        results = run_benchmarks(sizes, names, args.repeat, data_dir, args.workers, args.join)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    write_results(args.output, results, args.repeat, args.workers, args.join)
+    print(f"\n结果已保存到: {args.output}")
+
+    failed = sum(1 for result in results if "error" in result)
+    regressions = compare_results(args.compare, results, args.threshold) if args.compare else 0
+    if regressions:
+        print(f"\n{regressions} 个项目变慢超过 {args.threshold:.0%}")
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n程序被用户中断")
+        sys.exit(1)
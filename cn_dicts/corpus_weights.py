@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+语料词频统计工具
+用主词库及其导入码表（或指定词库）中的全部词语建立一个Aho–Corasick自动机，只扫描一遍本地语料，
+统计每个词语（含重叠出现，如“中国人”同时计入“中国”和“国人”）的出现次数，
+写出 read_phrase_weights 和 replace_weight.py 读取的 phrase_weight.txt（词语\t次数）。
+语料按块分给进程池，同时在途的块数有上限，内存占用与语料大小无关；各阶段耗时写入记录目录中的 .metrics.json
+"""
+
+import os
+import sys
+import re
+import argparse
+import datetime
+import collections
+import multiprocessing
+from array import array
+from typing import Dict, List, Tuple, Optional, Iterable, Iterator
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from run_report import RunMetrics, session_metrics, progress_enabled, VERBOSITY_NORMAL  # noqa: E402
+from replace_weight import BASE_FILE  # noqa: E402
+from table_io import RECORD_DIR, write_file_atomically, backup_original_file  # noqa: E402
+from dict_compiler import MAIN_DICT_FILE, read_dict_header, iter_table_entries  # noqa: E402
+
+# 参与统计的词语：只由汉字组成（基本区、扩展A区及以后各区、兼容汉字），英文、符号等词条不统计
+CJK_IDEOGRAPHS_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0003134f]+')
+
+# 每块语料的字符数，同时在途的块数为进程数的两倍
+CORPUS_CHUNK_CHARS = 4 * 1024 * 1024
+# 在块的末尾附近寻找切分点（换行或词语中不会出现的字符）时最多向前查找的字符数，找不到时直接切分
+SPLIT_SEARCH_CHARS = 4096
+# 语料中无法按UTF-8解码的字节按此方式处理
+CORPUS_ERRORS = "replace"
+# 进程数：0表示使用全部CPU核心
+CORPUS_WORKERS = 0
+
+
+class PhraseAutomaton:
+    """
+    Aho–Corasick多模式自动机
+    状态以整数表示，0为根；goto[状态]为 {字: 下一状态}，fail[状态]为失配时转到的状态（最长的真后缀状态）。
+    扫描时每个字只在所到达的状态上计数一次，扫描结束后沿失配链从深到浅累加，
+    每个词语终止状态上的累计值即为该词语的出现次数（含重叠出现）
+    """
+
+    def __init__(self, phrases: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.terminal: Dict[int, str] = {}
+        for phrase in phrases:
+            self._insert(phrase)
+        self.fail = array('l', [0]) * len(self.goto)
+        # 按广度优先顺序排列的状态，累加计数时倒序处理
+        self.order = array('l')
+        self._build_fail_links()
+        self.alphabet = frozenset(char for transitions in self.goto for char in transitions)
+
+    def __len__(self) -> int:
+        return len(self.terminal)
+
+    @property
+    def state_count(self) -> int:
+        return len(self.goto)
+
+    def _insert(self, phrase: str) -> None:
+        goto = self.goto
+        state = 0
+        for char in phrase:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto.append({})
+                goto[state][char] = next_state
+            state = next_state
+        self.terminal[state] = phrase
+
+    def _build_fail_links(self) -> None:
+        goto, fail, order = self.goto, self.fail, self.order
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            order.append(state)
+            for char, next_state in goto[state].items():
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                queue.append(next_state)
+
+    def scan(self, text: str, hits: array) -> None:
+        """扫描一段文本，把每个字所到达的状态计入hits（长度为状态数）"""
+        goto, fail, alphabet = self.goto, self.fail, self.alphabet
+        state = 0
+        for char in text:
+            if char not in alphabet:
+                state = 0
+                continue
+            while True:
+                next_state = goto[state].get(char)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            hits[state] += 1
+
+    def phrase_counts(self, hits: array) -> Dict[str, int]:
+        """把各状态的到达次数沿失配链累加，返回出现过的词语的出现次数"""
+        totals = array('q', hits)
+        fail = self.fail
+        for state in reversed(self.order):
+            totals[fail[state]] += totals[state]
+        return {phrase: totals[state] for state, phrase in self.terminal.items() if totals[state]}
+
+
+def read_dictionary_phrases(dict_files: List[str], min_length: int = 1) -> List[str]:
+    """
+    读取词库中的词语（去重，保持首次出现的顺序）
+    词库的文件头有import_tables时一并读取导入的码表；只保留由汉字组成、长度不小于min_length的词语
+    """
+    phrases: Dict[str, None] = {}
+    for dict_file in dict_files:
+        header = read_dict_header(dict_file)
+        dict_dir = os.path.dirname(os.path.abspath(dict_file))
+        sources = [(dict_file, header.data_columns, header.data_start)]
+        for table in header.import_tables:
+            table_file = os.path.join(dict_dir, table + ".dict.yaml")
+            if not os.path.exists(table_file):
+                print(f"警告: 导入的码表 {table_file} 不存在，已跳过")
+                continue
+            table_header = read_dict_header(table_file)
+            sources.append((table_file, table_header.data_columns, table_header.data_start))
+
+        for file_path, columns, start_line in sources:
+            if start_line is None:
+                print(f"警告: 码表 {file_path} 中没有'...'，已跳过")
+                continue
+            before = len(phrases)
+            for _, text, _, _, _ in iter_table_entries(file_path, columns, start_line):
+                if len(text) >= min_length and CJK_IDEOGRAPHS_RE.fullmatch(text):
+                    phrases[text] = None
+            print(f"  {os.path.basename(file_path)}: 新增 {len(phrases) - before} 个词语")
+    return list(phrases)
+
+
+def _split_point(block: str, alphabet: frozenset) -> int:
+    """
+    块的切分位置：最后一个换行之后，没有换行时为末尾附近最后一个不在词语中出现的字之后，
+    使切分点两侧不会被同一个词语跨越；都找不到时在末尾直接切分
+    """
+    newline = block.rfind('\n')
+    if newline >= 0:
+        return newline + 1
+    for i in range(len(block) - 1, max(len(block) - SPLIT_SEARCH_CHARS, 0) - 1, -1):
+        if block[i] not in alphabet:
+            return i + 1
+    return len(block)
+
+
+def iter_corpus_chunks(corpus_files: List[str], alphabet: frozenset, chunk_chars: int = CORPUS_CHUNK_CHARS,
+                       metrics: Optional[RunMetrics] = None) -> Iterator[str]:
+    """
+    逐个语料文件按块读取，产出约chunk_chars个字符的文本块
+    块在换行（或词语中不会出现的字）处切分，切分点之后的部分并入下一块，每个字只被读取和扫描一次
+    """
+    for corpus_file in corpus_files:
+        with open(corpus_file, 'r', encoding='utf-8', errors=CORPUS_ERRORS) as f:
+            if metrics is not None:
+                metrics.track_file(f)
+            carry = ""
+            while True:
+                block = f.read(chunk_chars)
+                if not block:
+                    break
+                block = carry + block
+                split = _split_point(block, alphabet)
+                carry = block[split:]
+                if split:
+                    yield block[:split]
+            if carry:
+                yield carry
+
+
+# 工作进程中的自动机，由进程初始化函数设置
+_worker_automaton: Optional[PhraseAutomaton] = None
+
+
+def _init_scan_worker(automaton: PhraseAutomaton) -> None:
+    """工作进程初始化：每个进程只接收一次自动机（fork方式直接继承父进程内存）"""
+    global _worker_automaton
+    _worker_automaton = automaton
+
+
+def _scan_chunk(text: str) -> List[Tuple[int, int]]:
+    """工作进程：扫描一块语料，返回到达过的状态及次数 [(状态, 次数)]"""
+    automaton = _worker_automaton
+    hits = array('q', bytes(8 * automaton.state_count))
+    automaton.scan(text, hits)
+    return [(state, count) for state, count in enumerate(hits) if count]
+
+
+def scan_corpus(automaton: PhraseAutomaton, chunks: Iterable[str], workers: int,
+                metrics: RunMetrics) -> Tuple[array, int]:
+    """
+    扫描全部语料块，返回各状态的到达次数和扫描的字符数
+    多进程时同时在途的块数不超过进程数的两倍，内存占用与语料大小无关
+    """
+    hits = array('q', bytes(8 * automaton.state_count))
+    chars = 0
+    chunks = iter(chunks)
+
+    def next_chunk() -> Optional[str]:
+        nonlocal chars
+        with metrics.stage("parse"):
+            text = next(chunks, None)
+        if text is not None:
+            chars += len(text)
+            metrics.tick(text.count('\n'))
+        return text
+
+    def merge(state_counts: List[Tuple[int, int]]) -> None:
+        for state, count in state_counts:
+            hits[state] += count
+
+    if workers <= 1:
+        _init_scan_worker(automaton)
+        while True:
+            text = next_chunk()
+            if text is None:
+                break
+            with metrics.stage("classify"):
+                merge(_scan_chunk(text))
+        return hits, chars
+
+    window = workers * 2
+    pending = collections.deque()
+    with multiprocessing.Pool(workers, initializer=_init_scan_worker, initargs=(automaton,)) as pool:
+        while True:
+            while len(pending) < window:
+                text = next_chunk()
+                if text is None:
+                    break
+                pending.append(pool.apply_async(_scan_chunk, (text,)))
+            if not pending:
+                break
+            with metrics.stage("classify"):
+                merge(pending.popleft().get())
+    return hits, chars
+
+
+def count_corpus_phrases(
+    corpus_files: List[str],
+    dict_files: List[str],
+    output_file: str = BASE_FILE,
+    min_count: int = 1,
+    min_length: int = 1,
+    workers: int = CORPUS_WORKERS,
+    record_dir: str = RECORD_DIR,
+    show_progress: bool = False
+) -> bool:
+    """
+    统计语料中词库词语的出现次数，按次数从大到小写入output_file（词语\t次数）
+    只写出现次数不小于min_count的词语；output_file已存在时先存入备份库
+    """
+    metrics = RunMetrics("corpus_weights", progress=progress_enabled(VERBOSITY_NORMAL, show_progress))
+
+    print("正在读取词库中的词语:")
+    with metrics.stage("table_load"):
+        phrases = read_dictionary_phrases(dict_files, min_length)
+    if not phrases:
+        print("错误: 词库中没有可以统计的词语")
+        return False
+
+    with metrics.stage("index_build"):
+        automaton = PhraseAutomaton(phrases)
+    print(f"已建立自动机: {len(automaton)} 个词语，{automaton.state_count} 个状态")
+
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    metrics.count("workers", workers)
+    if workers > 1:
+        print(f"使用 {workers} 个进程扫描语料")
+    corpus_size = sum(os.path.getsize(corpus_file) for corpus_file in corpus_files)
+    print(f"正在扫描 {len(corpus_files)} 个语料文件（共 {corpus_size / 1024 / 1024:.1f} MB）")
+
+    try:
+        chunks = iter_corpus_chunks(corpus_files, automaton.alphabet, metrics=metrics)
+        hits, chars = scan_corpus(automaton, chunks, workers, metrics)
+    except Exception as e:
+        print(f"扫描语料时发生错误: {str(e)}")
+        return False
+    finally:
+        metrics.finish_progress()
+
+    with metrics.stage("substitute"):
+        counts = automaton.phrase_counts(hits)
+        ranked = sorted(((phrase, count) for phrase, count in counts.items() if count >= min_count),
+                        key=lambda item: (-item[1], item[0]))
+    print(f"已扫描 {chars} 个字符，{len(counts)} 个词语出现过，写出出现 {min_count} 次以上的 {len(ranked)} 个")
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    backup = [None]
+
+    def before_commit() -> bool:
+        # 覆盖已有的权重表（可能是手工维护的）之前先存入备份库
+        if os.path.exists(output_file):
+            with metrics.stage("record"):
+                backup[0], _ = backup_original_file(record_dir, output_file, timestamp)
+            if backup[0] is None:
+                print(f"错误: {output_file} 未能存入备份库，不覆盖原文件")
+                return False
+        return True
+
+    try:
+        with metrics.stage("write"):
+            if not write_file_atomically(output_file, (f"{phrase}\t{count}\n" for phrase, count in ranked),
+                                         before_commit):
+                return False
+    except Exception as e:
+        print(f"写入文件 {output_file} 时发生错误: {str(e)}")
+        return False
+    print(f"已写入: {output_file}")
+    if backup[0]:
+        print(f"原文件已保存到备份库: {backup[0][:12]}")
+        print(f"恢复命令: python replace_weight.py --restore {backup[0][:12]} --record-dir \"{record_dir}\"")
+
+    os.makedirs(record_dir, exist_ok=True)
+    record_file = os.path.join(record_dir, f"corpus_weights_log_{timestamp}.txt")
+    try:
+        with open(record_file, 'w', encoding='utf-8') as f:
+            f.write(f"# 语料词频统计记录 - {timestamp}\n")
+            f.write(f"# 词库: {', '.join(dict_files)}\n")
+            f.write(f"# 语料: {', '.join(corpus_files)}\n")
+            f.write(f"# 扫描字符数: {chars}\n")
+            f.write(f"# 词语数: {len(automaton)}，出现过: {len(counts)}，写出: {len(ranked)}\n")
+            f.write(f"# 输出文件: {output_file}\n")
+            if backup[0]:
+                f.write(f"# 原文件已保存到备份库: {backup[0]}\n")
+            f.write("*" * 30 + "\n\n")
+            f.write("## 出现次数最多的词语\n")
+            f.writelines(f"{phrase}\t{count}\n" for phrase, count in ranked[:100])
+    except Exception as e:
+        print(f"写入统计记录时发生错误: {str(e)}")
+        return True
+    print(f"统计记录已保存到: {record_file}")
+
+    metrics.count("corpus_chars", chars)
+    metrics.count("phrases", len(automaton))
+    metrics.count("states", automaton.state_count)
+    metrics.count("matched_phrases", len(counts))
+    metrics_file = metrics.write(record_file, session_metrics())
+    if metrics_file:
+        print(f"运行统计已保存到: {metrics_file}")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="统计本地语料中词库词语的出现次数，生成replace_weight.py和wubi.encoded.py读取的词语权重表")
+    parser.add_argument("corpus", nargs="+",
+                        help="语料文件（UTF-8文本）")
+    parser.add_argument("-d", "--dict", action="append", dest="dicts",
+                        help="提供词语的词库，可多次指定；有import_tables时一并读取导入的码表（默认 ../wubi.dict.yaml）")
+    parser.add_argument("-o", "--output", default=BASE_FILE,
+                        help=f"输出的词语权重表（默认: {BASE_FILE}，已存在时先存入备份库）")
+    parser.add_argument("--min-count", type=int, default=1,
+                        help="只写出出现次数不小于此值的词语（默认: 1）")
+    parser.add_argument("--min-length", type=int, default=1,
+                        help="只统计字数不小于此值的词语（默认: 1，含单字）")
+    parser.add_argument("-j", "--workers", type=int, default=CORPUS_WORKERS,
+                        help="扫描语料的进程数（默认: 0，使用全部CPU核心）")
+    parser.add_argument("--record-dir", default=RECORD_DIR,
+                        help=f"记录文件和备份库的目录（默认: {RECORD_DIR}）")
+    parser.add_argument("--progress", action="store_true",
+                        help="总是显示进度条（默认只在终端中显示）")
+    args = parser.parse_args()
+
+    dict_files = args.dicts or [MAIN_DICT_FILE]
+    missing = [path for path in args.corpus + dict_files if not os.path.exists(path)]
+    if missing:
+        parser.error(f"文件不存在: {', '.join(missing)}")
+
+    ok = count_corpus_phrases(args.corpus, dict_files, args.output, args.min_count, args.min_length,
+                              args.workers, args.record_dir, args.progress)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n程序被用户中断")
+        sys.exit(1)
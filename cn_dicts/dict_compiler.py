@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+部署前词库编译工具
+流式读取主词库（如 wubi.dict.yaml）及其import_tables导入的全部码表，合并为一个按编码排序、
+去除重复词条的码表，写入暂存目录（默认 cn_dicts/compiled/）。编译结果保留主词库的name、去掉import_tables，
+复制到用户目录覆盖主词库后重新部署，rime_deployer只需编译这一个码表；恢复原主词库即改回导入链。
+同一词条（文字和编码都相同）出现多次时按指定策略保留一条；文字为空、编码含有方案无法输入的字符的
+失效词条被剔除。丢弃的每一条都写入编译报告，各阶段耗时写入报告旁的 .metrics.json
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import itertools
+import tempfile
+from typing import List, Tuple, Optional, Iterable, Iterator, Set
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from run_report import (RunMetrics, RowLog, session_metrics, progress_enabled,  # noqa: E402
+                        VERBOSITY_QUIET, VERBOSITY_NORMAL, VERBOSITY_VERBOSE)
+from table_io import JOIN_MEMORY_LIMIT, external_sort, write_file_atomically  # noqa: E402
+
+# 默认编译的主词库（位于cn_dicts的上一级目录）
+MAIN_DICT_FILE = os.path.join(os.path.dirname(SCRIPT_DIR), "wubi.dict.yaml")
+# 编译结果的暂存目录，文件名与主词库相同；不使用Rime自己写入编译产物的 build/ 目录
+COMPILED_DIR = os.path.join(SCRIPT_DIR, "compiled")
+# 编译报告文件名为 <词库名>加此后缀
+REPORT_SUFFIX = ".compile_report.txt"
+
+# 码表未声明columns时Rime使用的列
+DEFAULT_COLUMNS = ["text", "code", "weight"]
+# 编译时保留的列，其余列（如附加注释）不写入编译结果
+KNOWN_COLUMNS = ("text", "code", "weight", "stem")
+
+# 重复词条的处理策略：max 保留权重最大的（相同时取先出现的），first 保留最先出现的（主词库、按import_tables顺序），
+# last 保留最后出现的
+DUPLICATE_POLICIES = ("max", "first", "last")
+DEFAULT_POLICY = "max"
+
+# 外部排序记录中各字段的分隔符（ASCII单元分隔符，不会出现在码表的单元格中）
+FIELD_SEP = "\x1f"
+
+
+class DictHeader:
+    """Rime词库文件头（'...'之前的部分）中编译需要的信息"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lines: List[str] = []
+        self.name = os.path.basename(file_path).split('.dict.yaml')[0]
+        self.sort = "by_weight"
+        self.columns: Optional[List[str]] = None
+        self.import_tables: List[str] = []
+        # 数据行之前的行数（含'...'），没有'...'时为None
+        self.data_start: Optional[int] = None
+
+    @property
+    def data_columns(self) -> List[str]:
+        return self.columns or DEFAULT_COLUMNS
+
+
+def read_dict_header(file_path: str) -> DictHeader:
+    """
+    读取词库文件头：name、sort、columns和import_tables
+    只处理Rime词库用到的简单YAML（顶层的 key: value 和其下的 - 列表项），行内 # 之后为注释
+    """
+    header = DictHeader(file_path)
+    current_key = None
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f):
+            header.lines.append(line)
+            if line.strip() == '...':
+                header.data_start = line_num + 1
+                break
+
+            content = line.split('#', 1)[0].rstrip()
+            if not content.strip() or content.strip() == '---':
+                continue
+            if not content[0].isspace():
+                key, _, value = content.partition(':')
+                current_key = key.strip()
+                value = value.strip().strip('"\'')
+                if current_key == "name" and value:
+                    header.name = value
+                elif current_key == "sort" and value:
+                    header.sort = value
+                elif current_key == "columns":
+                    header.columns = []
+                continue
+
+            item = content.strip()
+            if not item.startswith('- '):
+                continue
+            item = item[2:].strip().strip('"\'')
+            if current_key == "columns":
+                header.columns.append(item)
+            elif current_key == "import_tables":
+                header.import_tables.append(item)
+    return header
+
+
+def _yaml_scalar(value: str) -> str:
+    """取出YAML标量的值：去掉引号，未加引号时去掉行尾注释"""
+    value = value.strip()
+    if value[:1] in ('"', "'"):
+        end = value.find(value[0], 1)
+        return value[1:end] if end > 0 else value[1:]
+    return value.split(' #', 1)[0].strip()
+
+
+def read_schema_alphabet(schema_file: str) -> Optional[Set[str]]:
+    """
+    读取输入方案speller中的alphabet和delimiter，返回编码中允许出现的字符（另加空格）
+    方案文件不存在或未设置alphabet时返回None（不检查编码）
+    """
+    if not os.path.exists(schema_file):
+        return None
+
+    alphabet = None
+    delimiter = ""
+    in_speller = False
+    try:
+        with open(schema_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip() or line.lstrip().startswith('#'):
+                    continue
+                if not line[0].isspace():
+                    in_speller = line.startswith('speller:')
+                    continue
+                if not in_speller:
+                    continue
+                key, _, value = line.strip().partition(':')
+                if key == "alphabet":
+                    alphabet = _yaml_scalar(value)
+                elif key == "delimiter":
+                    delimiter = _yaml_scalar(value)
+    except Exception as e:
+        print(f"读取输入方案 {schema_file} 时出错: {e}")
+        return None
+
+    if not alphabet:
+        return None
+    return set(alphabet) | set(delimiter) | {' '}
+
+
+def _weight_value(weight: str) -> float:
+    """权重的数值，用于比较和排序；没有权重或不是数字（如百分比）时视为最小"""
+    try:
+        return float(weight)
+    except ValueError:
+        return float('-inf')
+
+
+class TableStats:
+    """一个码表的编译统计"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.name = os.path.basename(file_path)
+        self.size = 0
+        self.rows = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.missing = False
+
+    @property
+    def kept(self) -> int:
+        return self.rows - self.invalid - self.duplicates
+
+
+class CompileResult:
+    """一次编译的结果"""
+
+    def __init__(self, header: DictHeader, output_file: str, policy: str):
+        self.header = header
+        self.output_file = output_file
+        self.policy = policy
+        self.tables: List[TableStats] = []
+        self.output_rows = 0
+        self.output_size = 0
+
+    @property
+    def input_rows(self) -> int:
+        return sum(table.rows for table in self.tables)
+
+    @property
+    def input_size(self) -> int:
+        return sum(table.size for table in self.tables)
+
+
+def iter_table_entries(
+    file_path: str,
+    columns: List[str],
+    start_line: Optional[int] = None
+) -> Iterator[Tuple[int, str, str, str, str]]:
+    """
+    流式读取码表的数据行，产出 (行号, 文字, 编码, 权重, 造词码)，行号从1开始
+    start_line为数据行之前的行数（已由read_dict_header得到），为None时在此查找'...'
+    空行和以#开头的注释行被跳过；码表没有的列为空字符串
+    """
+    positions = [(name, columns.index(name)) for name in KNOWN_COLUMNS if name in columns]
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if start_line is None:
+            start_line = 0
+            for line in f:
+                start_line += 1
+                if line.strip() == '...':
+                    break
+            else:
+                return
+        else:
+            for _ in itertools.islice(f, start_line):
+                pass
+
+        for line_num, line in enumerate(f, start_line + 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.split('\t')
+            fields = {name: parts[index].strip() if index < len(parts) else "" for name, index in positions}
+            yield (line_num, fields.get("text", ""), fields.get("code", ""),
+                   fields.get("weight", ""), fields.get("stem", ""))
+
+
+def _dead_entry_reason(text: str, code: str, alphabet: Optional[Set[str]]) -> Optional[str]:
+    """失效词条的原因，正常词条返回None"""
+    if not text:
+        return "文字为空"
+    if alphabet is not None and any(char not in alphabet for char in code):
+        return "编码含有方案无法输入的字符"
+    return None
+
+
+def compile_dictionary(
+    main_dict: str,
+    output_file: Optional[str] = None,
+    policy: str = DEFAULT_POLICY,
+    schema_file: Optional[str] = None,
+    prune: bool = True,
+    memory_limit: int = JOIN_MEMORY_LIMIT,
+    verbosity: int = VERBOSITY_NORMAL,
+    show_progress: bool = False
+) -> Optional[CompileResult]:
+    """
+    编译主词库：合并主词库及其导入的码表，去重、剔除失效词条并排序后写入output_file
+    未指定output_file时写入COMPILED_DIR，未指定schema_file时使用主词库旁的 <词库名>.schema.yaml
+    编译报告（丢弃词条的明细）和运行统计写在输出文件旁；编译失败时返回None
+    """
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"未知的重复词条处理策略: {policy}")
+
+    header = read_dict_header(main_dict)
+    if header.data_start is None:
+        print(f"错误: 词库 {main_dict} 中没有'...'，无法确定数据行的位置")
+        return None
+
+    dict_dir = os.path.dirname(os.path.abspath(main_dict))
+    if output_file is None:
+        output_file = os.path.join(COMPILED_DIR, os.path.basename(main_dict))
+    if os.path.abspath(output_file) == os.path.abspath(main_dict):
+        print("错误: 输出文件不能是主词库本身")
+        return None
+    if schema_file is None:
+        schema_file = os.path.join(dict_dir, f"{header.name}.schema.yaml")
+    alphabet = read_schema_alphabet(schema_file) if prune else None
+
+    result = CompileResult(header, output_file, policy)
+    metrics = RunMetrics("compile_dictionary", progress=progress_enabled(verbosity, show_progress))
+    log = RowLog(verbosity)
+
+    # 主词库自身的数据行排在最前，之后按import_tables的顺序
+    sources: List[Tuple[str, List[str], Optional[int]]] = [(main_dict, header.data_columns, header.data_start)]
+    for table in header.import_tables:
+        sources.append((os.path.join(dict_dir, table + ".dict.yaml"), [], None))
+
+    print(f"\n正在编译词库: {main_dict}")
+    print(f"重复词条处理策略: {policy}")
+    if alphabet is None and prune:
+        print(f"未找到输入方案 {schema_file} 的字母表，不检查编码")
+
+    def records() -> Iterator[Tuple[str, int, str]]:
+        """逐个码表流式读取，产出外部排序记录 (编码+文字, 序号, 权重+造词码+码表+行号)"""
+        seq = 0
+        for table_index, (file_path, columns, start_line) in enumerate(sources):
+            stats = TableStats(file_path)
+            result.tables.append(stats)
+            if not os.path.exists(file_path):
+                stats.missing = True
+                print(f"警告: 导入的码表 {file_path} 不存在，已跳过")
+                continue
+            if table_index > 0:
+                with metrics.stage("parse"):
+                    table_header = read_dict_header(file_path)
+                columns, start_line = table_header.data_columns, table_header.data_start
+                if start_line is None:
+                    print(f"警告: 码表 {file_path} 中没有'...'，已跳过")
+                    continue
+            stats.size = os.path.getsize(file_path)
+
+            entries = metrics.timed_iter(iter_table_entries(file_path, columns, start_line), "parse", count_rows=True)
+            for line_num, text, code, weight, stem in entries:
+                stats.rows += 1
+                reason = _dead_entry_reason(text, code, alphabet) if prune else None
+                if reason is not None:
+                    stats.invalid += 1
+                    log.add(reason, f"{stats.name}:{line_num}: {text}\t{code}\t{weight}")
+                    continue
+                yield (f"{code}{FIELD_SEP}{text}", seq,
+                       FIELD_SEP.join((weight, stem, str(table_index), str(line_num))))
+                seq += 1
+
+    def merged_entries(sorted_records: Iterable[Tuple[str, int, str]]) -> Iterator[Tuple[str, str, int, list]]:
+        """按 (编码, 文字) 分组，按策略保留一条，产出 (编码, 文字, 序号, [权重, 造词码, 码表, 行号])"""
+        for key, group in itertools.groupby(sorted_records, key=lambda record: record[0]):
+            code, text = key.split(FIELD_SEP)
+            entries = [(seq, value.split(FIELD_SEP)) for _, seq, value in group]
+            if len(entries) == 1:
+                kept = entries[0]
+            elif policy == "first":
+                kept = entries[0]
+            elif policy == "last":
+                kept = entries[-1]
+            else:
+                kept = max(entries, key=lambda entry: (_weight_value(entry[1][0]), -entry[0]))
+
+            for entry in entries:
+                if entry is kept:
+                    continue
+                weight, _, table_index, line_num = entry[1]
+                stats = result.tables[int(table_index)]
+                stats.duplicates += 1
+                log.add("重复词条",
+                        f"{stats.name}:{line_num}: {text}\t{code}\t{weight}"
+                        f"（保留 {result.tables[int(kept[1][2])].name}:{kept[1][3]}，权重 {kept[1][0]}）")
+            yield code, text, kept[0], kept[1]
+
+    def output_lines(sorted_records: Iterable[Tuple[str, int, str]]) -> Iterator[str]:
+        yield f"# 由 dict_compiler.py 编译生成（{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}），请勿手动修改\n"
+        imported = sum(1 for file_path, _, _ in sources[1:] if os.path.exists(file_path))
+        yield f"# 已合并 {os.path.basename(main_dict)} 及其导入的 {imported} 个码表\n"
+        yield from _compiled_header_lines(header.lines)
+
+        columns = [name for name in header.data_columns if name in KNOWN_COLUMNS]
+        by_weight = header.sort != "original"
+        # 同一编码的词条在内存中按Rime的排序方式排好：by_weight按权重从大到小，original按出现顺序
+        for code, group in itertools.groupby(merged_entries(sorted_records), key=lambda entry: entry[0]):
+            entries = list(group)
+            if by_weight:
+                entries.sort(key=lambda entry: (-_weight_value(entry[3][0]), entry[2]))
+            else:
+                entries.sort(key=lambda entry: entry[2])
+            for _, text, _, (weight, stem, _, _) in entries:
+                fields = {"text": text, "code": code, "weight": weight, "stem": stem}
+                yield '\t'.join([fields[name] for name in columns]).rstrip('\t') + '\n'
+                result.output_rows += 1
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="dict_compiler_") as tmp_dir, metrics.stage("write"):
+            sorted_records = metrics.timed_iter(external_sort(records(), tmp_dir, memory_limit), "index_build")
+            write_file_atomically(output_file, output_lines(sorted_records))
+    except Exception as e:
+        print(f"编译词库时发生错误: {str(e)}")
+        log.close()
+        return None
+    finally:
+        metrics.finish_progress()
+
+    result.output_size = os.path.getsize(output_file)
+    for stats in result.tables:
+        if not stats.missing:
+            print(f"  {stats.name}: {stats.rows} 行，保留 {stats.kept} 行")
+    print(f"编译结果: {result.input_rows} 行 → {result.output_rows} 行，"
+          f"{result.input_size / 1024:.0f} KB → {result.output_size / 1024:.0f} KB")
+    print(f"已写入: {output_file}")
+    print(f"使用编译结果: 备份 {main_dict} 后用编译结果覆盖它，再重新部署")
+    log.summary("丢弃的词条")
+
+    report_file = os.path.join(os.path.dirname(os.path.abspath(output_file)), header.name + REPORT_SUFFIX)
+    with metrics.stage("record"):
+        written = write_compile_report(report_file, result, log)
+    log.close()
+    if written:
+        print(f"编译报告已保存到: {report_file}")
+        metrics.count("input_rows", result.input_rows)
+        metrics.count("output_rows", result.output_rows)
+        metrics.count("duplicates", sum(stats.duplicates for stats in result.tables))
+        metrics.count("invalid", sum(stats.invalid for stats in result.tables))
+        metrics_file = metrics.write(report_file, session_metrics())
+        if metrics_file:
+            print(f"运行统计已保存到: {metrics_file}")
+    return result
+
+
+def _compiled_header_lines(lines: List[str]) -> Iterator[str]:
+    """
+    主词库的文件头去掉import_tables（其中的码表已合并进来），其余原样保留
+    import_tables之后到下一个键之前的注释行（注释掉的码表）一并去掉
+    """
+    in_import_tables = False
+    for line in lines:
+        content = line.split('#', 1)[0].rstrip()
+        if content.strip() and not content[0].isspace():
+            in_import_tables = content.startswith('import_tables:')
+        if in_import_tables:
+            continue
+        yield line
+
+
+def write_compile_report(report_file: str, result: CompileResult, log: RowLog) -> bool:
+    """写编译报告：各码表的统计和丢弃词条的明细，返回是否写入成功"""
+    try:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            f.write(f"# 词库编译报告 - {datetime.datetime.now().strftime('%Y%m%d%H%M%S')}\n")
+            f.write("*" * 30 + "\n\n")
+
+            f.write(f"## 词库: {os.path.basename(result.header.file_path)}\n")
+            f.write("-" * 40 + "\n")
+            f.write(f"输出文件: {result.output_file}\n")
+            f.write(f"重复词条处理策略: {result.policy}\n")
+            f.write(f"排序方式: {result.header.sort}\n")
+            f.write(f"输入: {result.input_rows} 行，{result.input_size} 字节\n")
+            f.write(f"输出: {result.output_rows} 行，{result.output_size} 字节\n\n")
+
+            f.write("码表\t行数\t重复\t失效\t保留\n")
+            for stats in result.tables:
+                if stats.missing:
+                    f.write(f"{stats.name}\t不存在\n")
+                else:
+                    f.write(f"{stats.name}\t{stats.rows}\t{stats.duplicates}\t{stats.invalid}\t{stats.kept}\n")
+
+            f.write("\n" + "*" * 30 + "\n\n")
+
+            f.write("## 丢弃的词条\n")
+            f.write("-" * 40 + "\n")
+            if log:
+                f.write(f"共 {len(log)} 条:\n\n")
+                for kind, message in log.details():
+                    f.write(f"[{kind}] {message}\n")
+            else:
+                f.write("没有丢弃任何词条。\n")
+        return True
+
+    except Exception as e:
+        print(f"写入编译报告时发生错误: {str(e)}")
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="合并主词库及其import_tables导入的码表，去重、剔除失效词条并排序，供rime_deployer编译")
+    parser.add_argument("dicts", nargs="*", default=[MAIN_DICT_FILE],
+                        help="主词库文件（默认 ../wubi.dict.yaml）")
+    parser.add_argument("-o", "--output",
+                        help="输出文件，只能与一个主词库一起使用（默认写入 cn_dicts/compiled/）")
+    parser.add_argument("-p", "--policy", choices=DUPLICATE_POLICIES, default=DEFAULT_POLICY,
+                        help="重复词条的处理策略：max 保留权重最大的（默认），first 保留最先出现的，last 保留最后出现的")
+    parser.add_argument("--schema",
+                        help="检查编码时使用的输入方案文件（默认主词库旁的 <词库名>.schema.yaml）")
+    parser.add_argument("--no-prune", action="store_true",
+                        help="只去除重复词条，保留文字为空或编码无法输入的失效词条")
+    parser.add_argument("--memory-limit", type=int, default=JOIN_MEMORY_LIMIT // (1024 * 1024), metavar="MB",
+                        help=f"排序时使用的内存上限，超过后使用外部排序（默认: {JOIN_MEMORY_LIMIT // (1024 * 1024)} MB）")
+    parser.add_argument("--progress", action="store_true",
+                        help="总是显示进度条（默认只在终端中显示）")
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument("-q", "--quiet", action="store_true",
+                              help="安静模式：丢弃的词条只显示各类别的计数，明细写入编译报告")
+    output_group.add_argument("-v", "--verbose", action="store_true",
+                              help="详细模式：逐条打印丢弃的词条（不显示进度条）")
+    args = parser.parse_args()
+
+    if args.output and len(args.dicts) > 1:
+        parser.error("--output 只能与一个主词库一起使用")
+    verbosity = VERBOSITY_QUIET if args.quiet else VERBOSITY_VERBOSE if args.verbose else VERBOSITY_NORMAL
+
+    failed = []
+    for main_dict in args.dicts:
+        if not os.path.exists(main_dict):
+            print(f"错误: 主词库 '{main_dict}' 不存在")
+            failed.append(main_dict)
+            continue
+        result = compile_dictionary(main_dict, args.output, args.policy, args.schema, not args.no_prune,
+                                    args.memory_limit * 1024 * 1024, verbosity, args.progress)
+        if result is None:
+            failed.append(main_dict)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n程序被用户中断")
+        sys.exit(1)
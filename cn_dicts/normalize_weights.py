@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+词库权重归一化工具
+各词库的权重尺度不同（如 zi.dict.yaml 约为 1~900，wubi.phrase.dict.yaml、renming.dict.yaml 的分布又各不相同），
+导入同一方案后跨词库的候选排序会被尺度差异左右。本工具读取各词库的权重列，计算每个词库的分位数，
+按分位数把权重映射到共同的尺度上：词库内的先后顺序不变，同一分位的词条在各词库中得到相同的权重。
+默认按导入关系分组：每个顶层词库（如 wubi.dict.yaml）与其import_tables导入的码表为一组，只在组内归一化，
+不同输入方案的词库互不影响。共同尺度默认为组内各词库分位数曲线的逐点中位数（每个词库同等对待），也可以指定一个参考词库。
+列类型识别和权重替换与 replace_weight.py 相同（共用 table_io.py），写入前原文件存入备份库，可用 replace_weight.py --restore 恢复。
+安装了NumPy时使用向量化计算，否则使用较慢的纯Python实现，结果相同
+"""
+
+import os
+import sys
+import glob
+import bisect
+import statistics
+import argparse
+import datetime
+import itertools
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from run_report import (RunMetrics, RowLog, session_metrics, progress_enabled,  # noqa: E402
+                        VERBOSITY_QUIET, VERBOSITY_NORMAL, VERBOSITY_VERBOSE)
+from table_io import (RECORD_DIR, scan_file_layout, iter_file_rows, iter_valid_rows,  # noqa: E402
+                      stream_data_rows, substitute_weights, SubstitutionResult,
+                      write_file_atomically, backup_original_file)
+from dict_compiler import MAIN_DICT_FILE, read_dict_header  # noqa: E402
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 顶层词库（输入方案直接使用的词库）所在的目录，import_tables中的路径相对于此目录
+DICT_ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+# 分位数曲线的采样点数：在 [0, 1] 上等间隔取这么多个分位
+QUANTILE_POINTS = 1001
+# 终端和记录中展示的分位
+REPORT_QUANTILES = (0.1, 0.5, 0.9, 1.0)
+
+
+class FileWeights:
+    """一个词库的权重列：有效数据行的序号和整数权重，按行的先后顺序"""
+
+    def __init__(self, file_path: str, header_line_count: int, column_types: Dict[int, str], log: RowLog):
+        self.file_path = file_path
+        self.name = os.path.basename(file_path)
+        self.header_line_count = header_line_count
+        self.column_types = column_types
+        self.log = log
+        self.indices = array('q')
+        self.weights = array('q')
+        self.new_weights: Optional[Sequence[int]] = None
+        self.curve: Optional[Sequence[float]] = None
+        self.result = SubstitutionResult()
+        self.backup_digest: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+
+def collect_weights(file_path: str, metrics: RunMetrics, log: RowLog) -> FileWeights:
+    """
+    按replace_weight.py的列类型识别读取词库的权重列
+    只收集权重为整数的数据行；权重为空或无法确定权重列的行记入log，归一化时保持原样
+    """
+    header_line_count, column_types = scan_file_layout(file_path)
+    weights = FileWeights(file_path, header_line_count, column_types, log)
+    rows = metrics.timed_iter(iter_file_rows(file_path, header_line_count), "parse", count_rows=True)
+    for line_num, _, _, weight in iter_valid_rows(rows, column_types, log):
+        if weight.isdecimal():
+            weights.indices.append(line_num - header_line_count)
+            weights.weights.append(int(weight))
+    return weights
+
+
+def quantile_grid(points: int = QUANTILE_POINTS) -> List[float]:
+    """[0, 1] 上等间隔的points个分位"""
+    return [i / (points - 1) for i in range(points)]
+
+
+def quantile_curve(weights: Sequence[int], points: int = QUANTILE_POINTS) -> Sequence[float]:
+    """权重在等间隔分位上的取值（线性插值，与numpy.quantile的默认方法相同）"""
+    if np is not None:
+        return np.quantile(np.asarray(weights, dtype=np.int64), np.linspace(0.0, 1.0, points))
+
+    ordered = sorted(weights)
+    last = len(ordered) - 1
+    curve = []
+    for q in quantile_grid(points):
+        position = q * last
+        lower = int(position)
+        upper = min(lower + 1, last)
+        curve.append(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower))
+    return curve
+
+
+def common_curve(curves: List[Sequence[float]]) -> Sequence[float]:
+    """各词库分位数曲线的逐点中位数，作为共同尺度（个别词库的极端权重不会拉高整体尺度）"""
+    if np is not None:
+        return np.median(np.vstack(curves), axis=0)
+    return [statistics.median(values) for values in zip(*curves)]
+
+
+def remap_weights(weights: Sequence[int], reference: Sequence[float]) -> Sequence[int]:
+    """
+    把权重按其在本词库中的分位映射到参考分位数曲线上
+    同一权重的词条取其所占分位区间的中点，映射后仍为同一权重；权重越大映射结果越大（或相等）
+    """
+    if np is not None:
+        values = np.asarray(weights, dtype=np.int64)
+        distinct, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+        midpoints = (np.cumsum(counts) - counts / 2) / len(values)
+        mapped = np.rint(np.interp(midpoints, np.linspace(0.0, 1.0, len(reference)), reference))
+        return mapped.astype(np.int64)[inverse]
+
+    total = len(weights)
+    counts: Dict[int, int] = {}
+    for weight in weights:
+        counts[weight] = counts.get(weight, 0) + 1
+    grid = quantile_grid(len(reference))
+    mapping: Dict[int, int] = {}
+    seen = 0
+    for weight in sorted(counts):
+        midpoint = (seen + counts[weight] / 2) / total
+        seen += counts[weight]
+        upper = min(bisect.bisect_right(grid, midpoint), len(grid) - 1)
+        lower = upper - 1
+        fraction = (midpoint - grid[lower]) / (grid[upper] - grid[lower])
+        mapping[weight] = round(reference[lower] + (reference[upper] - reference[lower]) * fraction)
+    return [mapping[weight] for weight in weights]
+
+
+def _quantile_summary(curve: Sequence[float]) -> str:
+    """分位数曲线中REPORT_QUANTILES各分位的取值，如 'p10=3 p50=120 p90=800 max=999'"""
+    last = len(curve) - 1
+    labels = ("max" if q == 1.0 else f"p{round(q * 100)}" for q in REPORT_QUANTILES)
+    return " ".join(f"{label}={round(float(curve[round(q * last)]))}" for label, q in zip(labels, REPORT_QUANTILES))
+
+
+def _write_file_weights(weights: FileWeights, record_dir: str, timestamp: str, metrics: RunMetrics) -> bool:
+    """把映射后的权重写回词库：逐行替换权重列后原子替换原文件，替换前原文件存入备份库"""
+    new_weights = dict(zip(weights.indices, (str(weight) for weight in weights.new_weights)))
+    # 收集权重时已记录过警告，写入时的警告不再重复
+    rewrite_log = RowLog(VERBOSITY_QUIET)
+
+    def output_lines():
+        with open(weights.file_path, 'r', encoding='utf-8') as f:
+            yield from itertools.islice(f, weights.header_line_count)
+            rows = stream_data_rows(f, weights.header_line_count)
+            yield from substitute_weights(rows, weights.column_types, lambda index, phrase: new_weights.get(index),
+                                          weights.name, weights.result, rewrite_log)
+
+    def before_commit() -> bool:
+        if not weights.result.updated_count:
+            return False
+        with metrics.stage("record"):
+            weights.backup_digest, _ = backup_original_file(record_dir, weights.file_path, timestamp)
+        if weights.backup_digest is None:
+            print(f"错误: {weights.name} 未能存入备份库，不覆盖原文件")
+            return False
+        return True
+
+    try:
+        with metrics.stage("write"):
+            return write_file_atomically(weights.file_path, output_lines(), before_commit)
+    except Exception as e:
+        print(f"写入文件 {weights.file_path} 时发生错误: {str(e)}")
+        return False
+    finally:
+        rewrite_log.close()
+
+
+def write_normalize_record(record_file: str, timestamp: str, reference_name: str,
+                           files: List[FileWeights], written: List[FileWeights]) -> bool:
+    """写入归一化记录：各词库映射前后的分位数、替换行数和备份库中的原文件版本"""
+    try:
+        with open(record_file, 'w', encoding='utf-8') as f:
+            f.write(f"# 权重归一化记录 - {timestamp}\n")
+            f.write(f"# 共同尺度: {reference_name}\n")
+            f.write(f"# 计算方式: {'NumPy' if np is not None else '纯Python'}\n")
+            f.write("*" * 30 + "\n\n")
+            for weights in files:
+                f.write(f"## 文件: {weights.name}\n")
+                f.write("-" * 40 + "\n")
+                f.write(f"有效权重: {len(weights)} 行\n")
+                f.write(f"映射前: {_quantile_summary(weights.curve)}\n")
+                if weights.new_weights is not None:
+                    f.write(f"映射后: {_quantile_summary(quantile_curve(weights.new_weights))}\n")
+                f.write(f"替换行数: {weights.result.updated_count}\n")
+                if weights in written:
+                    f.write(f"原文件已保存到备份库: {weights.backup_digest}\n")
+                    f.write(f"恢复命令: python replace_weight.py --restore {weights.backup_digest[:12]} "
+                            f"--record-dir \"{os.path.dirname(record_file)}\"\n")
+                if weights.log:
+                    f.write(f"警告: 共 {len(weights.log)} 条\n")
+                    for kind, message in weights.log.details():
+                        f.write(f"[{kind}] {message}\n")
+                f.write("\n")
+        return True
+    except Exception as e:
+        print(f"写入归一化记录时发生错误: {str(e)}")
+        return False
+
+
+def normalize_weights(
+    files: List[str],
+    reference_file: Optional[str] = None,
+    dry_run: bool = False,
+    record_dir: str = RECORD_DIR,
+    verbosity: int = VERBOSITY_NORMAL,
+    show_progress: bool = False,
+    group: str = ""
+) -> bool:
+    """
+    把各词库的权重按分位数映射到共同尺度并写回
+    reference_file为None时共同尺度为各词库分位数曲线的逐点中位数，否则为该词库（须在files中）的分位数曲线
+    group为词库组的名称，用于区分同一次运行中各组的记录文件
+    dry_run为True时只打印映射前后的分位数，不修改文件
+    """
+    metrics = RunMetrics("normalize_weights", progress=progress_enabled(verbosity, show_progress))
+    if np is None:
+        print("提示: 未安装numpy，使用纯Python计算（较慢），可运行 pip install numpy 安装")
+
+    # 读取各词库的权重列
+    collected: List[FileWeights] = []
+    for file_path in files:
+        print(f"\n正在读取: {file_path}")
+        log = RowLog(verbosity)
+        try:
+            weights = collect_weights(file_path, metrics, log)
+        except Exception as e:
+            print(f"读取文件 {file_path} 时发生错误: {str(e)}")
+            log.close()
+            continue
+        log.summary(f"{os.path.basename(file_path)}中的警告")
+        if not weights:
+            print(f"警告: {file_path} 中没有整数权重，已跳过")
+            log.close()
+            continue
+        collected.append(weights)
+    metrics.finish_progress()
+    if not collected:
+        print("错误: 没有可以归一化的词库")
+        return False
+    if len(collected) == 1 and reference_file is None:
+        print(f"只有 {collected[0].name} 有整数权重，无需归一化")
+        collected[0].log.close()
+        return True
+
+    # 计算各词库的分位数曲线和共同尺度，再映射每个词库的权重
+    with metrics.stage("index_build"):
+        for weights in collected:
+            weights.curve = quantile_curve(weights.weights)
+        if reference_file is not None:
+            matches = [weights for weights in collected
+                       if os.path.abspath(weights.file_path) == os.path.abspath(reference_file)]
+            if not matches:
+                print(f"错误: 参考词库 {reference_file} 不在要归一化的词库中或没有整数权重")
+                return False
+            reference = matches[0].curve
+            reference_name = f"参考词库 {matches[0].name} 的分位数"
+        else:
+            reference = common_curve([weights.curve for weights in collected])
+            reference_name = f"{len(collected)} 个词库分位数的中位数"
+    with metrics.stage("substitute"):
+        for weights in collected:
+            weights.new_weights = remap_weights(weights.weights, reference)
+
+    print(f"\n共同尺度（{reference_name}）: {_quantile_summary(reference)}")
+    for weights in collected:
+        mapped = _quantile_summary(quantile_curve(weights.new_weights))
+        print(f"  {weights.name}: {len(weights)} 行  {_quantile_summary(weights.curve)}  →  {mapped}")
+
+    if dry_run:
+        print("\n试运行，未修改任何文件")
+        for weights in collected:
+            weights.log.close()
+        return True
+
+    # 写回各词库
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    written = []
+    failed = []
+    for weights in collected:
+        if _write_file_weights(weights, record_dir, timestamp, metrics):
+            written.append(weights)
+            print(f"已更新 {weights.name}: 替换了 {weights.result.updated_count} 行")
+        elif weights.result.updated_count:
+            failed.append(weights)
+        else:
+            print(f"{weights.name} 的权重无需修改")
+
+    os.makedirs(record_dir, exist_ok=True)
+    record_name = f"normalize_weights_{group}_log_{timestamp}.txt" if group else f"normalize_weights_log_{timestamp}.txt"
+    record_file = os.path.join(record_dir, record_name)
+    with metrics.stage("record"):
+        recorded = write_normalize_record(record_file, timestamp, reference_name, collected, written)
+    if recorded:
+        print(f"归一化记录已保存到: {record_file}")
+        metrics.count("files", len(collected))
+        metrics.count("updated", sum(weights.result.updated_count for weights in collected))
+        metrics.count("warnings", sum(len(weights.log) for weights in collected))
+        metrics.count("numpy", int(np is not None))
+        metrics_file = metrics.write(record_file, session_metrics())
+        if metrics_file:
+            print(f"运行统计已保存到: {metrics_file}")
+    for weights in collected:
+        weights.log.close()
+    return not failed
+
+
+def dictionary_groups(root_dir: str = DICT_ROOT_DIR) -> List[Tuple[str, List[str]]]:
+    """
+    按导入关系把词库分组：root_dir下的每个顶层词库与其import_tables导入的码表为一组，返回 [(组名, 词库文件列表)]
+    被多个顶层词库导入的码表只归入最先导入它的组（主词库的组最先），不存在的码表被跳过
+    """
+    main_dict = os.path.abspath(MAIN_DICT_FILE)
+    top_level = sorted(glob.glob(os.path.join(root_dir, "*.dict.yaml")),
+                       key=lambda file_path: (os.path.abspath(file_path) != main_dict, file_path))
+    owners: Dict[str, str] = {}
+    groups = []
+    for dict_file in top_level:
+        header = read_dict_header(dict_file)
+        members = [dict_file]
+        for table in header.import_tables:
+            table_file = os.path.abspath(os.path.join(root_dir, table + ".dict.yaml"))
+            if table_file in owners:
+                print(f"提示: {table} 同时被 {owners[table_file]} 和 {header.name} 导入，归入 {owners[table_file]} 组")
+            elif os.path.exists(table_file):
+                owners[table_file] = header.name
+                members.append(table_file)
+        groups.append((header.name, members))
+    return groups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="按分位数把多个词库的权重映射到共同尺度，使跨词库的候选排序不受各词库权重尺度的影响")
+    parser.add_argument("dicts", nargs="*",
+                        help="要归一化的词库文件，作为一组归一化（默认按导入关系分组：每个顶层词库与其导入的码表为一组）")
+    parser.add_argument("--reference", metavar="DICT",
+                        help="以此词库的权重分布为其所在组的共同尺度（须是要归一化的词库之一；默认取组内各词库分位数的中位数）")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="只打印各词库映射前后的分位数，不修改文件")
+    parser.add_argument("--record-dir", default=RECORD_DIR,
+                        help=f"记录文件和备份库的目录（默认: {RECORD_DIR}）")
+    parser.add_argument("--progress", action="store_true",
+                        help="总是显示进度条（默认只在终端中显示）")
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument("-q", "--quiet", action="store_true",
+                              help="安静模式：读取时的警告只显示各类别的计数，明细写入归一化记录")
+    output_group.add_argument("-v", "--verbose", action="store_true",
+                              help="详细模式：逐条打印读取时的警告（不显示进度条）")
+    args = parser.parse_args()
+
+    verbosity = VERBOSITY_QUIET if args.quiet else VERBOSITY_VERBOSE if args.verbose else VERBOSITY_NORMAL
+    if args.dicts:
+        missing = [file_path for file_path in args.dicts if not os.path.exists(file_path)]
+        if missing:
+            parser.error(f"词库文件不存在: {', '.join(missing)}")
+        groups = [("", args.dicts)]
+    else:
+        groups = dictionary_groups()
+    if args.reference is not None and not any(
+            os.path.abspath(args.reference) in map(os.path.abspath, files) for _, files in groups):
+        parser.error(f"参考词库 {args.reference} 不在要归一化的词库中")
+
+    failed = []
+    for group, files in groups:
+        if group:
+            print(f"\n===== 词库组: {group}（{len(files)} 个词库） =====")
+        reference = args.reference if args.reference is not None and os.path.abspath(args.reference) in map(
+            os.path.abspath, files) else None
+        if not normalize_weights(files, reference, args.dry_run, args.record_dir, verbosity, args.progress, group):
+            failed.append(group)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n程序被用户中断")
+        sys.exit(1)
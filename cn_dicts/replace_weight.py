@@ -1,191 +1,312 @@
 import os
+import sys
+import io
+import glob
 import datetime
-import re
-from typing import Dict, List, Tuple, Optional
-
-
-def detect_column_types(data_lines: List[Tuple[int, str, str]]) -> Dict[int, str]:
+import shutil
+import tempfile
+import itertools
+import heapq
+import zlib
+import marshal
+import hashlib
+import argparse
+import atexit
+import contextlib
+import multiprocessing
+from array import array
+from typing import Dict, List, Set, Tuple, Optional, Iterable, Iterator, Callable
+
+from run_report import (RunMetrics, RowLog, session_metrics, progress_enabled,
+                        VERBOSITY_QUIET, VERBOSITY_NORMAL, VERBOSITY_VERBOSE)
+from table_io import (RECORD_DIR, BACKUP_STORE_DIR, BACKUP_CHUNK_SIZE, COLUMN_SAMPLE_SIZE, JOIN_MEMORY_LIMIT,
+                      BackupStore, SubstitutionResult, tokenize_line, sample_evenly, parse_header_columns,
+                      detect_column_types, column_types_from_cells, resolve_row, iter_valid_rows, scan_file_layout,
+                      stream_data_rows, iter_file_rows, substitute_weights, backup_original_file,
+                      write_file_atomically, external_sort)
+
+# 默认基础文件
+BASE_FILE = "phrase_weight.txt"
+
+# 增量同步（--incremental）：检查点保存在基础文件同目录的此子目录中
+SYNC_STATE_DIR = ".weight_sync"
+SYNC_STATE_MAGIC = "rime-weight-sync"
+SYNC_STATE_VERSION = 1
+# 基础文件中权重有变化的词组超过此数时，目标文件不再逐行筛选，按完整方式同步
+SYNC_MAX_CHANGED_PHRASES = 5000
+
+# 连接引擎：hash 在内存中建立词组映射；external 将两侧按词组外部排序后合并连接；auto 按估算内存自动选择
+JOIN_ENGINES = ("auto", "hash", "external")
+# 内存连接时占用内存与文件大小之比的估算值（PhraseTable实测约为文件大小的15倍）
+JOIN_MEMORY_FACTOR = 16
+
+# 处理文件时总是在终端显示进度条（默认只在标准错误输出为终端时显示；各阶段耗时等统计总会写入更新记录旁的 .metrics.json），
+# 可用 --progress 打开
+SHOW_PROGRESS = False
+# 输出详细程度：逐行的警告默认按类别汇总（明细写入更新记录），-q 只显示汇总计数，-v 逐行打印
+VERBOSITY = VERBOSITY_NORMAL
+
+# PhraseTable中单元格类型的编码：每行的类型序列压缩为一个64位整数，
+# 低5位为单元格数，之后每个单元格占2位；单元格数为0表示空行，为31表示超过可压缩的列数，使用时重新分类
+CELL_TYPE_NAMES = ("unknown", "phrase", "code", "weight")
+CELL_TYPE_CODES = {name: code for code, name in enumerate(CELL_TYPE_NAMES)}
+CELL_PACK_MAX_CELLS = 29
+CELL_PACK_UNPACKED = 31
+# PhraseTable权重列的特殊值：-1 表示权重不是规范的整数写法，原字符串另存；-2 表示该行不在词组映射中
+WEIGHT_RAW = -1
+WEIGHT_NOT_INDEXED = -2
+
+
+def _report_duplicates(first_duplicates: List[Tuple[str, int]], total: int) -> None:
+    """打印重复词组：first_duplicates为按首次出现顺序的前10个 (词组, 出现次数)，total为重复词组总数"""
+    if total:
+        print(f"发现 {total} 个重复词组:")
+        for phrase, count in first_duplicates:  # 只显示前10个
+            print(f"  '{phrase}' 出现 {count} 次")
+        if total > 10:
+            print(f"  ... 还有 {total-10} 个重复词组")
+
+
+def _pack_cell_types(cell_types: List[str]) -> int:
+    """将一行的单元格类型压缩为一个整数"""
+    count = len(cell_types)
+    if count > CELL_PACK_MAX_CELLS:
+        return CELL_PACK_UNPACKED
+    code = count
+    for i, cell_type in enumerate(cell_types):
+        code |= CELL_TYPE_CODES[cell_type] << (5 + 2 * i)
+    return code
+
+
+class PhraseTable:
     """
-    根据每行的内容特征识别每行的列类型
-    返回一个字典，键为列索引，值为列类型（"phrase", "code", "weight"）
-    采用逐行分析，统计每列出现类型的频率，选择频率最高的类型
+    紧凑的码表记录存储
+    数据行按UTF-8编码连续保存在一个bytearray中，只记录每行的起始偏移，不保留行的副本；
+    每行的单元格类型、权重和同词组的下一行都保存在array列中；
+    词组映射只保存 词组（驻留字符串） -> 第一行，同一词组的其他行通过链表相连
     """
-    if not data_lines:
-        return {}
-
-    column_stats = {}
-
-    # 收集所有非空行的数据
-    for _, line_content, _ in data_lines:
-        if not line_content.strip():
-            continue
-
-        parts = line_content.split('\t')
-
-        # 识别该行每个单元格的类型
-        cell_types = []
-        for cell in parts:
-            cell = cell.strip()
-            if not cell:
-                cell_types.append("unknown")
-                continue
-
-            # 检查是否为权重（正整数）
-            if re.fullmatch(r'\d+', cell):
-                cell_types.append("weight")
-            # 检查是否为编码/拼音（全小写字母，可以有空格）
-            elif re.fullmatch(r'[a-z\s]+', cell) and re.search(r'[a-z]', cell):
-                cell_types.append("code")
-            # 其他情况都认为是词组（汉字、字母、数字、符号的组合）
-            else:
-                cell_types.append("phrase")
-
-        # 为每列统计特征
-        for i, cell_type in enumerate(cell_types):
-            if i not in column_stats:
-                column_stats[i] = {
-                    'total': 0,
-                    'phrase': 0,
-                    'code': 0,
-                    'weight': 0,
-                    'unknown': 0
-                }
-
-            column_stats[i]['total'] += 1
-            column_stats[i][cell_type] += 1
-
-    # 根据统计结果确定每列的类型
-    column_types = {}
-
-    for col_idx, stats in column_stats.items():
-        total = stats['total']
-        if total == 0:
-            continue
-
-        # 找到出现次数最多的类型
-        max_type = None
-        max_count = -1
 
-        for type_key in ('phrase', 'code', 'weight'):
-            if stats[type_key] > max_count:
-                max_count = stats[type_key]
-                max_type = type_key
-
-        # 如果最高频率的类型占总数的50%以上，就确定为此类型
-        if max_count / total >= 0.5:
-            column_types[col_idx] = max_type
-        else:
-            # 频率不够高，无法确定类型
-            column_types[col_idx] = "unknown"
-
-    return column_types
-
-
-def analyze_row_pattern(parts: List[str]) -> Dict[int, str]:
-    """
-    分析单行的列模式，返回每个列索引对应的类型
-    """
-    cell_types = {}
-    for i, cell in enumerate(parts):
-        cell = cell.strip()
-        if not cell:
-            cell_types[i] = "unknown"
-            continue
+    __slots__ = ('comment_lines', 'column_types', 'header_line_count', '_buffer', '_offsets', '_cells',
+                 '_weights', '_raw_weights', '_next', '_first', '_overlay')
+
+    def __init__(self):
+        self.comment_lines: List[str] = []
+        self.column_types: Dict[int, str] = {}
+        self.header_line_count = 0
+        self._buffer = bytearray()
+        self._offsets = array('q', [0])      # 第i行为 _buffer[_offsets[i]:_offsets[i+1]]
+        self._cells = array('Q')              # 压缩后的单元格类型
+        self._weights = array('q')            # 整数权重或 WEIGHT_RAW / WEIGHT_NOT_INDEXED
+        self._raw_weights: Dict[int, str] = {}  # 行 -> 非规范写法的权重原字符串
+        self._next = array('i')               # 同一词组的下一行，-1表示没有
+        self._first: Dict[str, int] = {}      # 词组 -> 第一行
+        self._overlay: Dict[int, str] = {}    # 本会话改写过的行 -> 新行
+
+    @property
+    def row_count(self) -> int:
+        return len(self._cells)
+
+    def __len__(self) -> int:
+        """词组数量"""
+        return len(self._first)
+
+    def __contains__(self, phrase: str) -> bool:
+        return phrase in self._first
+
+    def _append_line(self, line: str) -> None:
+        self._buffer += line.encode('utf-8')
+        self._offsets.append(len(self._buffer))
+        line_content = line.rstrip('\n')
+        self._cells.append(_pack_cell_types(tokenize_line(line_content)[1]) if line_content.strip() else 0)
+
+    def read(self, file_path: str) -> None:
+        """读取文件：'...'之前为注释行，其后为数据行；没有'...'时所有行都是数据行"""
+        found_marker = False
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if found_marker:
+                    self._append_line(line)
+                    continue
+                self.comment_lines.append(line)
+                if line.rstrip('\n').strip() == '...':
+                    found_marker = True
 
-        # 检查是否为权重（正整数）
-        if re.fullmatch(r'\d+', cell):
-            cell_types[i] = "weight"
-        # 检查是否为编码/拼音（全小写字母，可以有空格）
-        elif re.fullmatch(r'[a-z\s]+', cell) and re.search(r'[a-z]', cell):
-            cell_types[i] = "code"
-        # 其他情况都认为是词组（汉字、字母、数字、符号的组合）
+        if not found_marker:
+            lines, self.comment_lines = self.comment_lines, []
+            for line in lines:
+                self._append_line(line)
+        self.header_line_count = len(self.comment_lines)
+
+    def line(self, index: int) -> str:
+        """第index个数据行（含换行符）"""
+        if index in self._overlay:
+            return self._overlay[index]
+        return self._buffer[self._offsets[index]:self._offsets[index + 1]].decode('utf-8')
+
+    def cell_types(self, index: int, line_content: Optional[str] = None) -> Optional[List[str]]:
+        """第index个数据行的单元格类型，空行返回None"""
+        code = self._cells[index]
+        count = code & 31
+        if count == 0:
+            return None
+        if count == CELL_PACK_UNPACKED:
+            if line_content is None:
+                line_content = self.line(index).rstrip('\n')
+            return tokenize_line(line_content)[1]
+        return [CELL_TYPE_NAMES[(code >> (5 + 2 * i)) & 3] for i in range(count)]
+
+    def iter_lines(self) -> Iterator[Tuple[int, str, str]]:
+        """逐行产出 (行索引, 行内容, 原始行)"""
+        for index in range(self.row_count):
+            line = self.line(index)
+            yield self.header_line_count + index, line.rstrip('\n'), line
+
+    def iter_rows(self) -> Iterator[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]]:
+        """逐行产出 (行索引, 行内容, 原始行, 单元格分类结果)，分类结果由压缩的类型还原，不重新分类"""
+        for index, (line_num, line_content, line) in enumerate(self.iter_lines()):
+            cell_types = self.cell_types(index, line_content)
+            yield line_num, line_content, line, (line_content.split('\t'), cell_types) if cell_types else None
+
+    def detect_column_types(self, sample_size: int = COLUMN_SAMPLE_SIZE) -> Dict[int, str]:
+        """与detect_column_types相同：对非空数据行等间隔抽样统计列类型"""
+        non_empty = (index for index in range(self.row_count) if self._cells[index])
+        return column_types_from_cells(self.cell_types(index) for index in sample_evenly(non_empty, sample_size))
+
+    def _set_weight(self, index: int, weight: str) -> None:
+        # 规范写法的整数权重（无多余前导零）存为整数，其余保留原字符串
+        if weight.isascii() and weight.isdigit() and len(weight) < 19 and (weight == '0' or weight[0] != '0'):
+            self._weights[index] = int(weight)
+            self._raw_weights.pop(index, None)
         else:
-            cell_types[i] = "phrase"
-
-    return cell_types
-
-
-def validate_row_by_column_types(parts: List[str], column_types: Dict[int, str]) -> List[str]:
-    """根据列类型验证行数据"""
-    errors = []
-
-    for col_idx, col_type in column_types.items():
-        if col_idx >= len(parts):
-            errors.append(f"列{col_idx}不存在")
-            continue
-
-        cell = parts[col_idx].strip()
-
-        if not cell:
-            errors.append(f"{col_type}列为空")
-            continue
-
-        if col_type == "weight":
-            # 权重列必须是正整数
-            if not re.fullmatch(r'\d+', cell):
-                errors.append(f"权重列不是正整数: '{cell}'")
-        elif col_type == "code":
-            # 编码列必须是全小写字母，可以有空格
-            if not re.fullmatch(r'[a-z\s]+', cell) or not re.search(r'[a-z]', cell):
-                errors.append(f"编码/拼音列不是小写英文字母（可包含空格）: '{cell}'")
-        elif col_type == "phrase":
-            # 词组只需要非空即可
-            if not cell.strip():
-                errors.append(f"词组列为空")
-        elif col_type == "unknown":
-            # 未知列类型，跳过验证
-            pass
-
-    return errors
+            self._weights[index] = WEIGHT_RAW
+            self._raw_weights[index] = weight
+
+    def _weight(self, index: int) -> str:
+        weight = self._weights[index]
+        return str(weight) if weight >= 0 else self._raw_weights[index]
+
+    def build_index(self, column_types: Dict[int, str], log: Optional[RowLog] = None) -> None:
+        """校验数据行并建立词组映射，无效行的警告记入log（未指定时逐条打印），重复词组提示与原加载方式相同"""
+        self.column_types = column_types
+        self._weights = array('q', [WEIGHT_NOT_INDEXED]) * self.row_count
+        self._next = array('i', [-1]) * self.row_count
+        # 建立过程中链表首尾相连，_first暂时指向最后一行，省去单独记录尾部的字典
+        tails = self._first = {}
+        counts: Dict[str, int] = {}
+
+        for line_num, _, phrase, weight in iter_valid_rows(self.iter_rows(), column_types, log):
+            index = line_num - self.header_line_count
+            self._set_weight(index, weight)
+            tail = tails.get(phrase)
+            if tail is None:
+                tails[sys.intern(phrase)] = index
+                self._next[index] = index
+            else:
+                self._next[index] = self._next[tail]
+                self._next[tail] = index
+                tails[phrase] = index
+                counts[phrase] = counts.get(phrase, 1) + 1
+
+        for phrase, tail in tails.items():
+            tails[phrase] = self._next[tail]
+            self._next[tail] = -1
+
+        # 检查重复词组，按首次出现的顺序提示
+        duplicate_phrases = sorted(counts.items(), key=lambda item: self._first[item[0]])
+        _report_duplicates(duplicate_phrases[:10], len(duplicate_phrases))
+
+    def first_weight(self, phrase: str) -> Optional[str]:
+        """词组的第一个权重，不存在时返回None"""
+        index = self._first.get(phrase)
+        return None if index is None else self._weight(index)
+
+    def entries(self, phrase: str) -> List[Tuple[int, str, str]]:
+        """词组对应的全部行 [(行索引, 行内容, 权重)]"""
+        result = []
+        index = self._first.get(phrase, -1)
+        while index != -1:
+            result.append((self.header_line_count + index, self.line(index).rstrip('\n'), self._weight(index)))
+            index = self._next[index]
+        return result
+
+    def phrases(self) -> Iterator[str]:
+        return iter(self._first)
+
+    def content(self) -> str:
+        """还原文件内容（与磁盘文件一致）"""
+        if not self._overlay:
+            return ''.join(self.comment_lines) + self._buffer.decode('utf-8')
+        return ''.join(self.comment_lines) + ''.join(line for _, _, line in self.iter_lines())
+
+    def apply_update(self, index: int, phrase: str, new_line: str) -> None:
+        """
+        记录第index个数据行被改写为new_line，并更新该行的权重
+        加载时因权重为空被跳过的行按行号插入词组链表
+        """
+        self._overlay[index] = new_line
+        line_content = new_line.rstrip('\n')
+        parts, cell_types = tokenize_line(line_content)
+        self._cells[index] = _pack_cell_types(cell_types)
+
+        _, phrase_col, weight_col = resolve_row(parts, cell_types, self.column_types)
+        if phrase_col is None or weight_col is None or weight_col >= len(parts):
+            return
+        weight = parts[weight_col].strip()
+        if not weight:
+            return
+
+        if self._weights[index] == WEIGHT_NOT_INDEXED:
+            previous = -1
+            current = self._first.get(phrase, -1)
+            while current != -1 and current < index:
+                previous, current = current, self._next[current]
+            self._next[index] = current
+            if previous == -1:
+                self._first[sys.intern(phrase)] = index
+            else:
+                self._next[previous] = index
+        self._set_weight(index, weight)
 
 
-def find_columns_by_type_for_row(
-    parts: List[str],
-    column_types: Dict[int, str]
-) -> Tuple[Optional[int], Optional[int]]:
+def load_phrase_table(
+    file_path: str,
+    metrics: Optional[RunMetrics] = None,
+    log: Optional[RowLog] = None
+) -> PhraseTable:
     """
-    根据列类型和行内容找到该行的词组列和权重列
-    返回 (phrase_col, weight_col)
-    如果找不到，返回 (None, None)
+    加载文件到紧凑的PhraseTable并检测列类型
+    文件头声明了columns时直接使用声明的列位置，否则抽样统计检测列类型
+    读取和建立索引的耗时记入metrics（table_load、index_build阶段）
+    无效行的警告记入log，由调用方汇总；未指定时加载完成后在此打印汇总
     """
-    # 首先尝试使用统计得出的列类型
-    phrase_col = None
-    weight_col = None
+    metrics = metrics or RunMetrics("load_phrase_table")
+    own_log = log is None
+    if own_log:
+        log = RowLog(VERBOSITY)
+    table = PhraseTable()
+    try:
+        with metrics.stage("table_load"):
+            table.read(file_path)
 
-    for col_idx, col_type in column_types.items():
-        if col_idx < len(parts):
-            if col_type == "phrase" and phrase_col is None:
-                phrase_col = col_idx
-            elif col_type == "weight" and weight_col is None:
-                weight_col = col_idx
+        with metrics.stage("index_build"):
+            column_types = parse_header_columns(table.comment_lines)
+            if column_types is not None:
+                print(f"列类型（文件头columns声明）: {column_types}")
+            else:
+                column_types = table.detect_column_types()
+                print(f"列类型检测结果: {column_types}")
 
-    # 如果统计类型找不到，尝试分析该行的模式
-    if phrase_col is None or weight_col is None:
-        row_pattern = analyze_row_pattern(parts)
-
-        # 在行模式中寻找词组和权重
-        for col_idx, cell_type in row_pattern.items():
-            if cell_type == "phrase" and phrase_col is None:
-                phrase_col = col_idx
-            elif cell_type == "weight" and weight_col is None:
-                weight_col = col_idx
-
-    # 如果仍然找不到，使用启发式方法
-    if phrase_col is None:
-        for col_idx, cell in enumerate(parts):
-            cell = cell.strip()
-            if cell and re.search(r'[\u4e00-\u9fff]', cell):
-                phrase_col = col_idx
-                break
+            table.build_index(column_types, log)
+        return table
 
-    if weight_col is None:
-        for col_idx, cell in enumerate(parts):
-            cell = cell.strip()
-            if cell and re.fullmatch(r'\d+', cell):
-                weight_col = col_idx
-                break
+    except Exception as e:
+        print(f"加载文件时发生错误: {str(e)}")
+        return PhraseTable()
 
-    return phrase_col, weight_col
+    finally:
+        if own_log:
+            log.summary("加载文件时的警告")
+            log.close()
 
 
 def load_file_with_column_detection(file_path: str) -> Tuple[
@@ -194,112 +315,176 @@ def load_file_with_column_detection(file_path: str) -> Tuple[
     """
     加载文件并检测列类型
     修改：返回词组到行数据的映射，支持一个词组多行的情况
+    本工具内部使用更省内存的load_phrase_table，此函数按原来的数据结构展开，供外部调用
     """
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        # 查找注释结束标记
-        comment_lines = []
-        data_lines = []
-        found_marker = False
-
-        for i, line in enumerate(lines):
-            line_content = line.rstrip('\n')
-
-            if not found_marker:
-                comment_lines.append(line)
-                if line_content.strip() == '...':
-                    found_marker = True
-            else:
-                data_lines.append((i, line_content, line))
-
-        # 如果没有找到'...'，则所有行都是数据行
-        if not found_marker:
-            data_lines = [(i, lines[i].rstrip('\n'), lines[i]) for i in range(len(lines))]
-            comment_lines = []
-
-        # 检测列类型（基于统计）
-        column_types = detect_column_types(data_lines)
-        print(f"列类型检测结果: {column_types}")
-
-        # 构建词组到行数据的映射，支持一个词组多行
-        phrase_to_lines = {}  # 词组 -> [(行索引, 行内容, 原始权重)]
-        phrase_to_line_indices = {}  # 词组 -> [行索引列表]
-
-        for line_num, line_content, original_line in data_lines:
-            if not line_content.strip():
-                continue
-
-            parts = line_content.split('\t')
+    table = load_phrase_table(file_path)
+    phrase_to_lines = {phrase: table.entries(phrase) for phrase in table.phrases()}
+    phrase_to_line_indices = {phrase: [line_num for line_num, _, _ in lines]
+                              for phrase, lines in phrase_to_lines.items()}
+    return table.comment_lines, list(table.iter_lines()), table.column_types, phrase_to_lines, phrase_to_line_indices
 
-            # 跳过没有足够列的行
-            if len(parts) < 2:
-                print(f"警告: 第{line_num+1}行列数不足，已跳过")
-                continue
-
-            # 验证行数据
-            errors = validate_row_by_column_types(parts, column_types)
-            if errors:
-                print(f"警告: 第{line_num+1}行数据验证失败: {'; '.join(errors)}")
-
-            # 查找该行的词组列和权重列
-            phrase_col, weight_col = find_columns_by_type_for_row(parts, column_types)
-
-            if phrase_col is None:
-                # 尝试查找包含汉字的列作为词组列
-                for col_idx, cell in enumerate(parts):
-                    cell = cell.strip()
-                    if cell and re.search(r'[\u4e00-\u9fff]', cell):
-                        phrase_col = col_idx
-                        break
-
-            if weight_col is None:
-                # 尝试查找纯数字的列作为权重列
-                for col_idx, cell in enumerate(parts):
-                    cell = cell.strip()
-                    if cell and re.fullmatch(r'\d+', cell):
-                        weight_col = col_idx
-                        break
-
-            if phrase_col is None or weight_col is None:
-                print(f"警告: 第{line_num+1}行无法确定词组列或权重列，已跳过")
-                continue
-
-            phrase = parts[phrase_col].strip()
-            weight = parts[weight_col].strip() if weight_col < len(parts) else ""
-
-            # 验证词组和权重
-            if not phrase:
-                print(f"警告: 第{line_num+1}行词组列为空，已跳过")
-                continue
-
-            if weight == "":  # 权重为空字符串
-                print(f"警告: 第{line_num+1}行权重列为空，已跳过")
-                continue
 
-            # 记录词组对应的行数据
-            if phrase not in phrase_to_lines:
-                phrase_to_lines[phrase] = []
-                phrase_to_line_indices[phrase] = []
+class BaseFileIndex:
+    """
+    基础文件（phrase_weight.txt）的会话级索引
+    整个会话只解析一次；本会话写回的修改直接应用到内存，
+    只有文件在会话之外被修改（大小或mtime变化）时才重新读取
+    基础文件超过内存上限时不载入内存，改为建立按词组排序的映射文件，供外部排序合并连接使用
+    """
 
-            phrase_to_lines[phrase].append((line_num, line_content, weight))
-            phrase_to_line_indices[phrase].append(line_num)
+    def __init__(self, file_path: str, join_engine: str = "auto", memory_limit: int = JOIN_MEMORY_LIMIT):
+        self.file_path = file_path
+        self.join_engine = join_engine
+        self.memory_limit = memory_limit
+        self.sorted_mapping: Optional[SortedMapping] = None
+        # 排序映射文件所在的临时目录，只由创建它的进程删除（工作进程继承的是同一份文件）
+        self._tmp_dir: Optional[str] = None
+        self._tmp_owner: Optional[int] = None
+        # 本会话以外部排序方式改写基础文件后，排序映射需在下次使用时重建
+        self._sorted_stale = False
+        self.table = PhraseTable()
+        self.column_types: Dict[int, str] = {}
+        self.load_count = 0
+        self._stat: Optional[Tuple[int, int]] = None
+        # 最近一次加载时的警告，由之后的第一份更新记录取走写入
+        self.load_warnings: Optional[RowLog] = None
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        """返回文件的 (大小, mtime_ns)，文件不存在时返回None"""
+        try:
+            st = os.stat(self.file_path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    @property
+    def external(self) -> bool:
+        """是否使用外部排序合并连接（基础文件未载入内存）"""
+        return self.sorted_mapping is not None
+
+    @property
+    def phrase_count(self) -> int:
+        return len(self.sorted_mapping) if self.external else len(self.table)
+
+    def needs_external_join(self, extra_bytes: int = 0) -> bool:
+        """与另外extra_bytes字节的文件一起连接时，是否需要使用外部排序合并连接"""
+        if self.external:
+            return True
+        size = self._stat[0] if self._stat is not None else 0
+        return needs_external_join(size + extra_bytes, self.join_engine, self.memory_limit)
+
+    def load(self, metrics: Optional[RunMetrics] = None) -> None:
+        """
+        完整解析基础文件；超过内存上限时改为建立排序映射文件
+        耗时记入metrics，未指定时记入会话统计
+        """
+        metrics = metrics or session_metrics()
+        # 先取状态再读取：读取期间若有外部修改，下次refresh时会发现状态不一致
+        stat = self._file_stat()
+        self._clear_sorted_mapping()
+        self._sorted_stale = False
+        self.load_count += 1
+        self.table = PhraseTable()
+        log = RowLog(VERBOSITY)
+        try:
+            self._load(stat, metrics, log)
+        finally:
+            log.summary("加载基础文件时的警告")
+            self._replace_load_warnings(log)
+
+    def _load(self, stat: Optional[Tuple[int, int]], metrics: RunMetrics, log: RowLog) -> None:
+        if needs_external_join(stat[0] if stat else 0, self.join_engine, self.memory_limit):
+            print(f"使用外部排序合并连接（内存上限 {self.memory_limit // (1024 * 1024)} MB）")
+            try:
+                if self._tmp_dir is None or self._tmp_owner != os.getpid():
+                    self._tmp_dir = tempfile.mkdtemp(prefix="replace_weight_")
+                    self._tmp_owner = os.getpid()
+                with metrics.stage("index_build"):
+                    self.sorted_mapping = SortedMapping.build(self.file_path, self._tmp_dir, self.memory_limit, log)
+                self.column_types = self.sorted_mapping.column_types
+            except Exception as e:
+                print(f"加载文件时发生错误: {str(e)}")
+            self._stat = stat if self.sorted_mapping is not None else None
+            return
+
+        self.table = load_phrase_table(self.file_path, metrics, log)
+        self.column_types = self.table.column_types
+        self._stat = stat if self.table.row_count else None
+
+    def _replace_load_warnings(self, log: Optional[RowLog]) -> None:
+        if self.load_warnings is not None:
+            self.load_warnings.close()
+        self.load_warnings = log
+
+    def take_load_warnings(self) -> Optional[RowLog]:
+        """取走最近一次加载时的警告（已被取走时返回None），由调用方写入记录"""
+        log, self.load_warnings = self.load_warnings, None
+        return log
+
+    def current_sorted_mapping(self) -> 'SortedMapping':
+        """
+        返回与磁盘一致的排序映射
+        本会话改写过基础文件时在此重建；重建的输出与首次加载重复，不再打印
+        """
+        if self._sorted_stale:
+            log = RowLog(VERBOSITY_QUIET)
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.sorted_mapping.remove()
+                self.sorted_mapping = SortedMapping.build(self.file_path, self._tmp_dir, self.memory_limit, log)
+            log.close()
+            self._sorted_stale = False
+        return self.sorted_mapping
+
+    def mark_rewritten(self) -> None:
+        """本会话以外部排序方式改写了基础文件：记录新的文件状态，排序映射延后到需要时重建"""
+        self._stat = self._file_stat()
+        self._sorted_stale = True
+
+    def _clear_sorted_mapping(self) -> None:
+        if self.sorted_mapping is not None and self._tmp_owner == os.getpid():
+            self.sorted_mapping.remove()
+        self.sorted_mapping = None
+
+    def close(self) -> None:
+        """删除外部排序使用的临时文件"""
+        self._clear_sorted_mapping()
+        if self._tmp_dir is not None and self._tmp_owner == os.getpid():
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir = None
+        self._replace_load_warnings(None)
+
+    def refresh(self, metrics: Optional[RunMetrics] = None) -> bool:
+        """
+        文件在会话之外被修改（或尚未加载）时重新解析，返回是否重新解析
+        是否沿用会话中的索引作为base_index缓存的命中/未命中记入metrics
+        """
+        metrics = metrics or session_metrics()
+        stat = self._file_stat()
+        if self._stat is not None and stat == self._stat:
+            metrics.cache("base_index", hits=1)
+            return False
+        metrics.cache("base_index", misses=1)
+        if self._stat is not None:
+            print("检测到基础文件已在外部被修改，正在重新加载...")
+        self.load(metrics)
+        return True
 
-        # 检查重复词组
-        duplicate_phrases = {phrase: len(lines) for phrase, lines in phrase_to_lines.items() if len(lines) > 1}
-        if duplicate_phrases:
-            print(f"发现 {len(duplicate_phrases)} 个重复词组:")
-            for phrase, count in list(duplicate_phrases.items())[:10]:  # 只显示前10个
-                print(f"  '{phrase}' 出现 {count} 次")
-            if len(duplicate_phrases) > 10:
-                print(f"  ... 还有 {len(duplicate_phrases)-10} 个重复词组")
+    def content(self) -> str:
+        """按内存中的行还原文件内容（与磁盘文件一致），用于备份"""
+        return self.table.content()
 
-        return comment_lines, data_lines, column_types, phrase_to_lines, phrase_to_line_indices
+    def apply_updates(self, updates: List[Tuple[int, str, str]]) -> None:
+        """
+        将本会话写回的修改应用到内存，updates为 [(数据行序号, 词组, 新行)]
+        调用前文件已写入磁盘，这里同时记录写入后的文件状态
+        """
+        for index, phrase, new_line in updates:
+            self.table.apply_update(index, phrase, new_line)
+        self._stat = self._file_stat()
 
-    except Exception as e:
-        print(f"加载文件时发生错误: {str(e)}")
-        return [], [], {}, {}, {}
+    def invalidate(self) -> None:
+        """写入失败或以外部排序方式改写后，内存与磁盘可能不一致，下次使用前强制重新解析"""
+        self._stat = None
 
 
 def create_update_record(
@@ -313,17 +498,35 @@ def create_update_record(
     direction: str,
     source_file_name: str,
     modified_lines: List[str],
-    original_content: str
+    original_content: Optional[str],
+    base_file_name: str = BASE_FILE,
+    backup_digest: Optional[str] = None,
+    warnings: Optional[List[Tuple[str, Optional[RowLog]]]] = None
 ) -> Optional[str]:
-    """创建更新记录文件，不再生成单独的备份文件"""
+    """
+    创建更新记录文件
+    原文件已存入备份库时记录中只写版本哈希（backup_digest），
+    否则把original_content完整写入记录
+    warnings为 [(文件名, 该文件的警告)]，有警告时写入全部明细（终端只显示汇总）
+    """
     try:
         # 确保记录目录存在
         os.makedirs(record_dir, exist_ok=True)
 
         # 记录文件名 - 使用Python文件名_log_时间戳
-        record_file = os.path.join(record_dir, f"{script_name}_log_{timestamp}.txt")
+        # 同一秒内（如多进程处理多个文件时）生成多份记录时依次加序号，独占创建避免互相覆盖
+        record_base = os.path.join(record_dir, f"{script_name}_log_{timestamp}")
+        record_file = record_base + ".txt"
+        suffix = 1
+        while True:
+            try:
+                f = open(record_file, 'x', encoding='utf-8')
+                break
+            except FileExistsError:
+                record_file = f"{record_base}_{suffix}.txt"
+                suffix += 1
 
-        with open(record_file, 'w', encoding='utf-8') as f:
+        with f:
             f.write(f"# 权重更新日志 - {timestamp}\n")
             f.write("*" * 30 + "\n\n")
 
@@ -337,9 +540,9 @@ def create_update_record(
 
             if direction == "用拖入文件替换基础文件":
                 f.write(f"源文件: {source_file_name}\n")
-                f.write(f"目标文件: phrase_weight.txt\n")
+                f.write(f"目标文件: {base_file_name}\n")
             else:
-                f.write(f"源文件: phrase_weight.txt\n")
+                f.write(f"源文件: {base_file_name}\n")
                 f.write(f"目标文件: {source_file_name}\n")
 
             f.write("\n" + "*" * 30 + "\n\n")
@@ -356,10 +559,27 @@ def create_update_record(
 
             f.write("\n" + "*" * 30 + "\n\n")
 
+            # 处理警告：被跳过或数据有问题的行
+            warning_logs = [(name, log) for name, log in warnings or [] if log]
+            if warning_logs:
+                f.write("## 处理警告\n")
+                f.write("-" * 40 + "\n")
+                for name, log in warning_logs:
+                    f.write(f"{name}: 共 {len(log)} 条\n")
+                    for kind, message in log.details():
+                        f.write(f"[{kind}] {message}\n")
+                    f.write("\n")
+                f.write("*" * 30 + "\n\n")
+
             # 第三部分：原文件内容（作为备份）
             f.write("## 此处为原文件内容（更新前）\n")
             f.write("-" * 40 + "\n")
-            f.write(original_content)
+            if backup_digest:
+                f.write(f"原文件已保存到备份库: {backup_digest}\n")
+                f.write(f"恢复命令: python {script_name}.py --restore {backup_digest[:12]} "
+                        f"--record-dir \"{record_dir}\"\n")
+            else:
+                f.write(original_content if original_content is not None else "无法读取原文件内容")
 
         return record_file
 
@@ -368,339 +588,458 @@ def create_update_record(
         return None
 
 
-def replace_weights_direction1(
-    drag_in_file: str,
-    base_phrase_to_lines: Dict[str, List[Tuple[int, str, str]]],
-    record_dir: str
-) -> bool:
-    """方向1：用基础文件替换拖入文件中的权重"""
-    print("\n正在执行替换方向1：用基础文件替换拖入文件中的权重")
+def _iter_lines(lines: Iterable[str], first_line_num: int) -> Iterator[Tuple[int, str, str]]:
+    """逐行产出 (行索引, 行内容, 原始行)，不分类单元格"""
+    for line_num, line in enumerate(lines, first_line_num):
+        yield line_num, line.rstrip('\n'), line
 
-    # 解析拖入文件
-    drag_in_comment_lines, drag_in_data_lines, drag_in_column_types, drag_in_phrase_to_lines, _ = \
-        load_file_with_column_detection(drag_in_file)
 
-    if not drag_in_data_lines:
-        print("错误: 拖入文件中没有数据行")
-        return False
-
-    # 将基础文件的词组映射转换为 {phrase: weight} 形式，只取第一个权重
-    base_mapping = {}
-    for phrase, lines in base_phrase_to_lines.items():
-        if lines:
-            base_mapping[phrase] = lines[0][2]  # 取第一个权重
-
-    updated_lines = []
-    updated_count = 0
-    not_found_count = 0
-    error_count = 0
-    modified_lines = []
-
-    for line_num, line_content, original_line in drag_in_data_lines:
-        # 跳过空行
-        if not line_content.strip():
-            updated_lines.append(original_line)
-            continue
+def _mentions_phrase(line_content: str, phrases: Set[str]) -> bool:
+    """行中是否有单元格（去掉首尾空白后）是phrases中的词组，用于增量同步时跳过无关的行"""
+    return not phrases.isdisjoint(map(str.strip, line_content.split('\t')))
 
-        # 检查分隔符
-        if '\t' not in line_content:
-            print(f"警告: 拖入文件第{line_num+1}行未找到Tab分隔符，已跳过: {line_content}")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
 
-        # 分割行
-        parts = line_content.split('\t')
-
-        # 跳过没有足够列的行
-        if len(parts) < 2:
-            print(f"警告: 拖入文件第{line_num+1}行列数不足，已跳过")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
-
-        # 验证行数据
-        errors = validate_row_by_column_types(parts, drag_in_column_types)
-        if errors:
-            print(f"警告: 拖入文件第{line_num+1}行数据验证失败: {'; '.join(errors)}")
+def needs_external_join(in_memory_bytes: int, join_engine: str, memory_limit: int) -> bool:
+    """根据设置和需要载入内存的文件大小决定是否使用外部排序合并连接"""
+    if join_engine == "external":
+        return True
+    if join_engine == "hash":
+        return False
+    return in_memory_bytes * JOIN_MEMORY_FACTOR > memory_limit
 
-        # 查找该行的词组列和权重列
-        phrase_col, weight_col = find_columns_by_type_for_row(parts, drag_in_column_types)
 
-        if phrase_col is None:
-            # 尝试查找包含汉字的列作为词组列
-            for col_idx, cell in enumerate(parts):
-                cell = cell.strip()
-                if cell and re.search(r'[\u4e00-\u9fff]', cell):
-                    phrase_col = col_idx
-                    break
+class SortedMapping:
+    """
+    按词组排序、落盘的 {词组: 权重} 映射（外部排序合并连接的一侧）
+    一个词组有多个权重时与内存映射相同，只保留文件中第一个权重
+    """
 
-        if weight_col is None:
-            # 尝试查找纯数字的列作为权重列
-            for col_idx, cell in enumerate(parts):
-                cell = cell.strip()
-                if cell and re.fullmatch(r'\d+', cell):
-                    weight_col = col_idx
-                    break
+    def __init__(self, sorted_file: str, phrase_count: int, header_line_count: int, column_types: Dict[int, str]):
+        self.sorted_file = sorted_file
+        self.phrase_count = phrase_count
+        # 源文件的文件头行数和列类型，替换源文件本身时无需再次扫描
+        self.header_line_count = header_line_count
+        self.column_types = column_types
+
+    def __len__(self) -> int:
+        return self.phrase_count
+
+    @classmethod
+    def build(cls, file_path: str, tmp_dir: str, memory_limit: int, log: Optional[RowLog] = None) -> 'SortedMapping':
+        """
+        流式解析文件（打印的列类型、重复词组提示和记入log的警告与内存加载相同），外部排序后写入映射文件
+        """
+        header_line_count, column_types = scan_file_layout(file_path)
+
+        fd, sorted_file = tempfile.mkstemp(suffix='.sorted', dir=tmp_dir)
+        phrase_count = 0
+        # 重复词组按首次出现的行排序，只保留前10个用于提示
+        first_duplicates: List[Tuple[int, str, int]] = []
+        duplicate_count = 0
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as out:
+                valid_rows = iter_valid_rows(iter_file_rows(file_path, header_line_count), column_types, log)
+                records = ((phrase, line_num, weight) for line_num, _, phrase, weight in valid_rows)
+
+                for phrase, group in itertools.groupby(external_sort(records, tmp_dir, memory_limit),
+                                                       key=lambda record: record[0]):
+                    _, first_line, weight = next(group)
+                    out.write(f"{phrase}\t{weight}\n")
+                    phrase_count += 1
+
+                    count = 1 + sum(1 for _ in group)
+                    if count > 1:
+                        duplicate_count += 1
+                        entry = (-first_line, phrase, count)
+                        if len(first_duplicates) < 10:
+                            heapq.heappush(first_duplicates, entry)
+                        elif entry > first_duplicates[0]:
+                            heapq.heapreplace(first_duplicates, entry)
+        except BaseException:
+            os.remove(sorted_file)
+            raise
+
+        first_duplicates.sort(reverse=True)
+        _report_duplicates([(phrase, count) for _, phrase, count in first_duplicates], duplicate_count)
+        return cls(sorted_file, phrase_count, header_line_count, column_types)
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        with open(self.sorted_file, 'r', encoding='utf-8', newline='\n') as f:
+            for line in f:
+                phrase, weight = line[:-1].split('\t')
+                yield phrase, weight
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.sorted_file)
+        except OSError:
+            pass
 
-        if phrase_col is None:
-            print(f"警告: 拖入文件第{line_num+1}行词组列不存在，已跳过")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
 
-        if weight_col is None:
-            print(f"警告: 拖入文件第{line_num+1}行权重列不存在，已跳过")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
+def _row_phrase(
+    row: Optional[Tuple[List[str], List[str]]],
+    line_content: str,
+    column_types: Dict[int, str]
+) -> Optional[str]:
+    """按替换时的规则取出数据行的词组（不打印警告），无法替换的行返回None"""
+    if row is None or '\t' not in line_content or len(row[0]) < 2:
+        return None
+    _, phrase_col, weight_col = resolve_row(row[0], row[1], column_types)
+    if phrase_col is None or weight_col is None:
+        return None
+    return row[0][phrase_col].strip()
 
-        phrase = parts[phrase_col].strip()
 
-        # 提取原始权重
-        original_weight = parts[weight_col].strip() if weight_col < len(parts) else ""
+def merge_join_lookup(
+    rows: Iterable[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]],
+    column_types: Dict[int, str],
+    mapping: SortedMapping,
+    tmp_dir: str,
+    memory_limit: int
+) -> Callable[[int, str], Optional[str]]:
+    """
+    外部排序合并连接：目标文件各行的 (词组, 数据行序号) 外部排序后与排好序的映射一次合并，
+    匹配结果再按数据行序号外部排序，返回供substitute_weights按行顺序调用的lookup
+    """
+    keys = ((phrase, index, '') for index, (_, line_content, _, row) in enumerate(rows)
+            for phrase in (_row_phrase(row, line_content, column_types),) if phrase is not None)
+
+    def matches() -> Iterator[Tuple[str, int, str]]:
+        source = iter(mapping)
+        current = next(source, None)
+        for phrase, index, _ in external_sort(keys, tmp_dir, memory_limit):
+            while current is not None and current[0] < phrase:
+                current = next(source, None)
+            if current is None:
+                return
+            if current[0] == phrase:
+                yield phrase, index, current[1]
+
+    # 合并连接按词组顺序产出匹配，替换时需要按行顺序读取
+    ordered = external_sort(matches(), tmp_dir, memory_limit, by_seq=True)
+    pending = next(ordered, None)
+
+    def lookup(index: int, phrase: str) -> Optional[str]:
+        nonlocal pending
+        while pending is not None and pending[1] < index:
+            pending = next(ordered, None)
+        if pending is not None and pending[1] == index:
+            return pending[2]
+        return None
 
-        # 在基础文件中查找
-        if phrase in base_mapping:
-            new_weight = base_mapping[phrase]
+    return lookup
 
-            # 如果权重相同，不需要修改
-            if original_weight == new_weight:
-                updated_lines.append(original_line)
-                continue
 
-            # 替换权重列
-            parts[weight_col] = new_weight
+def replace_weights_direction1(
+    drag_in_file: str,
+    base_index: BaseFileIndex,
+    record_dir: str,
+    changed_weights: Optional[Dict[str, str]] = None
+) -> bool:
+    """
+    方向1：用基础文件替换拖入文件中的权重
+    拖入文件逐行流式处理并原子替换，内存占用与拖入文件大小无关
+    changed_weights为增量同步时基础文件中权重有变化的词组及其新权重：不为None时不加载基础文件，
+    只校验和替换含有这些词组的行，其余行原样写出；没有行需要修改时不改写文件
+    """
+    incremental = changed_weights is not None
+    if incremental:
+        print(f"\n正在执行替换方向1（增量）：基础文件中 {len(changed_weights)} 个词组的权重有变化")
+    else:
+        print("\n正在执行替换方向1：用基础文件替换拖入文件中的权重")
+    metrics = RunMetrics("replace_weights_direction1", progress=_progress_shown())
+    log = RowLog(VERBOSITY)
 
-            # 重新构建行
-            updated_line = '\t'.join(parts) + '\n'
-            updated_lines.append(updated_line)
+    # 确定拖入文件的文件头和列类型
+    try:
+        with metrics.stage("parse"):
+            header_line_count, drag_in_column_types = scan_file_layout(drag_in_file)
+    except Exception as e:
+        print(f"加载文件时发生错误: {str(e)}")
+        return False
 
-            # 记录被修改的原始行内容
-            modified_lines.append(line_content)
-            updated_count += 1
-        else:
-            # 未找到，保持原样
-            updated_lines.append(original_line)
-            not_found_count += 1
+    # 基础文件的 {phrase: weight} 映射，只取第一个权重；外部修改过时先重新加载
+    if not incremental:
+        base_index.refresh(metrics)
+    base_name = os.path.basename(base_index.file_path)
 
-    # 读取原始拖入文件内容用于记录
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    result = SubstitutionResult()
+    backup = [None, None]  # [版本哈希, 未能存入备份库时的原文件内容]
+    tmp_dir = None
+    unchanged = [False]
+
+    def output_lines() -> Iterator[str]:
+        if incremental:
+            # 不含变化词组的行不会被替换，不再分类，按空行原样写出
+            changed = set(changed_weights)
+            with open(drag_in_file, 'r', encoding='utf-8') as f:
+                metrics.track_file(f)
+                yield from itertools.islice(f, header_line_count)
+                rows = ((line_num, line_content, line,
+                         tokenize_line(line_content) if _mentions_phrase(line_content, changed) else None)
+                        for line_num, line_content, line in _iter_lines(f, header_line_count))
+                yield from metrics.timed_iter(
+                    substitute_weights(metrics.timed_iter(rows, "classify", count_rows=True), drag_in_column_types,
+                                       lambda index, phrase: changed_weights.get(phrase), "拖入文件", result, log),
+                    "substitute")
+            return
+
+        if base_index.external:
+            # 基础文件未载入内存：先扫描一遍拖入文件，与排序映射做合并连接
+            with metrics.stage("index_build"):
+                lookup = merge_join_lookup(iter_file_rows(drag_in_file, header_line_count), drag_in_column_types,
+                                           base_index.current_sorted_mapping(), tmp_dir, base_index.memory_limit)
+        else:
+            lookup = lambda index, phrase: base_index.table.first_weight(phrase)
 
-    try:
-        # 读取原始拖入文件内容
         with open(drag_in_file, 'r', encoding='utf-8') as f:
-            original_content = f.read()
-    except Exception as e:
-        print(f"警告: 读取拖入文件失败: {str(e)}")
-        original_content = "无法读取原文件内容"
+            metrics.track_file(f)
+            # 注释行原样写入，数据行逐行替换
+            yield from itertools.islice(f, header_line_count)
+            rows = metrics.timed_iter(stream_data_rows(metrics.timed_iter(f, "parse"), header_line_count),
+                                      "classify", count_rows=True)
+            yield from metrics.timed_iter(
+                substitute_weights(rows, drag_in_column_types, lookup, "拖入文件", result, log), "substitute")
+
+    def before_commit() -> bool:
+        if not result.row_count:
+            print("错误: 拖入文件中没有数据行")
+            return False
+        if incremental and not result.updated_count:
+            unchanged[0] = True
+            return False
+        # 替换前原文件仍完整，此时存入备份库
+        with metrics.stage("record"):
+            backup[:] = backup_original_file(record_dir, drag_in_file, timestamp)
+        return True
 
     # 写入更新后的拖入文件
     try:
-        with open(drag_in_file, 'w', encoding='utf-8') as f:
-            # 写入注释行
-            for line in drag_in_comment_lines:
-                f.write(line)
-
-            # 写入数据行
-            for line in updated_lines:
-                f.write(line)
-
-        print(f"成功更新拖入文件: {drag_in_file}")
-        print(f"替换了 {updated_count} 行数据")
-        print(f"未找到匹配的词组: {not_found_count} 个")
-        print(f"处理错误: {error_count} 行")
-
-        # 创建更新记录（不再生成单独的备份文件）
-        script_name = os.path.splitext(os.path.basename(__file__))[0]
+        with tempfile.TemporaryDirectory(prefix="replace_weight_") as tmp_dir, metrics.stage("write"):
+            if not write_file_atomically(drag_in_file, output_lines(), before_commit):
+                if unchanged[0]:
+                    print(f"拖入文件中没有需要更新的行，未改写: {drag_in_file}")
+                return unchanged[0]
+    except Exception as e:
+        print(f"写入拖入文件时发生错误: {str(e)}")
+        return False
+    finally:
+        metrics.finish_progress()
+
+    print(f"成功更新拖入文件: {drag_in_file}")
+    print(f"替换了 {result.updated_count} 行数据")
+    print(f"未找到匹配的词组: {result.not_found_count} 个")
+    print(f"处理错误: {result.error_count} 行")
+    log.summary("拖入文件中的警告")
+
+    # 创建更新记录（不再生成单独的备份文件）
+    script_name = os.path.splitext(os.path.basename(__file__))[0]
+    with metrics.stage("record"):
         record_file = create_update_record(
             record_dir, script_name, timestamp, os.path.basename(drag_in_file),
-            updated_count, not_found_count, error_count,
-            "用基础文件替换拖入文件", "phrase_weight.txt",
-            modified_lines, original_content
+            result.updated_count, result.not_found_count, result.error_count,
+            "用基础文件替换拖入文件", base_name,
+            result.modified_lines, backup[1], base_name, backup[0],
+            _record_warnings((base_name, base_index.take_load_warnings()), (os.path.basename(drag_in_file), log))
         )
 
-        if record_file:
-            print(f"更新记录已保存到: {record_file}")
+    if record_file:
+        print(f"更新记录已保存到: {record_file}")
+        _write_run_metrics(metrics, result, base_index, record_file, len(log))
 
-        return True
-
-    except Exception as e:
-        print(f"写入拖入文件时发生错误: {str(e)}")
-        return False
+    return True
 
 
 def replace_weights_direction2(
     drag_in_file: str,
-    base_file: str,
-    record_dir: str
+    base_index: BaseFileIndex,
+    record_dir: str,
+    preloaded: Optional[Tuple[str, PhraseTable, RowLog]] = None
 ) -> bool:
-    """方向2：用拖入文件替换基础文件中的权重"""
+    """
+    方向2：用拖入文件替换基础文件中的权重
+    preloaded为工作进程预先解析好的 (解析输出, 拖入文件的PhraseTable, 解析时的警告)，为None时在此解析拖入文件
+    两个文件超过内存上限时使用外部排序合并连接，排序用的临时文件在结束后删除
+    """
     print("\n正在执行替换方向2：用拖入文件替换基础文件中的权重")
 
-    # 加载拖入文件
-    drag_in_comment_lines, drag_in_data_lines, drag_in_column_types, drag_in_phrase_to_lines, _ = \
-        load_file_with_column_detection(drag_in_file)
+    try:
+        drag_in_size = os.path.getsize(drag_in_file)
+    except OSError:
+        drag_in_size = 0
+    external = preloaded is None and base_index.needs_external_join(drag_in_size)
 
-    if not drag_in_phrase_to_lines:
-        print("错误: 拖入文件中没有有效数据，无法继续")
-        return False
+    tmp_dir = tempfile.mkdtemp(prefix="replace_weight_") if external else None
+    try:
+        return _replace_weights_direction2(drag_in_file, base_index, record_dir, preloaded, tmp_dir)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    print(f"拖入文件中词组数量: {len(drag_in_phrase_to_lines)}")
 
-    # 将拖入文件的词组映射转换为 {phrase: weight} 形式，只取第一个权重
-    drag_in_mapping = {}
-    for phrase, lines in drag_in_phrase_to_lines.items():
-        if lines:
-            drag_in_mapping[phrase] = lines[0][2]  # 取第一个权重
+def _replace_weights_direction2(
+    drag_in_file: str,
+    base_index: BaseFileIndex,
+    record_dir: str,
+    preloaded: Optional[Tuple[str, PhraseTable, RowLog]],
+    tmp_dir: Optional[str]
+) -> bool:
+    """
+    方向2的实际处理，tmp_dir不为None时使用外部排序合并连接
+    基础文件逐行写入临时文件后原子替换；基础文件在内存中时再把修改同步到索引
+    """
+    metrics = RunMetrics("replace_weights_direction2", progress=_progress_shown())
+    base_log = RowLog(VERBOSITY)
 
-    # 加载基础文件
-    base_comment_lines, base_data_lines, base_column_types, base_phrase_to_lines, _ = \
-        load_file_with_column_detection(base_file)
+    # 加载拖入文件，得到词组到权重的映射，只取第一个权重
+    if preloaded is not None:
+        parse_output, drag_in_mapping, drag_in_log = preloaded
+        print(parse_output, end='')
+    else:
+        drag_in_log = RowLog(VERBOSITY)
+        if tmp_dir is not None:
+            try:
+                with metrics.stage("index_build"):
+                    drag_in_mapping = SortedMapping.build(drag_in_file, tmp_dir, base_index.memory_limit, drag_in_log)
+            except Exception as e:
+                print(f"加载文件时发生错误: {str(e)}")
+                drag_in_mapping = PhraseTable()
+        else:
+            drag_in_mapping = load_phrase_table(drag_in_file, metrics, drag_in_log)
+    drag_in_log.summary("加载拖入文件时的警告")
 
-    if not base_data_lines:
-        print("错误: 基础文件中没有数据行")
+    if not drag_in_mapping:
+        print("错误: 拖入文件中没有有效数据，无法继续")
         return False
 
-    updated_lines = []
-    updated_count = 0
-    not_found_count = 0
-    error_count = 0
-    modified_lines = []
-
-    # 处理基础文件数据行
-    for line_num, line_content, original_line in base_data_lines:
-        # 跳过空行
-        if not line_content.strip():
-            updated_lines.append(original_line)
-            continue
+    print(f"拖入文件中词组数量: {len(drag_in_mapping)}")
 
-        # 检查分隔符
-        if '\t' not in line_content:
-            print(f"警告: 基础文件第{line_num+1}行未找到Tab分隔符，已跳过: {line_content}")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
-
-        # 分割行
-        parts = line_content.split('\t')
-
-        # 跳过没有足够列的行
-        if len(parts) < 2:
-            print(f"警告: 基础文件第{line_num+1}行列数不足，已跳过")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
+    # 使用会话中已加载的基础文件，外部修改过时先重新加载
+    base_index.refresh(metrics)
+    base_file = base_index.file_path
+    base_name = os.path.basename(base_file)
 
-        # 验证行数据
-        errors = validate_row_by_column_types(parts, base_column_types)
-        if errors:
-            print(f"警告: 基础文件第{line_num+1}行数据验证失败: {'; '.join(errors)}")
-
-        # 查找该行的词组列和权重列
-        phrase_col, weight_col = find_columns_by_type_for_row(parts, base_column_types)
-
-        if phrase_col is None:
-            # 尝试查找包含汉字的列作为词组列
-            for col_idx, cell in enumerate(parts):
-                cell = cell.strip()
-                if cell and re.search(r'[\u4e00-\u9fff]', cell):
-                    phrase_col = col_idx
-                    break
-
-        if weight_col is None:
-            # 尝试查找纯数字的列作为权重列
-            for col_idx, cell in enumerate(parts):
-                cell = cell.strip()
-                if cell and re.fullmatch(r'\d+', cell):
-                    weight_col = col_idx
-                    break
-
-        if phrase_col is None:
-            print(f"警告: 基础文件第{line_num+1}行词组列不存在，已跳过")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
-
-        if weight_col is None:
-            print(f"警告: 基础文件第{line_num+1}行权重列不存在，已跳过")
-            updated_lines.append(original_line)
-            error_count += 1
-            continue
-
-        phrase = parts[phrase_col].strip()
-
-        # 提取原始权重
-        original_weight = parts[weight_col].strip() if weight_col < len(parts) else ""
-
-        # 在拖入文件中查找
-        if phrase in drag_in_mapping:
-            new_weight = drag_in_mapping[phrase]
-
-            # 如果权重相同，不需要修改
-            if original_weight == new_weight:
-                updated_lines.append(original_line)
-                continue
-
-            # 替换权重列
-            parts[weight_col] = new_weight
-
-            # 重新构建行
-            updated_line = '\t'.join(parts) + '\n'
-            updated_lines.append(updated_line)
+    if not base_index.external and not base_index.table.row_count:
+        print("错误: 基础文件中没有数据行")
+        return False
 
-            # 记录被修改的原始行内容
-            modified_lines.append(line_content)
-            updated_count += 1
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    result = SubstitutionResult()
+    backup = [None, None]  # [版本哈希, 未能存入备份库时的原文件内容]
+
+    def base_rows() -> Iterator[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]]:
+        # 基础文件未载入内存时从磁盘流式读取
+        if base_index.external:
+            return iter_file_rows(base_file, base_index.sorted_mapping.header_line_count)
+        return base_index.table.iter_rows()
+
+    def output_lines() -> Iterator[str]:
+        if tmp_dir is not None:
+            # 先扫描一遍基础文件，与拖入文件的排序映射做合并连接
+            with metrics.stage("index_build"):
+                lookup = merge_join_lookup(base_rows(), base_index.column_types, drag_in_mapping,
+                                           tmp_dir, base_index.memory_limit)
         else:
-            # 未找到，保持原样
-            updated_lines.append(original_line)
-            not_found_count += 1
+            lookup = lambda index, phrase: drag_in_mapping.first_weight(phrase)
 
-    # 读取原始基础文件内容用于记录
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        if base_index.external:
+            with open(base_file, 'r', encoding='utf-8') as f:
+                yield from itertools.islice(f, base_index.sorted_mapping.header_line_count)
+        else:
+            metrics.set_total_rows(base_index.table.row_count)
+            yield from base_index.table.comment_lines
+        rows = metrics.timed_iter(base_rows(), "parse" if base_index.external else "classify", count_rows=True)
+        yield from metrics.timed_iter(
+            substitute_weights(rows, base_index.column_types, lookup, "基础文件", result, base_log), "substitute")
+
+    def before_commit() -> bool:
+        if base_index.external:
+            if not result.row_count:
+                print("错误: 基础文件中没有数据行")
+                return False
+            with metrics.stage("record"):
+                backup[:] = backup_original_file(record_dir, base_file, timestamp)
+        else:
+            # 内存中的行与磁盘一致，直接用于备份，无需再读一次文件
+            with metrics.stage("record"):
+                backup[:] = backup_original_file(record_dir, base_file, timestamp, base_index.content())
+        return True
 
+    # 写入更新后的基础文件
     try:
-        # 读取原始基础文件内容
-        with open(base_file, 'r', encoding='utf-8') as f:
-            original_content = f.read()
+        with metrics.stage("write"):
+            if not write_file_atomically(base_file, output_lines(), before_commit):
+                return False
     except Exception as e:
-        print(f"警告: 读取基础文件失败: {str(e)}")
-        original_content = "无法读取原文件内容"
+        print(f"写入基础文件时发生错误: {str(e)}")
+        base_index.invalidate()
+        return False
+    finally:
+        metrics.finish_progress()
 
-    # 写入更新后的基础文件
-    try:
-        with open(base_file, 'w', encoding='utf-8') as f:
-            # 写入注释行
-            for line in base_comment_lines:
-                f.write(line)
-
-            # 写入数据行
-            for line in updated_lines:
-                f.write(line)
-
-        print(f"成功更新基础文件: {base_file}")
-        print(f"替换了 {updated_count} 行数据")
-        print(f"未找到匹配的词组: {not_found_count} 个")
-        print(f"处理错误: {error_count} 行")
-
-        # 创建更新记录（不再生成单独的备份文件）
-        script_name = os.path.splitext(os.path.basename(__file__))[0]
+    with metrics.stage("index_build"):
+        if base_index.external:
+            # 排序映射已过期，方向1下次使用前重新建立
+            base_index.mark_rewritten()
+        else:
+            # 将本次修改同步到内存索引，后续文件无需重新解析基础文件
+            base_index.apply_updates(result.changes)
+
+    print(f"成功更新基础文件: {base_file}")
+    print(f"替换了 {result.updated_count} 行数据")
+    print(f"未找到匹配的词组: {result.not_found_count} 个")
+    print(f"处理错误: {result.error_count} 行")
+    base_log.summary("基础文件中的警告")
+
+    # 创建更新记录（不再生成单独的备份文件）
+    script_name = os.path.splitext(os.path.basename(__file__))[0]
+    with metrics.stage("record"):
         record_file = create_update_record(
-            record_dir, script_name, timestamp, "phrase_weight.txt",
-            updated_count, not_found_count, error_count,
+            record_dir, script_name, timestamp, base_name,
+            result.updated_count, result.not_found_count, result.error_count,
             "用拖入文件替换基础文件", os.path.basename(drag_in_file),
-            modified_lines, original_content
+            result.modified_lines, backup[1], base_name, backup[0],
+            _record_warnings((os.path.basename(drag_in_file), drag_in_log),
+                             (base_name, base_index.take_load_warnings()), (base_name, base_log))
         )
 
-        if record_file:
-            print(f"更新记录已保存到: {record_file}")
+    if record_file:
+        print(f"更新记录已保存到: {record_file}")
+        _write_run_metrics(metrics, result, base_index, record_file, len(drag_in_log) + len(base_log))
 
-        return True
+    return True
 
-    except Exception as e:
-        print(f"写入基础文件时发生错误: {str(e)}")
-        return False
+
+def _record_warnings(*warnings: Tuple[str, Optional[RowLog]]) -> List[Tuple[str, RowLog]]:
+    """整理写入更新记录的警告：同一文件的多份警告按顺序并入第一份，没有警告的去掉"""
+    merged: Dict[str, RowLog] = {}
+    for name, log in warnings:
+        if not log:
+            continue
+        if name in merged:
+            merged[name].merge(log)
+        else:
+            merged[name] = log
+    return list(merged.items())
+
+
+def _write_run_metrics(
+    metrics: RunMetrics,
+    result: 'SubstitutionResult',
+    base_index: BaseFileIndex,
+    record_file: str,
+    warning_count: int = 0
+) -> None:
+    """把一次替换的统计写到更新记录旁"""
+    metrics.count("updated", result.updated_count)
+    metrics.count("not_found", result.not_found_count)
+    metrics.count("errors", result.error_count)
+    metrics.count("warnings", warning_count)
+    metrics.count("external_join", int(base_index.external))
+    metrics_file = metrics.write(record_file, session_metrics())
+    if metrics_file:
+        print(f"运行统计已保存到: {metrics_file}")
 
 
 def get_file_path() -> str:
@@ -719,8 +1058,13 @@ def get_file_path() -> str:
     return file_path
 
 
-def main() -> None:
-    """主函数"""
+def interactive_main(
+    base_file: str = BASE_FILE,
+    record_dir: str = RECORD_DIR,
+    join_engine: str = "auto",
+    memory_limit: int = JOIN_MEMORY_LIMIT
+) -> None:
+    """交互模式：逐个拖入文件并选择替换方向"""
     print("=" * 60)
     print("文件权重更新工具")
     print("程序名称: 智能文件权重同步器")
@@ -751,7 +1095,6 @@ def main() -> None:
     print()
 
     # 检查phrase_weight.txt文件是否存在
-    base_file = "phrase_weight.txt"
     if not os.path.exists(base_file):
         print(f"错误: 基础文件 '{base_file}' 不存在")
         print("请确保phrase_weight.txt文件与程序在同一目录下")
@@ -763,12 +1106,12 @@ def main() -> None:
 
     # 加载基础文件
     print("\n正在加载基础文件...")
-    base_comment_lines, base_data_lines, base_column_types, base_phrase_to_lines, _ = \
-        load_file_with_column_detection(base_file)
-    print(f"基础文件中词组数量: {len(base_phrase_to_lines)}")
+    base_index = BaseFileIndex(base_file, join_engine, memory_limit)
+    # 交互模式有多处退出，统一在程序结束时删除外部排序的临时文件
+    atexit.register(base_index.close)
+    base_index.load()
+    print(f"基础文件中词组数量: {base_index.phrase_count}")
 
-    # 设置记录文件保存目录
-    record_dir = r"D:\OneDrive\Backup\RimeSync\update_record"
     print(f"备份或更新日志文件将保存到: {record_dir}")
 
     # 文件处理计数
@@ -850,9 +1193,9 @@ def main() -> None:
 
         # 根据选择的方向执行相应的替换操作
         if direction == 1:
-            success = replace_weights_direction1(file_path, base_phrase_to_lines, record_dir)
+            success = replace_weights_direction1(file_path, base_index, record_dir)
         else:
-            success = replace_weights_direction2(file_path, base_file, record_dir)
+            success = replace_weights_direction2(file_path, base_index, record_dir)
 
         if success:
             print(f"\n✓ 文件处理成功！")
@@ -867,5 +1210,558 @@ def main() -> None:
     print("\n程序退出。")
 
 
+def file_digest(file_path: str) -> str:
+    """文件内容的sha256，分块读取"""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def scan_sync_entries(
+    file_path: str,
+    cached_columns: Optional[Dict[int, str]] = None,
+    cached_rows: Optional[Dict[str, Optional[Tuple[str, str]]]] = None
+) -> Tuple[Dict[int, str], Dict[str, Optional[Tuple[str, str]]], Dict[str, str]]:
+    """
+    解析基础文件各数据行的词组和权重，校验方式与加载基础文件相同
+    返回 (列类型, {行内容: (词组, 权重)，无效行为None}, {词组: 第一个权重})
+    列类型与cached_columns相同时，内容未变的行直接使用cached_rows中的结果，只有新增或修改过的行重新分类
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        header_line_count, column_types = scan_file_layout(file_path)
+    if column_types != cached_columns or cached_rows is None:
+        cached_rows = {}
+
+    rows: Dict[str, Optional[Tuple[str, str]]] = {}
+    entries: Dict[str, str] = {}
+    # 基础文件的警告在完整加载时已报告过，这里不再重复
+    log = RowLog(VERBOSITY_QUIET)
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_num, line in enumerate(itertools.islice(f, header_line_count, None), header_line_count):
+                line_content = line.rstrip('\n')
+                row = cached_rows.get(line_content, False)
+                if row is False:
+                    row = None
+                    if line_content.strip():
+                        valid_rows = iter_valid_rows([(line_num, line_content, line, tokenize_line(line_content))],
+                                                      column_types, log)
+                        for _, _, phrase, weight in valid_rows:
+                            row = (phrase, weight)
+                rows[line_content] = row
+                if row is not None and row[0] not in entries:
+                    entries[row[0]] = row[1]
+    finally:
+        log.close()
+    return column_types, rows, entries
+
+
+class SyncCheckpoint:
+    """
+    增量同步的检查点，保存在基础文件同目录的 .weight_sync/ 中，每个基础文件一组：
+    <基础文件名>.<路径哈希>.ckpt 记录最近见到的基础文件状态、每个目标文件上次同步后的大小、修改时间、
+    内容哈希和当时基础文件的内容哈希，以及最近一次完整成功的方向2的目标文件顺序；
+    <...>.entries 记录某一版本基础文件各数据行的解析结果，只在基础文件内容变化时读取，用于找出权重有变化的词组
+    """
+
+    def __init__(self, base_file: str):
+        self.base_file = base_file
+        base_path = os.path.abspath(base_file)
+        key = hashlib.sha256(base_path.encode('utf-8')).hexdigest()[:12]
+        prefix = os.path.join(os.path.dirname(base_path), SYNC_STATE_DIR, f"{os.path.basename(base_path)}.{key}")
+        self.checkpoint_file = prefix + ".ckpt"
+        self.entries_file = prefix + ".entries"
+        # 最近一次见到的基础文件 (大小, mtime_ns, 内容哈希)，大小和修改时间未变时不再计算哈希
+        self.base_seen: Optional[Tuple[int, int, str]] = None
+        # .entries 所记录的基础文件版本的内容哈希
+        self.entries_digest: Optional[str] = None
+        # 目标文件绝对路径 -> (方向, 大小, mtime_ns, 内容哈希, 同步后基础文件的内容哈希)
+        self.targets: Dict[str, Tuple[int, int, int, str, str]] = {}
+        # 最近一次完整成功的方向2：(目标文件绝对路径的顺序, 结束时基础文件的内容哈希)
+        self.last_direction2: Tuple[Tuple[str, ...], Optional[str]] = ((), None)
+
+    def load(self) -> 'SyncCheckpoint':
+        """读取检查点，不存在或格式不符时视为从未同步"""
+        try:
+            with open(self.checkpoint_file, 'rb') as f:
+                magic, version, base_seen, entries_digest, targets, last_direction2 = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return self
+        if magic == SYNC_STATE_MAGIC and version == SYNC_STATE_VERSION:
+            self.base_seen = base_seen
+            self.entries_digest = entries_digest
+            self.targets = targets
+            self.last_direction2 = last_direction2
+        return self
+
+    def _write(self, file_path: str, payload: tuple) -> bool:
+        """先写临时文件再替换；写入失败只影响下次同步能否增量进行"""
+        tmp_file = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(tmp_file, 'wb') as f:
+                f.write(marshal.dumps(payload))
+            os.replace(tmp_file, file_path)
+            return True
+        except OSError as e:
+            print(f"警告: 无法保存同步检查点 {file_path}: {e}")
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            return False
+
+    def save(self) -> None:
+        self._write(self.checkpoint_file, (SYNC_STATE_MAGIC, SYNC_STATE_VERSION, self.base_seen,
+                                           self.entries_digest, self.targets, self.last_direction2))
+
+    def base_digest(self) -> str:
+        """基础文件当前的内容哈希"""
+        st = os.stat(self.base_file)
+        if self.base_seen is not None and self.base_seen[:2] == (st.st_size, st.st_mtime_ns):
+            return self.base_seen[2]
+        digest = file_digest(self.base_file)
+        self.base_seen = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def base_changes(self, base_digest: str) -> Optional[Dict[str, str]]:
+        """
+        与 .entries 记录的版本相比，当前基础文件中第一个权重有变化（含新增）的词组 {词组: 新权重}，
+        同时把当前版本的解析结果写入 .entries；没有可比较的记录时返回None
+        """
+        previous_digest = self.entries_digest
+        if base_digest == previous_digest:
+            return {}
+        try:
+            with open(self.entries_file, 'rb') as f:
+                magic, version, digest, columns, rows, entries = marshal.loads(f.read())
+            if magic != SYNC_STATE_MAGIC or version != SYNC_STATE_VERSION:
+                raise ValueError(self.entries_file)
+        except (OSError, EOFError, ValueError, TypeError):
+            digest, columns, rows, entries = None, None, None, {}
+
+        new_columns, new_rows, new_entries = scan_sync_entries(self.base_file, columns, rows)
+        if self._write(self.entries_file, (SYNC_STATE_MAGIC, SYNC_STATE_VERSION, base_digest,
+                                           new_columns, new_rows, new_entries)):
+            self.entries_digest = base_digest
+        else:
+            self.entries_digest = None
+        if digest is None or digest != previous_digest:
+            return None
+        return {phrase: weight for phrase, weight in new_entries.items() if entries.get(phrase) != weight}
+
+    def is_current(self, target: str, direction: int, base_digest: Optional[str] = None) -> bool:
+        """
+        目标文件上次以direction方向同步后是否未被修改；base_digest不为None时还要求当时基础文件的内容哈希与之相同
+        大小和修改时间变化但内容未变（如只是被保存了一次）时也视为未修改
+        """
+        key = os.path.abspath(target)
+        entry = self.targets.get(key)
+        if entry is None or entry[0] != direction or (base_digest is not None and entry[4] != base_digest):
+            return False
+        st = os.stat(target)
+        if (st.st_size, st.st_mtime_ns) == entry[1:3]:
+            return True
+        if st.st_size != entry[1] or file_digest(target) != entry[3]:
+            return False
+        self.targets[key] = (direction, st.st_size, st.st_mtime_ns, entry[3], entry[4])
+        return True
+
+    def mark_synced(self, target: str, direction: int, base_digest: str) -> None:
+        """记录目标文件已按direction方向与内容哈希为base_digest的基础文件同步"""
+        key = os.path.abspath(target)
+        entry = self.targets.get(key)
+        st = os.stat(target)
+        if entry is not None and entry[1:3] == (st.st_size, st.st_mtime_ns):
+            digest = entry[3]
+        else:
+            digest = file_digest(target)
+        self.targets[key] = (direction, st.st_size, st.st_mtime_ns, digest, base_digest)
+
+    def forget(self, target: str) -> None:
+        """同步失败的目标文件下次按完整方式同步"""
+        self.targets.pop(os.path.abspath(target), None)
+
+
+def expand_targets(patterns: List[str], base_file: str) -> Tuple[List[str], List[str]]:
+    """
+    展开目标文件列表中的通配符（Windows的命令行不会自动展开），
+    保持参数顺序、去掉重复文件和基础文件本身
+    返回 (目标文件列表, 不存在或没有匹配的参数列表)
+    """
+    targets = []
+    missing = []
+    seen = set()
+    base_path = os.path.abspath(base_file)
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print(f"错误: 没有文件匹配 '{pattern}'")
+                missing.append(pattern)
+        else:
+            matches = [pattern]
+        for path in matches:
+            abs_path = os.path.abspath(path)
+            if abs_path in seen:
+                continue
+            if abs_path == base_path:
+                print(f"警告: 目标文件 '{path}' 就是基础文件，已跳过")
+                continue
+            if not os.path.isfile(path):
+                print(f"错误: 文件 '{path}' 不存在，已跳过")
+                missing.append(path)
+                continue
+            seen.add(abs_path)
+            targets.append(path)
+    return targets, missing
+
+
+def _resolve_sync_workers(workers: int, target_count: int) -> int:
+    """确定实际使用的进程数：0表示按CPU核数，且不超过目标文件数"""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, target_count))
+
+
+# 工作进程中的基础文件索引，由进程池initializer设置
+_worker_base_index: Optional[BaseFileIndex] = None
+# 当前进程是否为进程池的工作进程
+_in_worker = False
+
+
+def _progress_shown() -> bool:
+    """是否显示进度条；工作进程的输出由主进程按顺序转发，不显示进度条"""
+    return not _in_worker and progress_enabled(VERBOSITY, SHOW_PROGRESS)
+
+
+def _init_sync_worker(base_index: Optional[BaseFileIndex], verbosity: int) -> None:
+    """进程池初始化：保存主进程加载好的基础文件索引和输出详细程度，工作进程不再重复解析"""
+    global _worker_base_index, _in_worker, VERBOSITY
+    _worker_base_index = base_index
+    _in_worker = True
+    VERBOSITY = verbosity
+
+
+def _direction1_task(task: Tuple[str, str, Optional[RowLog], Optional[Dict[str, str]]]) -> Tuple[bool, str]:
+    """
+    工作进程：对一个目标文件执行方向1，输出先缓存下来由主进程按顺序打印
+    基础文件加载时的警告随第一个任务传入，写入第一份更新记录；增量同步时随任务传入变化的词组
+    """
+    drag_in_file, record_dir, load_warnings, changed_weights = task
+    if load_warnings is not None:
+        _worker_base_index.load_warnings = load_warnings
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            success = replace_weights_direction1(drag_in_file, _worker_base_index, record_dir, changed_weights)
+        except Exception as e:
+            print(f"处理文件 '{drag_in_file}' 时发生错误: {str(e)}")
+            success = False
+    return success, output.getvalue()
+
+
+def _parse_drag_in_task(drag_in_file: Optional[str]) -> Optional[Tuple[str, PhraseTable, RowLog]]:
+    """
+    工作进程：解析方向2的拖入文件，返回 (解析输出, 拖入文件的PhraseTable, 解析时的警告)
+    drag_in_file为None（该文件使用外部排序合并连接，由主进程处理）时返回None
+    """
+    if drag_in_file is None:
+        return None
+    output = io.StringIO()
+    log = RowLog(VERBOSITY)
+    with contextlib.redirect_stdout(output):
+        try:
+            table = load_phrase_table(drag_in_file, log=log)
+        except Exception as e:
+            print(f"加载文件时发生错误: {str(e)}")
+            table = PhraseTable()
+    return output.getvalue(), table, log
+
+
+def _run_direction1(
+    targets: List[str],
+    base_index: BaseFileIndex,
+    record_dir: str,
+    workers: int,
+    changes: Optional[List[Optional[Dict[str, str]]]] = None
+) -> Iterator[bool]:
+    """
+    方向1：各目标文件互不影响，多进程并行处理，按参数顺序输出结果
+    changes为增量同步时各目标文件要处理的变化词组（None表示完整同步）
+    """
+    changes = changes or [None] * len(targets)
+    if workers == 1:
+        for target, changed_weights in zip(targets, changes):
+            yield replace_weights_direction1(target, base_index, record_dir, changed_weights)
+        return
+
+    # 基础文件加载时的警告只写入第一份记录，先取出，避免随索引复制到每个工作进程
+    load_warnings = base_index.take_load_warnings()
+    tasks = [(target, record_dir, load_warnings if i == 0 else None, changed_weights)
+             for i, (target, changed_weights) in enumerate(zip(targets, changes))]
+    with multiprocessing.Pool(workers, initializer=_init_sync_worker, initargs=(base_index, VERBOSITY)) as pool:
+        for success, output in pool.imap(_direction1_task, tasks):
+            print(output, end='')
+            yield success
+
+
+def _run_direction2(
+    targets: List[str],
+    base_index: BaseFileIndex,
+    record_dir: str,
+    workers: int,
+    checkpoint: Optional['SyncCheckpoint'] = None
+) -> Iterator[bool]:
+    """
+    方向2：所有目标文件都写回同一个基础文件，必须按顺序依次应用；
+    拖入文件的解析交给进程池提前进行，与主进程的写回重叠
+    需要外部排序合并连接的文件不在内存中解析，由主进程处理
+    checkpoint不为None时增量同步：见 _direction2_pending
+    """
+    pending, dirty = [True] * len(targets), True
+    base_digest, complete = None, True
+    if checkpoint is not None:
+        pending, dirty = _direction2_pending(checkpoint, targets)
+        base_digest = checkpoint.base_digest()
+        # 本次同步全部完成前，检查点中不保留上次方向2的结果
+        checkpoint.last_direction2 = ((), None)
+
+    def apply(target: str, must_run: bool, preloaded: Optional[Tuple[str, PhraseTable, RowLog]]) -> bool:
+        if checkpoint is None:
+            return replace_weights_direction2(target, base_index, record_dir, preloaded)
+        success = apply_incremental(target, must_run, preloaded)
+        if target is targets[-1] and complete:
+            checkpoint.last_direction2 = (tuple(os.path.abspath(target) for target in targets), base_digest)
+        return success
+
+    def apply_incremental(target: str, must_run: bool, preloaded: Optional[Tuple[str, PhraseTable, RowLog]]) -> bool:
+        nonlocal dirty, base_digest, complete
+        if not must_run and not dirty:
+            print(f"\n已是最新，跳过: {target}")
+            return True
+        success = replace_weights_direction2(target, base_index, record_dir, preloaded)
+        if success:
+            # 基础文件的内容因此改变时，之后未修改的目标文件也可能需要重新写回（后写回的文件优先）
+            new_digest = checkpoint.base_digest()
+            dirty = dirty or new_digest != base_digest
+            base_digest = new_digest
+            checkpoint.mark_synced(target, 2, base_digest)
+        else:
+            checkpoint.forget(target)
+            complete = False
+            dirty = True
+        return success
+
+    if workers == 1:
+        for target, must_run in zip(targets, pending):
+            yield apply(target, must_run, None)
+    else:
+        tasks = [target if must_run and not base_index.needs_external_join(os.path.getsize(target)) else None
+                 for target, must_run in zip(targets, pending)]
+        with multiprocessing.Pool(workers, initializer=_init_sync_worker, initargs=(None, VERBOSITY)) as pool:
+            for target, must_run, preloaded in zip(targets, pending, pool.imap(_parse_drag_in_task, tasks)):
+                yield apply(target, must_run, preloaded)
+
+
+def _direction2_pending(checkpoint: 'SyncCheckpoint', targets: List[str]) -> Tuple[List[bool], bool]:
+    """
+    增量同步方向2：返回 (各目标文件是否必须写回, 基础文件是否已偏离上次同步的结果)
+    上次以同样顺序同步全部目标文件后基础文件未被修改时，未修改的目标文件无需写回；
+    否则（或某个文件写回后基础文件有变化）为与完整同步的结果一致，之后的目标文件都要写回
+    """
+    order = tuple(os.path.abspath(target) for target in targets)
+    dirty = checkpoint.last_direction2 != (order, checkpoint.base_digest())
+    return [not checkpoint.is_current(target, 2) for target in targets], dirty
+
+
+def _plan_direction1(
+    checkpoint: 'SyncCheckpoint',
+    targets: List[str]
+) -> Tuple[List[str], List[Optional[Dict[str, str]]], str]:
+    """
+    增量同步方向1：返回 (需要处理的目标文件, 各文件要处理的变化词组（None表示完整同步）, 基础文件当前的内容哈希)
+    上次同步后未修改、且当时的基础文件就是 .entries 记录的版本的目标文件，只处理之后权重有变化的词组，
+    没有变化时跳过；其余目标文件按完整方式同步
+    """
+    previous_digest = checkpoint.entries_digest
+    base_digest = checkpoint.base_digest()
+    changes = checkpoint.base_changes(base_digest)
+    if changes is None:
+        print("没有可比较的上次同步记录，目标文件按完整方式同步")
+    elif changes:
+        print(f"基础文件中权重有变化的词组: {len(changes)} 个")
+
+    pending: List[str] = []
+    pending_changes: List[Optional[Dict[str, str]]] = []
+    for target in targets:
+        if changes is None or not checkpoint.is_current(target, 1, previous_digest):
+            pending.append(target)
+            pending_changes.append(None)
+        elif not changes:
+            print(f"已是最新，跳过: {target}")
+            checkpoint.mark_synced(target, 1, base_digest)
+        else:
+            pending.append(target)
+            pending_changes.append(changes if len(changes) <= SYNC_MAX_CHANGED_PHRASES else None)
+    return pending, pending_changes, base_digest
+
+
+def batch_main(
+    base_file: str,
+    direction: int,
+    patterns: List[str],
+    workers: int = 0,
+    record_dir: str = RECORD_DIR,
+    join_engine: str = "auto",
+    memory_limit: int = JOIN_MEMORY_LIMIT,
+    incremental: bool = False
+) -> int:
+    """
+    非交互模式：用同一份基础文件索引处理多个目标文件
+    incremental为True时按 .weight_sync/ 中的检查点只处理上次同步后有变化的部分，基础文件只在需要时加载
+    返回处理失败（含不存在）的文件数
+    """
+    if not os.path.exists(base_file):
+        print(f"错误: 基础文件 '{base_file}' 不存在")
+        return 1
+
+    targets, missing = expand_targets(patterns, base_file)
+    if not targets:
+        print("错误: 没有可处理的目标文件")
+        return max(1, len(missing))
+
+    print(f"基础文件: {base_file}")
+    checkpoint = SyncCheckpoint(base_file).load() if incremental else None
+    pending, changes = targets, None
+    needs_base = True
+    if checkpoint is not None and direction == 1:
+        pending, changes, base_digest = _plan_direction1(checkpoint, targets)
+        needs_base = None in changes
+    elif checkpoint is not None:
+        must_run, dirty = _direction2_pending(checkpoint, targets)
+        needs_base = dirty or any(must_run)
+        if not needs_base:
+            for target in targets:
+                print(f"已是最新，跳过: {target}")
+            pending = []
+
+    base_index = BaseFileIndex(base_file, join_engine, memory_limit)
+    failed = list(missing)
+    try:
+        if needs_base:
+            print("\n正在加载基础文件...")
+            base_index.load()
+            print(f"基础文件中词组数量: {base_index.phrase_count}")
+        if pending:
+            print(f"备份或更新日志文件将保存到: {record_dir}")
+            workers = _resolve_sync_workers(workers, len(pending))
+            print(f"替换方向: {direction}，目标文件: {len(pending)} 个，进程数: {workers}")
+
+            if direction == 1:
+                results = _run_direction1(pending, base_index, record_dir, workers, changes)
+            else:
+                results = _run_direction2(pending, base_index, record_dir, workers, checkpoint)
+            for target, success in zip(pending, results):
+                if success:
+                    print(f"\n✓ 文件处理成功！")
+                else:
+                    failed.append(target)
+                if checkpoint is not None and direction == 1:
+                    if success:
+                        checkpoint.mark_synced(target, 1, base_digest)
+                    else:
+                        checkpoint.forget(target)
+    finally:
+        base_index.close()
+        if checkpoint is not None:
+            checkpoint.save()
+
+    print(f"\n总共处理了 {len(targets) + len(missing) - len(failed)} 个文件。")
+    if failed:
+        print(f"处理失败 {len(failed)} 个文件:")
+        for target in failed:
+            print(f"  {target}")
+    print(f"所有记录文件已保存在: {record_dir}")
+    return len(failed)
+
+
+def main() -> None:
+    """主函数：指定目标文件时以非交互模式运行，否则进入交互模式"""
+    parser = argparse.ArgumentParser(
+        description="在基础文件和其他码表之间同步权重；不指定目标文件时进入交互模式"
+    )
+    parser.add_argument("targets", nargs="*",
+                        help="目标文件，可以使用通配符（如 cn_dicts/*.dict.yaml）")
+    parser.add_argument("-b", "--base", default=BASE_FILE,
+                        help=f"基础文件（默认: {BASE_FILE}）")
+    parser.add_argument("-d", "--direction", type=int, choices=(1, 2), default=1,
+                        help="替换方向：1 用基础文件替换目标文件（默认），2 用目标文件替换基础文件")
+    parser.add_argument("-j", "--workers", type=int, default=0,
+                        help="并行进程数，0表示按CPU核数（默认: 0）")
+    parser.add_argument("--record-dir", default=RECORD_DIR,
+                        help=f"记录文件保存目录（默认: {RECORD_DIR}）")
+    parser.add_argument("--join", choices=JOIN_ENGINES, default="auto",
+                        help="连接引擎：hash 内存映射，external 外部排序合并连接，auto 按内存上限自动选择（默认）")
+    parser.add_argument("--memory-limit", type=int, default=JOIN_MEMORY_LIMIT // (1024 * 1024), metavar="MB",
+                        help=f"自动选择连接引擎时的内存上限（默认: {JOIN_MEMORY_LIMIT // (1024 * 1024)} MB）")
+    parser.add_argument("--restore", metavar="HASH",
+                        help="从备份库恢复指定版本（哈希或其唯一前缀），默认写回原文件")
+    parser.add_argument("-o", "--output",
+                        help="与--restore一起使用，将恢复的内容写入此文件而不是原文件")
+    parser.add_argument("--list-backups", nargs="?", const="", metavar="FILE",
+                        help="列出备份库中的版本，可只列出某个文件的版本")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"增量同步：只处理上次同步后有变化的词组，跳过已是最新的目标文件"
+                             f"（检查点保存在基础文件同目录的 {SYNC_STATE_DIR}/ 中）")
+    parser.add_argument("--progress", action="store_true",
+                        help="总是显示进度条（默认只在终端中显示）")
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument("-q", "--quiet", action="store_true",
+                              help="安静模式：逐行的警告只显示各类别的计数，明细写入更新记录")
+    output_group.add_argument("-v", "--verbose", action="store_true",
+                              help="详细模式：逐行打印警告（不显示进度条）")
+    args = parser.parse_args()
+
+    global SHOW_PROGRESS, VERBOSITY
+    SHOW_PROGRESS = args.progress
+    if args.quiet:
+        VERBOSITY = VERBOSITY_QUIET
+    elif args.verbose:
+        VERBOSITY = VERBOSITY_VERBOSE
+
+    store = BackupStore(os.path.join(args.record_dir, BACKUP_STORE_DIR))
+    if args.list_backups is not None:
+        entries = store.entries()
+        if args.list_backups:
+            wanted = os.path.abspath(args.list_backups)
+            entries = [entry for entry in entries if entry[2] == wanted]
+        if not entries:
+            print("备份库中没有记录")
+        for timestamp, digest, file_path in entries:
+            print(f"{timestamp}\t{digest[:12]}\t{file_path}")
+        return
+
+    if args.restore:
+        try:
+            target = store.restore(args.restore, args.output)
+        except (OSError, ValueError, EOFError, zlib.error) as e:
+            print(f"恢复失败: {str(e)}")
+            sys.exit(1)
+        print(f"已将备份版本 {args.restore} 恢复到: {target}")
+        return
+
+    memory_limit = args.memory_limit * 1024 * 1024
+    if not args.targets:
+        interactive_main(args.base, args.record_dir, args.join, memory_limit)
+        return
+
+    failed = batch_main(args.base, args.direction, args.targets, args.workers, args.record_dir,
+                        args.join, memory_limit, args.incremental)
+    sys.exit(1 if failed else 0)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
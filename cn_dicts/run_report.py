@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行统计与输出控制
+记录一次运行中各阶段（读取码表、建立索引、解析、分类、编码、写入、记录）的耗时、行数、
+峰值内存和缓存命中率，写成JSON文件放在处理记录旁边；可在终端显示限频刷新的进度条。
+逐行的提示信息由RowLog按类别计数汇总，明细写入记录文件，只有详细模式才逐行打印
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import itertools
+import tempfile
+import contextlib
+from typing import IO, Dict, List, Optional, Iterable, Iterator, Tuple, TypeVar
+
+# 统计文件格式版本
+METRICS_FORMAT_VERSION = 1
+# 统计文件名为记录文件名（去掉扩展名）加此后缀
+METRICS_FILE_SUFFIX = ".metrics.json"
+# 进度行的刷新间隔（秒）
+PROGRESS_INTERVAL = 0.5
+# 计时迭代器每次成批取出的条数，避免逐条计时的开销
+TIMED_BLOCK_SIZE = 256
+# 进度条宽度（字符数）
+PROGRESS_BAR_WIDTH = 30
+# 逐行循环中每隔多少行详细计时一行（lap），汇总时按此倍数放大；取质数，避免与输入中的周期性重合
+LAP_SAMPLE_INTERVAL = 17
+
+# 输出详细程度：安静（只显示进度条和汇总）、普通（汇总并列出几条示例，默认）、详细（逐行打印）
+VERBOSITY_QUIET = 0
+VERBOSITY_NORMAL = 1
+VERBOSITY_VERBOSE = 2
+# 普通模式下每类提示显示的示例条数
+ROW_LOG_EXAMPLES = 3
+# 提示明细在内存中保存的最大字节数，超过后转存到临时文件
+ROW_LOG_SPOOL_BYTES = 1024 * 1024
+
+T = TypeVar('T')
+
+_clock = time.perf_counter
+
+
+def progress_enabled(verbosity: int, forced: bool = False) -> bool:
+    """是否显示进度条：指定forced时总是显示；否则非详细模式且标准错误输出为终端时显示"""
+    if forced:
+        return True
+    if verbosity >= VERBOSITY_VERBOSE:
+        return False
+    try:
+        return sys.stderr.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def peak_rss_bytes(children: bool = False) -> Optional[int]:
+    """
+    本进程（children为True时为已结束的子进程中最大者）的峰值常驻内存，无法获取时返回None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None if children else _windows_peak_rss()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux上ru_maxrss单位为KB，macOS上为字节
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def _windows_peak_rss() -> Optional[int]:
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except Exception:
+        return None
+
+
+class RunMetrics:
+    """
+    一次运行的统计
+    阶段耗时按"独占"计算：嵌套的阶段（如写入时拉取的替换结果）从外层阶段中扣除，各阶段之和不超过总耗时。
+    流水线中的生成器用timed_iter()按块计时；逐行循环每lap_interval行抽取一行，
+    用mark()/lap()把各段时间记到对应阶段，汇总时乘以lap_interval作为估计值
+    """
+
+    def __init__(self, name: str, progress: bool = False, lap_interval: int = LAP_SAMPLE_INTERVAL):
+        self.name = name
+        self.progress = progress
+        self.lap_interval = lap_interval
+        self.started = datetime.datetime.now()
+        self.stages: Dict[str, float] = {}
+        self.lap_stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.caches: Dict[str, List[int]] = {}
+        self.rows = 0
+        self._start = _clock()
+        self._last_lap = self._start
+        self._stack: List[list] = []  # [阶段, 开始时间, 嵌套阶段耗时]
+        self._last_progress = self._start
+        self._progress_shown = False
+        # 进度条的当前位置和总量，未设置总量时只显示行数和速度
+        self._position = None
+        self._total = 0
+
+    # ---------- 阶段计时 ----------
+
+    def begin(self, stage: str) -> None:
+        self._stack.append([stage, _clock(), 0.0])
+
+    def end(self) -> None:
+        stage, start, nested = self._stack.pop()
+        elapsed = _clock() - start
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """with metrics.stage("write"): ... 计入一个阶段"""
+        self.begin(stage)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def sampled(self, row_number: int) -> bool:
+        """逐行循环中第row_number行是否需要详细计时"""
+        return row_number % self.lap_interval == 0
+
+    def mark(self) -> None:
+        """开始一行的lap计时"""
+        self._last_lap = _clock()
+
+    def lap(self, stage: str) -> None:
+        """把距上次lap（或mark）的时间记到stage"""
+        now = _clock()
+        self.lap_stages[stage] = self.lap_stages.get(stage, 0.0) + (now - self._last_lap)
+        self._last_lap = now
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """各阶段耗时，抽样计时的部分已按抽样间隔放大"""
+        stages = dict(self.stages)
+        for stage, seconds in self.lap_stages.items():
+            stages[stage] = stages.get(stage, 0.0) + seconds * self.lap_interval
+        return stages
+
+    def timed_iter(self, iterable: Iterable[T], stage: str, count_rows: bool = False) -> Iterator[T]:
+        """
+        包装迭代器，把产生元素所用的时间计入stage
+        每次成批取出TIMED_BLOCK_SIZE个元素再逐个产出；count_rows为True时按产出的元素数累计行数
+        """
+        iterator = iter(iterable)
+        while True:
+            self.begin(stage)
+            try:
+                block = list(itertools.islice(iterator, TIMED_BLOCK_SIZE))
+            finally:
+                self.end()
+            if not block:
+                return
+            if count_rows:
+                self.tick(len(block))
+            yield from block
+
+    # ---------- 计数 ----------
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def cache(self, name: str, hits: int = 0, misses: int = 0) -> None:
+        """累计缓存的命中和未命中次数"""
+        entry = self.caches.setdefault(name, [0, 0])
+        entry[0] += hits
+        entry[1] += misses
+
+    def tick(self, rows: int = 1) -> None:
+        """累计处理的行数，需要时刷新进度行"""
+        self.rows += rows
+        if self.progress:
+            now = _clock()
+            if now - self._last_progress >= PROGRESS_INTERVAL:
+                self._last_progress = now
+                self._show_progress(now)
+
+    def track_file(self, f: IO) -> None:
+        """按已读取的字节数显示进度（f为以文本方式打开、正在逐行读取的文件）"""
+        try:
+            self._total = os.fstat(f.fileno()).st_size
+        except (OSError, AttributeError, ValueError):
+            return
+        self._position = f.buffer.tell
+
+    def set_total_rows(self, total: int) -> None:
+        """按已处理的行数显示进度"""
+        self._total = total
+        self._position = lambda: self.rows
+
+    def _progress_fraction(self) -> Optional[float]:
+        if self._position is None or self._total <= 0:
+            return None
+        try:
+            return min(1.0, self._position() / self._total)
+        except (OSError, ValueError):
+            # 文件已关闭
+            return 1.0
+
+    def _show_progress(self, now: float) -> None:
+        elapsed = now - self._start
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        rss = peak_rss_bytes()
+        memory = f"  峰值内存 {rss / (1024 * 1024):.0f} MB" if rss else ""
+        fraction = self._progress_fraction()
+        if fraction is None:
+            stage = self._stack[-1][0] if self._stack else ""
+            line = f"{self.name}: {self.rows} 行  {rate:,.0f} 行/秒  {elapsed:.1f} 秒  {stage}{memory}"
+        else:
+            filled = int(fraction * PROGRESS_BAR_WIDTH)
+            bar = "#" * filled + "-" * (PROGRESS_BAR_WIDTH - filled)
+            remaining = f"  剩余 {elapsed * (1 - fraction) / fraction:.0f} 秒" if 0 < fraction < 1 else ""
+            line = f"{self.name} [{bar}] {fraction:6.1%}  {self.rows:,} 行  {rate:,.0f} 行/秒{remaining}{memory}"
+        sys.stderr.write(f"\r{line}   ")
+        sys.stderr.flush()
+        self._progress_shown = True
+
+    def finish_progress(self) -> None:
+        """结束进度行（换行），之后的输出不会与进度行重叠"""
+        if self._progress_shown:
+            self._show_progress(_clock())
+            sys.stderr.write("\n")
+            sys.stderr.flush()
+            self._progress_shown = False
+
+    # ---------- 输出 ----------
+
+    def to_dict(self, session: Optional['RunMetrics'] = None) -> Dict[str, object]:
+        wall = _clock() - self._start
+        stage_seconds = self.stage_seconds()
+        stages = {name: {"seconds": round(seconds, 6), "share": round(seconds / wall, 4) if wall > 0 else 0.0}
+                  for name, seconds in stage_seconds.items()}
+        report = {
+            "format": METRICS_FORMAT_VERSION,
+            "name": self.name,
+            "started": self.started.isoformat(timespec='seconds'),
+            "wall_seconds": round(wall, 6),
+            "stages": stages,
+            "lap_sample_interval": self.lap_interval if self.lap_stages else None,
+            "other_seconds": round(max(0.0, wall - sum(stage_seconds.values())), 6),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / wall, 1) if wall > 0 else None,
+            "counters": dict(self.counters),
+            "caches": {name: {"hits": hits, "misses": misses,
+                              "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None}
+                       for name, (hits, misses) in self.caches.items()},
+            "peak_rss_bytes": peak_rss_bytes(),
+            "peak_rss_children_bytes": peak_rss_bytes(children=True),
+            "pid": os.getpid(),
+        }
+        if session is not None and (session.stages or session.caches):
+            # 会话开始时一次性完成的工作（如读取码表、建立索引），不计入本次运行的总耗时
+            report["session"] = {
+                "stages": {name: round(seconds, 6) for name, seconds in session.stages.items()},
+                "caches": {name: {"hits": hits, "misses": misses} for name, (hits, misses) in session.caches.items()},
+            }
+        return report
+
+    def write(self, record_file: str, session: Optional['RunMetrics'] = None) -> Optional[str]:
+        """
+        将统计写入记录文件旁的JSON文件（记录文件名去掉扩展名加 .metrics.json），返回写入的路径
+        先写临时文件再替换；写入失败只打印警告
+        """
+        self.finish_progress()
+        metrics_file = os.path.splitext(record_file)[0] + METRICS_FILE_SUFFIX
+        tmp_file = f"{metrics_file}.{os.getpid()}.tmp"
+        try:
+            report = self.to_dict(session)
+            report["record_file"] = os.path.basename(record_file)
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+                f.write('\n')
+            os.replace(tmp_file, metrics_file)
+            return metrics_file
+        except Exception as e:
+            print(f"警告: 无法写入运行统计 {metrics_file}: {e}")
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            return None
+
+
+# 整个会话（进程）共用的统计，记录读取码表、加载索引等只在会话开始时做一次的工作
+_session_metrics: Optional[RunMetrics] = None
+
+
+def session_metrics() -> RunMetrics:
+    """获取会话统计，首次调用时创建"""
+    global _session_metrics
+    if _session_metrics is None:
+        _session_metrics = RunMetrics("session")
+    return _session_metrics
+
+
+class RowLog:
+    """
+    逐行提示信息（警告、跳过的行等）的收集器
+    详细模式下逐条打印；否则只按类别计数并保留每类的前几条示例，结束时用summary()打印汇总。
+    全部明细按 "类别\t信息" 保存在SpooledTemporaryFile中（超过ROW_LOG_SPOOL_BYTES后转存磁盘），
+    由details()读出写入记录文件
+    """
+
+    def __init__(self, verbosity: int = VERBOSITY_NORMAL):
+        self.verbosity = verbosity
+        self.counts: Dict[str, int] = {}
+        self.examples: Dict[str, List[str]] = {}
+        self._details = tempfile.SpooledTemporaryFile(max_size=ROW_LOG_SPOOL_BYTES, mode='w+', encoding='utf-8')
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, kind: str, message: str, record: bool = True) -> None:
+        """
+        记录一条提示：kind为类别（汇总时按类别计数），message为完整信息
+        record为False时只计数和打印，不写入明细（明细已另有记录，如失败文件）
+        """
+        count = self.counts.get(kind, 0)
+        self.counts[kind] = count + 1
+        if count < ROW_LOG_EXAMPLES:
+            self.examples.setdefault(kind, []).append(message)
+        if record:
+            self._details.write(f"{kind}\t{message}\n")
+        if self.verbosity >= VERBOSITY_VERBOSE:
+            print(message)
+
+    def merge(self, other: 'RowLog') -> None:
+        """并入另一个收集器的计数、示例和明细（不再打印）"""
+        for kind, count in other.counts.items():
+            examples = self.examples.setdefault(kind, [])
+            examples.extend(other.examples.get(kind, [])[:ROW_LOG_EXAMPLES - len(examples)])
+            self.counts[kind] = self.counts.get(kind, 0) + count
+        for kind, message in other.details():
+            self._details.write(f"{kind}\t{message}\n")
+
+    def details(self) -> Iterator[Tuple[str, str]]:
+        """按记录顺序产出全部明细 (类别, 信息)"""
+        self._details.flush()
+        position = self._details.tell()
+        self._details.seek(0)
+        try:
+            for line in self._details:
+                kind, _, message = line.rstrip('\n').partition('\t')
+                yield kind, message
+        finally:
+            self._details.seek(position)
+
+    def summary(self, title: str) -> None:
+        """
+        打印按类别的汇总；普通模式附带示例，详细模式已逐条打印过，只打印计数
+        没有任何提示时不打印
+        """
+        if not self.counts:
+            return
+        print(f"{title}（共 {len(self)} 条）:")
+        for kind, count in self.counts.items():
+            print(f"  {kind}: {count} 条")
+            if self.verbosity == VERBOSITY_NORMAL:
+                for message in self.examples.get(kind, []):
+                    print(f"    {message.strip()}")
+                if count > ROW_LOG_EXAMPLES:
+                    print(f"    ...")
+
+    def close(self) -> None:
+        self._details.close()
+
+    def __getstate__(self):
+        # 临时文件无法序列化，传给其他进程时改为传递明细文本
+        state = self.__dict__.copy()
+        state['_details'] = ''.join(f"{kind}\t{message}\n" for kind, message in self.details())
+        return state
+
+    def __setstate__(self, state):
+        details = state.pop('_details')
+        self.__dict__.update(state)
+        self._details = tempfile.SpooledTemporaryFile(max_size=ROW_LOG_SPOOL_BYTES, mode='w+', encoding='utf-8')
+        self._details.write(details)
@@ -0,0 +1,893 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+码表读写公共模块
+replace_weight.py、normalize_weights.py、corpus_weights.py和dict_compiler.py共用的部分：
+单元格分类与列类型识别、逐行校验与权重替换、原子写入、压缩备份库和外部排序
+"""
+
+import os
+import sys
+import re
+import shutil
+import tempfile
+import itertools
+import heapq
+import zlib
+import marshal
+import hashlib
+import difflib
+from typing import Dict, List, Tuple, Optional, Iterable, Iterator, Callable, TypeVar
+
+from run_report import RowLog, VERBOSITY_VERBOSE
+
+# 单元格分类用的正则，模块加载时编译一次
+CODE_PATTERN = re.compile(r'[a-z\s]+')
+LETTER_PATTERN = re.compile(r'[a-z]')
+CHINESE_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+
+# 无columns声明时，统计列类型最多抽取的行数
+COLUMN_SAMPLE_SIZE = 2000
+
+# Rime码表columns声明中的列名与本工具列类型的对应关系，其余列（如stem）不参与识别
+RIME_COLUMN_TYPES = {
+    "text": "phrase",
+    "code": "code",
+    "weight": "weight",
+}
+
+# 记录文件保存目录（跨平台兼容）：Windows沿用原来的D盘同步目录，其他系统放在用户目录下
+if sys.platform == 'win32':
+    RECORD_DIR = r"D:\OneDrive\Backup\RimeSync\update_record"
+else:
+    RECORD_DIR = os.path.join(os.path.expanduser("~"), "OneDrive", "Backup", "RimeSync", "update_record")
+
+# 备份库：记录目录下的子目录，更新前的原文件按内容哈希压缩保存
+BACKUP_STORE_DIR = "store"
+BACKUP_CATALOG_FILE = "catalog.txt"
+BACKUP_OBJECT_MAGIC = "rime-weight-backup"
+BACKUP_OBJECT_VERSION = 2
+# 旧版备份对象（zlib压缩的marshal元组：魔数、版本、类型、...）的版本号，仍可读取和恢复
+BACKUP_OBJECT_LEGACY_VERSION = 1
+# 备份时分块读取原文件的块大小（字符数）
+BACKUP_CHUNK_SIZE = 1 << 20
+# 超过此大小（字节）的文件不计算增量，直接流式保存完整快照，避免把整个文件读入内存
+BACKUP_DELTA_MAX_BYTES = 32 * 1024 * 1024
+# 增量链的最大长度，超过后保存一份完整快照，限制恢复时需要回放的增量数
+BACKUP_SNAPSHOT_INTERVAL = 10
+
+# 外部排序的默认内存上限（字节），replace_weight.py自动选择连接引擎时也以此为上限，可用 --memory-limit 修改
+JOIN_MEMORY_LIMIT = 1024 * 1024 * 1024
+# 外部排序时每条记录按此字节数估算，用于由内存上限计算每个排序段的记录数
+JOIN_RECORD_BYTES = 256
+# 外部排序每个排序段至少包含的记录数
+SORT_RUN_MIN_RECORDS = 10000
+
+T = TypeVar('T')
+
+
+def classify_cell(cell: str) -> str:
+    """
+    识别单个单元格（已去除首尾空白）的类型
+    返回 "weight"（正整数）、"code"（全小写字母，可以有空格）、"phrase" 或 "unknown"（空）
+    """
+    if not cell:
+        return "unknown"
+    # 检查是否为权重（正整数）；isdecimal与正则\d+的匹配范围相同
+    if cell.isdecimal():
+        return "weight"
+    # 检查是否为编码/拼音（全小写字母，可以有空格）
+    if CODE_PATTERN.fullmatch(cell) and LETTER_PATTERN.search(cell):
+        return "code"
+    # 其他情况都认为是词组（汉字、字母、数字、符号的组合）
+    return "phrase"
+
+
+def tokenize_line(line_content: str) -> Tuple[List[str], List[str]]:
+    """
+    按Tab分割一行并对每个单元格分类一次
+    返回 (原始单元格列表, 单元格类型列表)，类型结果供列类型检测、行验证和列查找共用
+    """
+    parts = line_content.split('\t')
+    return parts, [classify_cell(cell.strip()) for cell in parts]
+
+
+def sample_evenly(items: Iterable[T], size: int) -> List[T]:
+    """
+    从可迭代对象中等间隔抽样，只遍历一次且内存有界
+    保留的数量在size到2*size之间（总数不足size时全部保留）
+    """
+    sample = []
+    step = 1
+    for i, item in enumerate(items):
+        if i % step:
+            continue
+        sample.append(item)
+        if len(sample) >= size * 2:
+            sample = sample[::2]
+            step *= 2
+    return sample
+
+
+def parse_header_columns(comment_lines: List[str]) -> Optional[Dict[int, str]]:
+    """
+    解析Rime码表文件头（'...'之前）中的columns声明
+    支持列表写法（columns: 换行后逐行 - text）和行内写法（columns: [text, code, weight]）
+    返回列索引到列类型的映射（只包含text、code、weight列）；没有columns声明时返回None
+    """
+    names = None
+    for line in comment_lines:
+        content = line.split('#', 1)[0].rstrip()
+        if not content.strip() or content.strip() in ('---', '...'):
+            continue
+
+        if not content[0].isspace():
+            if names is not None:
+                # columns列表已结束
+                break
+            key, _, value = content.partition(':')
+            if key.strip() == 'columns':
+                names = []
+                value = value.strip()
+                if value.startswith('[') and value.endswith(']'):
+                    names = [item.strip().strip('"\'') for item in value[1:-1].split(',') if item.strip()]
+                    break
+            continue
+
+        item = content.strip()
+        if names is not None and item.startswith('-'):
+            names.append(item[1:].strip().strip('"\''))
+
+    column_types = {i: RIME_COLUMN_TYPES[name] for i, name in enumerate(names or [])
+                    if name in RIME_COLUMN_TYPES}
+    return column_types or None
+
+
+def detect_column_types(
+    data_lines: List[Tuple[int, str, str]],
+    tokenized_rows: Optional[List[Optional[Tuple[List[str], List[str]]]]] = None,
+    sample_size: Optional[int] = COLUMN_SAMPLE_SIZE
+) -> Dict[int, str]:
+    """
+    根据每行的内容特征识别每行的列类型
+    返回一个字典，键为列索引，值为列类型（"phrase", "code", "weight"）
+    采用逐行分析，统计每列出现类型的频率，选择频率最高的类型
+    只统计等间隔抽取的约sample_size行（None表示统计全部行）
+    已有tokenize_line的分类结果时直接使用，不再重新分类
+    """
+    if not data_lines:
+        return {}
+
+    # 收集非空行（抽样）的数据
+    row_indices = (i for i, (_, line_content, _) in enumerate(data_lines) if line_content.strip())
+    if sample_size is not None:
+        row_indices = sample_evenly(row_indices, sample_size)
+
+    def row_cell_types() -> Iterator[List[str]]:
+        for row_idx in row_indices:
+            # 识别该行每个单元格的类型
+            if tokenized_rows is not None and tokenized_rows[row_idx] is not None:
+                yield tokenized_rows[row_idx][1]
+            else:
+                yield tokenize_line(data_lines[row_idx][1])[1]
+
+    return column_types_from_cells(row_cell_types())
+
+
+def column_types_from_cells(cell_type_rows: Iterable[List[str]]) -> Dict[int, str]:
+    """
+    统计各行单元格类型，确定每列的类型
+    某类型占该列50%以上时确定为此类型，否则为"unknown"
+    """
+    column_stats = {}
+
+    for cell_types in cell_type_rows:
+        # 为每列统计特征
+        for i, cell_type in enumerate(cell_types):
+            if i not in column_stats:
+                column_stats[i] = {
+                    'total': 0,
+                    'phrase': 0,
+                    'code': 0,
+                    'weight': 0,
+                    'unknown': 0
+                }
+
+            column_stats[i]['total'] += 1
+            column_stats[i][cell_type] += 1
+
+    # 根据统计结果确定每列的类型
+    column_types = {}
+
+    for col_idx, stats in column_stats.items():
+        total = stats['total']
+        if total == 0:
+            continue
+
+        # 找到出现次数最多的类型
+        max_type = None
+        max_count = -1
+
+        for type_key in ('phrase', 'code', 'weight'):
+            if stats[type_key] > max_count:
+                max_count = stats[type_key]
+                max_type = type_key
+
+        # 如果最高频率的类型占总数的50%以上，就确定为此类型
+        if max_count / total >= 0.5:
+            column_types[col_idx] = max_type
+        else:
+            # 频率不够高，无法确定类型
+            column_types[col_idx] = "unknown"
+
+    return column_types
+
+
+def analyze_row_pattern(parts: List[str]) -> Dict[int, str]:
+    """
+    分析单行的列模式，返回每个列索引对应的类型
+    """
+    return {i: classify_cell(cell.strip()) for i, cell in enumerate(parts)}
+
+
+def validate_row_by_column_types(
+    parts: List[str],
+    column_types: Dict[int, str],
+    cell_types: Optional[List[str]] = None
+) -> List[str]:
+    """根据列类型验证行数据，已有单元格分类结果时直接比较类型"""
+    errors = []
+
+    for col_idx, col_type in column_types.items():
+        if col_idx >= len(parts):
+            errors.append(f"列{col_idx}不存在")
+            continue
+
+        cell_type = cell_types[col_idx] if cell_types is not None else classify_cell(parts[col_idx].strip())
+
+        if cell_type == "unknown":
+            errors.append(f"{col_type}列为空")
+            continue
+
+        if col_type == "weight":
+            # 权重列必须是正整数
+            if cell_type != "weight":
+                errors.append(f"权重列不是正整数: '{parts[col_idx].strip()}'")
+        elif col_type == "code":
+            # 编码列必须是全小写字母，可以有空格
+            if cell_type != "code":
+                errors.append(f"编码/拼音列不是小写英文字母（可包含空格）: '{parts[col_idx].strip()}'")
+        # 词组列只需要非空即可；未知列类型，跳过验证
+
+    return errors
+
+
+def find_columns_by_type_for_row(
+    parts: List[str],
+    column_types: Dict[int, str],
+    cell_types: Optional[List[str]] = None
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    根据列类型和行内容找到该行的词组列和权重列
+    返回 (phrase_col, weight_col)
+    如果找不到，返回 (None, None)
+    """
+    # 首先尝试使用统计得出的列类型
+    phrase_col = None
+    weight_col = None
+
+    for col_idx, col_type in column_types.items():
+        if col_idx < len(parts):
+            if col_type == "phrase" and phrase_col is None:
+                phrase_col = col_idx
+            elif col_type == "weight" and weight_col is None:
+                weight_col = col_idx
+
+    # 如果统计类型找不到，使用该行的单元格分类结果
+    if phrase_col is None or weight_col is None:
+        if cell_types is None:
+            cell_types = [classify_cell(cell.strip()) for cell in parts]
+
+        # 在行模式中寻找词组和权重
+        for col_idx, cell_type in enumerate(cell_types):
+            if cell_type == "phrase" and phrase_col is None:
+                phrase_col = col_idx
+            elif cell_type == "weight" and weight_col is None:
+                weight_col = col_idx
+
+    # 如果仍然找不到，使用启发式方法
+    if phrase_col is None:
+        for col_idx, cell in enumerate(parts):
+            cell = cell.strip()
+            if cell and CHINESE_PATTERN.search(cell):
+                phrase_col = col_idx
+                break
+
+    return phrase_col, weight_col
+
+
+def resolve_row(
+    parts: List[str],
+    cell_types: List[str],
+    column_types: Dict[int, str]
+) -> Tuple[List[str], Optional[int], Optional[int]]:
+    """
+    使用一次分类的结果完成行验证和列查找
+    返回 (验证错误列表, 词组列, 权重列)
+    """
+    errors = validate_row_by_column_types(parts, column_types, cell_types)
+    phrase_col, weight_col = find_columns_by_type_for_row(parts, column_types, cell_types)
+    return errors, phrase_col, weight_col
+
+
+def iter_valid_rows(
+    rows: Iterable[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]],
+    column_types: Dict[int, str],
+    log: Optional[RowLog] = None
+) -> Iterator[Tuple[int, str, str, str]]:
+    """
+    逐行校验数据行，跳过无效行并把警告记入log（未指定时逐条打印）
+    rows为 (行索引, 行内容, 原始行, 单元格分类结果)，产出有效行的 (行索引, 行内容, 词组, 权重)
+    """
+    if log is None:
+        log = RowLog(VERBOSITY_VERBOSE)
+    for line_num, line_content, _, row in rows:
+        if row is None:
+            continue
+
+        parts, cell_types = row
+
+        # 跳过没有足够列的行
+        if len(parts) < 2:
+            log.add("列数不足", f"警告: 第{line_num+1}行列数不足，已跳过")
+            continue
+
+        # 验证行数据并查找该行的词组列和权重列
+        errors, phrase_col, weight_col = resolve_row(parts, cell_types, column_types)
+        if errors:
+            log.add("数据验证失败", f"警告: 第{line_num+1}行数据验证失败: {'; '.join(errors)}")
+
+        if phrase_col is None or weight_col is None:
+            log.add("无法确定词组列或权重列", f"警告: 第{line_num+1}行无法确定词组列或权重列，已跳过")
+            continue
+
+        phrase = parts[phrase_col].strip()
+        weight = parts[weight_col].strip() if weight_col < len(parts) else ""
+
+        # 验证词组和权重
+        if not phrase:
+            log.add("词组列为空", f"警告: 第{line_num+1}行词组列为空，已跳过")
+            continue
+
+        if weight == "":  # 权重为空字符串
+            log.add("权重列为空", f"警告: 第{line_num+1}行权重列为空，已跳过")
+            continue
+
+        yield line_num, line_content, phrase, weight
+
+
+class BackupStore:
+    """
+    按内容寻址的压缩备份库
+    每个文件版本以内容的sha256为键只保存一次（zlib压缩）；
+    同一文件的新版本只保存与上一版本之间的行级增量，增量链过长时保存完整快照。
+    catalog.txt 逐行记录 "时间戳\t哈希\t文件路径"，用于查找每个文件的上一版本和列出备份
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.catalog_file = os.path.join(store_dir, BACKUP_CATALOG_FILE)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.store_dir, "objects", digest[:2], digest)
+
+    def entries(self) -> List[Tuple[str, str, str]]:
+        """返回备份目录中的全部记录 [(时间戳, 哈希, 文件路径)]，按保存顺序"""
+        try:
+            with open(self.catalog_file, 'r', encoding='utf-8') as f:
+                return [tuple(line.rstrip('\n').split('\t', 2)) for line in f if line.count('\t') >= 2]
+        except FileNotFoundError:
+            return []
+
+    def _object_header(self, kind: str, *fields: object) -> bytes:
+        """对象解压后的第一行：魔数 版本 类型 [基准版本 增量链长度]"""
+        return ' '.join((BACKUP_OBJECT_MAGIC, str(BACKUP_OBJECT_VERSION), kind) + tuple(map(str, fields))).encode() + b'\n'
+
+    def _read_header(self, digest: str) -> Tuple[str, Optional[str], int]:
+        """只解压对象开头，返回 (类型, 基准版本, 增量链长度)，完整快照的增量链长度为0"""
+        decompressor = zlib.decompressobj()
+        data = b''
+        with open(self._object_path(digest), 'rb') as f:
+            while b'\n' not in data:
+                chunk = f.read(4096)
+                if not chunk:
+                    break
+                data += decompressor.decompress(chunk)
+        if not data.startswith(BACKUP_OBJECT_MAGIC.encode()):
+            # 旧版对象没有文本头，只能整体解压
+            kind, *rest = self._read_object(digest)
+            return (kind, None, 0) if kind == "full" else (kind, rest[0], rest[1])
+        fields = data.split(b'\n', 1)[0].decode('utf-8', 'replace').split()
+        if len(fields) < 3 or fields[0] != BACKUP_OBJECT_MAGIC or fields[1] != str(BACKUP_OBJECT_VERSION):
+            raise ValueError(f"备份对象格式不支持: {digest}")
+        if fields[2] == "full":
+            return "full", None, 0
+        return fields[2], fields[3], int(fields[4])
+
+    def _read_object(self, digest: str) -> tuple:
+        """读取整个对象，返回 ("full", 内容) 或 ("delta", 基准版本, 增量链长度, 增量)"""
+        with open(self._object_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if not data.startswith(BACKUP_OBJECT_MAGIC.encode()):
+            return self._read_legacy_object(digest, data)
+        header, _, body = data.partition(b'\n')
+        fields = header.decode('utf-8', 'replace').split()
+        if len(fields) < 3 or fields[0] != BACKUP_OBJECT_MAGIC or fields[1] != str(BACKUP_OBJECT_VERSION):
+            raise ValueError(f"备份对象格式不支持: {digest}")
+        if fields[2] == "full":
+            return "full", body.decode('utf-8')
+        return "delta", fields[3], int(fields[4]), marshal.loads(body)
+
+    @staticmethod
+    def _read_legacy_object(digest: str, data: bytes) -> tuple:
+        """解析旧版对象：marshal元组 (魔数, 版本, "full", 内容) 或 (魔数, 版本, "delta", 基准版本, 增量链长度, 增量)"""
+        try:
+            payload = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            raise ValueError(f"备份对象格式不支持: {digest}")
+        if (not isinstance(payload, tuple) or len(payload) < 4 or payload[0] != BACKUP_OBJECT_MAGIC
+                or payload[1] != BACKUP_OBJECT_LEGACY_VERSION):
+            raise ValueError(f"备份对象格式不支持: {digest}")
+        return payload[2:]
+
+    def _write_object(self, digest: str, compressed_chunks: Iterable[bytes]) -> None:
+        """先写临时文件再替换，多个进程同时保存时不会读到半个对象"""
+        path = self._object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                for chunk in compressed_chunks:
+                    f.write(chunk)
+            os.replace(tmp_file, path)
+        except BaseException:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _compress_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """流式压缩，内存占用与内容大小无关"""
+        compressor = zlib.compressobj()
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+    @staticmethod
+    def _line_delta(old_lines: List[str], new_lines: List[str]) -> list:
+        """
+        计算行级增量：元素为 (起, 止) 表示复制旧版本的行区间，为列表表示插入的新行
+        行数相同（只改权重的常见情况）时逐行比较，否则使用difflib对齐
+        """
+        ops: list = []
+        if len(old_lines) == len(new_lines):
+            start = None
+            for i, (old, new) in enumerate(zip(old_lines, new_lines)):
+                if old == new:
+                    if start is None:
+                        start = i
+                    continue
+                if start is not None:
+                    ops.append((start, i))
+                    start = None
+                if ops and isinstance(ops[-1], list):
+                    ops[-1].append(new)
+                else:
+                    ops.append([new])
+            if start is not None:
+                ops.append((start, len(old_lines)))
+            return ops
+
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                ops.append((i1, i2))
+            elif j2 > j1:
+                ops.append(new_lines[j1:j2])
+        return ops
+
+    def _previous_version(self, file_path: str) -> Optional[str]:
+        """同一文件最近一次备份的版本哈希"""
+        for _, digest, old_path in reversed(self.entries()):
+            if old_path == file_path:
+                return digest
+        return None
+
+    def save(self, file_path: str, timestamp: str, content: Optional[str] = None) -> str:
+        """
+        保存文件的一个版本，返回其内容哈希；相同内容已存在时只追加目录记录
+        content为None时分块读取文件：大文件只计算哈希并流式压缩为完整快照，不整体读入内存
+        """
+        file_path = os.path.abspath(file_path)
+
+        def text_chunks() -> Iterator[str]:
+            if content is not None:
+                yield content
+                return
+            with open(file_path, 'r', encoding='utf-8') as f:
+                while True:
+                    block = f.read(BACKUP_CHUNK_SIZE)
+                    if not block:
+                        return
+                    yield block
+
+        sha = hashlib.sha256()
+        for block in text_chunks():
+            sha.update(block.encode('utf-8'))
+        digest = sha.hexdigest()
+
+        if not os.path.exists(self._object_path(digest)):
+            compressed = None
+
+            # 以同一文件最近一次备份为基准保存增量；大文件跳过，直接保存完整快照
+            previous = self._previous_version(file_path)
+            if previous is not None and (content is not None
+                                         or os.path.getsize(file_path) <= BACKUP_DELTA_MAX_BYTES):
+                try:
+                    depth = self._read_header(previous)[2] + 1
+                    if depth < BACKUP_SNAPSHOT_INTERVAL:
+                        text = content if content is not None else ''.join(text_chunks())
+                        ops = self._line_delta(self.load(previous).splitlines(True), text.splitlines(True))
+                        delta = zlib.compress(self._object_header("delta", previous, depth) + marshal.dumps(ops))
+                        full = zlib.compress(self._object_header("full") + text.encode('utf-8'))
+                        # 大面积改动时增量可能比完整快照还大，取较小者
+                        compressed = [delta if len(delta) < len(full) else full]
+                except (OSError, ValueError, EOFError, zlib.error) as e:
+                    print(f"警告: 读取上一备份版本失败，保存完整快照: {str(e)}")
+
+            if compressed is None:
+                raw_chunks = itertools.chain(
+                    [self._object_header("full")],
+                    (block.encode('utf-8') for block in text_chunks())
+                )
+                compressed = self._compress_stream(raw_chunks)
+            self._write_object(digest, compressed)
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.catalog_file, 'a', encoding='utf-8') as f:
+            f.write(f"{timestamp}\t{digest}\t{file_path}\n")
+        return digest
+
+    def load(self, digest: str) -> str:
+        """还原某个版本的完整内容，并校验内容哈希"""
+        # 沿增量链找到完整快照，再依次回放增量
+        chain = []
+        current = digest
+        while True:
+            kind, *rest = self._read_object(current)
+            if kind == "full":
+                content = rest[0]
+                break
+            chain.append(rest[2])
+            current = rest[0]
+
+        for ops in reversed(chain):
+            old_lines = content.splitlines(True)
+            new_lines: List[str] = []
+            for op in ops:
+                if isinstance(op, tuple):
+                    new_lines.extend(old_lines[op[0]:op[1]])
+                else:
+                    new_lines.extend(op)
+            content = ''.join(new_lines)
+
+        if hashlib.sha256(content.encode('utf-8')).hexdigest() != digest:
+            raise ValueError(f"备份版本 {digest} 校验失败")
+        return content
+
+    def resolve(self, prefix: str) -> Tuple[str, Optional[str]]:
+        """
+        根据哈希（或唯一前缀）查找备份版本，返回 (完整哈希, 原文件路径)
+        找不到或前缀不唯一时抛出ValueError
+        """
+        matches: Dict[str, Optional[str]] = {}
+        for _, digest, file_path in self.entries():
+            if digest.startswith(prefix):
+                matches[digest] = file_path
+        if not matches and len(prefix) == 64 and os.path.exists(self._object_path(prefix)):
+            matches[prefix] = None
+        if not matches:
+            raise ValueError(f"找不到备份版本: {prefix}")
+        if len(matches) > 1:
+            raise ValueError(f"备份版本前缀 '{prefix}' 不唯一，匹配到 {len(matches)} 个版本")
+        return next(iter(matches.items()))
+
+    def restore(self, prefix: str, output_file: Optional[str] = None) -> str:
+        """将备份版本写回原文件（或output_file），返回写入的文件路径"""
+        digest, file_path = self.resolve(prefix)
+        target = output_file or file_path
+        if not target:
+            raise ValueError(f"备份版本 {digest} 没有记录原文件路径，请指定输出文件")
+        content = self.load(digest)
+        write_file_atomically(target, content.splitlines(True))
+        return target
+
+
+def backup_original_file(
+    record_dir: str,
+    file_path: str,
+    timestamp: str,
+    content: Optional[str] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    在覆盖文件之前把原文件存入备份库
+    返回 (版本哈希, None)；备份库不可用时返回 (None, 原文件内容)，由更新记录完整保存原内容
+    """
+    try:
+        store = BackupStore(os.path.join(record_dir, BACKUP_STORE_DIR))
+        return store.save(file_path, timestamp, content), None
+    except Exception as e:
+        print(f"警告: 保存到备份库失败，原文件内容将写入记录: {str(e)}")
+
+    try:
+        if content is None:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        return None, content
+    except Exception as e:
+        print(f"警告: 读取原文件失败: {str(e)}")
+        return None, None
+
+
+def write_file_atomically(
+    file_path: str,
+    lines: Iterable[str],
+    before_commit: Optional[Callable[[], bool]] = None
+) -> bool:
+    """
+    将lines流式写入同目录下的临时文件，fsync后原子替换原文件
+    写入过程中出错或进程被终止时原文件保持不变，最多留下一个临时文件
+    before_commit在替换前调用（如备份原文件），返回False时放弃替换
+    返回是否已替换
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(file_path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # 保留原文件的权限位；新建文件时按umask设置（mkstemp创建的文件只有所有者可读写）
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_file)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_file, 0o666 & ~umask)
+
+        if before_commit is not None and not before_commit():
+            os.remove(tmp_file)
+            return False
+
+        os.replace(tmp_file, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+    # 同步目录项，保证替换本身也已落盘（Windows不支持对目录fsync）
+    if os.name == 'posix':
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return True
+
+
+def scan_file_layout(file_path: str) -> Tuple[int, Dict[int, str]]:
+    """
+    流式确定文件头行数和列类型，不把整个文件读入内存
+    返回 (文件头行数（含'...'行，没有'...'时为0）, 列类型)
+    """
+    # 先找'...'所在行，通常在文件开头附近，找到即停止读取
+    header_line_count = 0
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if line.rstrip('\n').strip() == '...':
+                header_line_count = i + 1
+                break
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        comment_lines = list(itertools.islice(f, header_line_count))
+
+        # 文件头声明了columns时直接使用声明的列位置，否则对数据行等间隔抽样统计
+        column_types = parse_header_columns(comment_lines)
+        if column_types is not None:
+            print(f"列类型（文件头columns声明）: {column_types}")
+            return header_line_count, column_types
+
+        contents = (line.rstrip('\n') for line in f)
+        sample = sample_evenly((content for content in contents if content.strip()), COLUMN_SAMPLE_SIZE)
+
+    column_types = column_types_from_cells(tokenize_line(content)[1] for content in sample)
+    print(f"列类型检测结果: {column_types}")
+    return header_line_count, column_types
+
+
+def stream_data_rows(
+    lines: Iterable[str],
+    first_line_num: int
+) -> Iterator[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]]:
+    """逐行产出 (行索引, 行内容, 原始行, 单元格分类结果)，空行的分类结果为None"""
+    for line_num, line in enumerate(lines, first_line_num):
+        line_content = line.rstrip('\n')
+        yield line_num, line_content, line, tokenize_line(line_content) if line_content.strip() else None
+
+
+def iter_file_rows(
+    file_path: str,
+    header_line_count: int
+) -> Iterator[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]]:
+    """跳过文件头，逐行产出文件的数据行"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for _ in itertools.islice(f, header_line_count):
+            pass
+        yield from stream_data_rows(f, header_line_count)
+
+
+class SubstitutionResult:
+    """一次权重替换的统计结果"""
+
+    def __init__(self):
+        self.row_count = 0
+        self.updated_count = 0
+        self.not_found_count = 0
+        self.error_count = 0
+        self.modified_lines: List[str] = []
+        # [(数据行序号, 词组, 新行)]，方向2写入后同步到基础文件索引
+        self.changes: List[Tuple[int, str, str]] = []
+
+
+def substitute_weights(
+    rows: Iterable[Tuple[int, str, str, Optional[Tuple[List[str], List[str]]]]],
+    column_types: Dict[int, str],
+    lookup: Callable[[int, str], Optional[str]],
+    label: str,
+    result: SubstitutionResult,
+    log: Optional[RowLog] = None
+) -> Iterator[str]:
+    """
+    逐行替换权重并产出输出行，两个替换方向、两种连接引擎共用
+    rows为 (行索引, 行内容, 原始行, 单元格分类结果)，label为提示信息中的文件称呼
+    lookup(数据行序号, 词组) 返回新权重，未找到时返回None；按数据行顺序调用
+    统计结果累加到result中，警告记入log（未指定时逐条打印）
+    """
+    if log is None:
+        log = RowLog(VERBOSITY_VERBOSE)
+    for index, (line_num, line_content, original_line, row) in enumerate(rows):
+        result.row_count += 1
+
+        # 跳过空行
+        if row is None:
+            yield original_line
+            continue
+
+        # 检查分隔符
+        if '\t' not in line_content:
+            log.add("未找到Tab分隔符", f"警告: {label}第{line_num+1}行未找到Tab分隔符，已跳过: {line_content}")
+            yield original_line
+            result.error_count += 1
+            continue
+
+        # 复制一份单元格，替换权重时不改动分类结果
+        parts = list(row[0])
+        cell_types = row[1]
+
+        # 跳过没有足够列的行
+        if len(parts) < 2:
+            log.add("列数不足", f"警告: {label}第{line_num+1}行列数不足，已跳过")
+            yield original_line
+            result.error_count += 1
+            continue
+
+        # 验证行数据并查找该行的词组列和权重列
+        errors, phrase_col, weight_col = resolve_row(parts, cell_types, column_types)
+        if errors:
+            log.add("数据验证失败", f"警告: {label}第{line_num+1}行数据验证失败: {'; '.join(errors)}")
+
+        if phrase_col is None:
+            log.add("词组列不存在", f"警告: {label}第{line_num+1}行词组列不存在，已跳过")
+            yield original_line
+            result.error_count += 1
+            continue
+
+        if weight_col is None:
+            log.add("权重列不存在", f"警告: {label}第{line_num+1}行权重列不存在，已跳过")
+            yield original_line
+            result.error_count += 1
+            continue
+
+        phrase = parts[phrase_col].strip()
+
+        # 提取原始权重
+        original_weight = parts[weight_col].strip() if weight_col < len(parts) else ""
+
+        # 在另一个文件中查找
+        new_weight = lookup(index, phrase)
+        if new_weight is None:
+            # 未找到，保持原样
+            yield original_line
+            result.not_found_count += 1
+            continue
+
+        # 如果权重相同，不需要修改
+        if original_weight == new_weight:
+            yield original_line
+            continue
+
+        # 替换权重列并重新构建行
+        parts[weight_col] = new_weight
+        updated_line = '\t'.join(parts) + '\n'
+        yield updated_line
+
+        # 记录被修改的原始行内容
+        result.modified_lines.append(line_content)
+        result.changes.append((index, phrase, updated_line))
+        result.updated_count += 1
+
+
+def _write_run(records: List[Tuple[str, int, str]], tmp_dir: str) -> str:
+    """将已排序的一段记录写入临时文件，每行 "词组\t序号\t值"（词组和值都来自Tab分割的单元格，不含Tab和换行）"""
+    fd, run_file = tempfile.mkstemp(suffix='.run', dir=tmp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+        f.writelines(f"{key}\t{seq}\t{value}\n" for key, seq, value in records)
+    return run_file
+
+
+def _read_run(run_file: str) -> Iterator[Tuple[str, int, str]]:
+    with open(run_file, 'r', encoding='utf-8', newline='\n') as f:
+        for line in f:
+            key, seq, value = line[:-1].split('\t')
+            yield key, int(seq), value
+
+
+def external_sort(
+    records: Iterable[Tuple[str, int, str]],
+    tmp_dir: str,
+    memory_limit: int,
+    by_seq: bool = False
+) -> Iterator[Tuple[str, int, str]]:
+    """
+    外部排序 (键, 序号, 值) 记录：每段在内存中排序后写入临时文件，再用heapq.merge多路归并
+    默认按 (键, 序号) 排序，by_seq为True时按序号排序；记录数不超过一段时不落盘
+    """
+    run_records = max(SORT_RUN_MIN_RECORDS, memory_limit // JOIN_RECORD_BYTES)
+    sort_key = (lambda record: record[1]) if by_seq else None
+    run_files = []
+    try:
+        iterator = iter(records)
+        while True:
+            chunk = list(itertools.islice(iterator, run_records))
+            chunk.sort(key=sort_key)
+            if len(chunk) < run_records and not run_files:
+                yield from chunk
+                return
+            if chunk:
+                run_files.append(_write_run(chunk, tmp_dir))
+            if len(chunk) < run_records:
+                break
+            del chunk
+
+        yield from heapq.merge(*(_read_run(run_file) for run_file in run_files), key=sort_key)
+    finally:
+        for run_file in run_files:
+            try:
+                os.remove(run_file)
+            except OSError:
+                pass
@@ -10,14 +10,58 @@ import sys
 import subprocess
 import re
 import datetime
+import time
 import importlib
-from typing import Dict, Set, Tuple, Optional, List, Any
+import marshal
+import mmap
+import struct
+import shutil
+import heapq
+import argparse
+import itertools
+import collections
+import collections.abc
+import functools
+import multiprocessing
+from array import array
+from typing import Dict, Set, Tuple, Optional, List, Any, Callable, Iterable, Iterator, Sequence, Mapping
+
+from run_report import (RunMetrics, RowLog, session_metrics, progress_enabled,
+                        VERBOSITY_QUIET, VERBOSITY_NORMAL, VERBOSITY_VERBOSE)
 
 # 文件常量定义
 SINGLE_CHAR_FILE = "86word-8105-better.txt"
 PHRASE_WEIGHT_FILE = "phrase_weight.txt"
 OUTPUT_FILE = "wubi.user.dict.yaml"
 FAIL_FILE = "fail.txt"
+DUOYIN_FILE = "duoyin.dict.yaml"
+# 主词库（位于cn_dicts的上一级目录），其import_tables列出全部导入词库
+MAIN_DICT_FILE = os.path.join("..", "wubi.dict.yaml")
+
+# 词语索引文件
+PHRASE_INDEX_FILE = "wubi.phrase_index.cache"
+PHRASE_INDEX_MAGIC = "wubi-phrase-index"
+PHRASE_INDEX_VERSION = 2
+
+# 中文字符（基本区）
+CHINESE_CHAR_RE = re.compile(r'[\u4e00-\u9fff]')
+
+# 单字编码表编译缓存：与源文件同目录，文件名为源文件名加此后缀
+CHAR_TABLE_CACHE_SUFFIX = ".cache"
+CHAR_TABLE_CACHE_MAGIC = "wubi-char-table"
+CHAR_TABLE_CACHE_VERSION = 1
+
+# 词语权重表编译文件：与源文件同目录，文件名为源文件名加此后缀
+PHRASE_WEIGHT_STORE_SUFFIX = ".cache"
+PHRASE_WEIGHT_STORE_MAGIC = b"wubi-pws"
+# 版本2起跳过无效权重的行（版本1按0保存），旧编译文件需要重新编译
+PHRASE_WEIGHT_STORE_VERSION = 2
+# 文件头：标识、版本、字节序（1为小端）、词语数、源文件大小、源文件修改时间
+PHRASE_WEIGHT_STORE_HEADER = struct.Struct('<8sHHIqq')
+# 按首字分桶：基本多文种平面的每个字一个桶，其余各平面的字共用最后一个桶
+PHRASE_WEIGHT_STORE_BUCKETS = 0x10001
+# 权重以int64保存，超过此值的权重无法编译
+PHRASE_WEIGHT_MAX = 2 ** 63 - 1
 
 class Config:
     """配置参数"""
@@ -32,6 +76,36 @@ class Config:
     
     # 默认权重值
     DEFAULT_WEIGHT = "100"
+
+    # 补充单字编码表（如扩展B区字表），存在时与主码表合并，主码表优先
+    EXTRA_CHAR_FILES: List[str] = []
+
+    # 文件批量处理的并行进程数：0表示自动（行数达到阈值时使用全部CPU核心），1表示不并行
+    BATCH_WORKERS = 0
+    # 自动并行的最小输入文件大小（字节，约10万行）
+    PARALLEL_MIN_BYTES = 2 * 1024 * 1024
+    # 每个进程每次处理的行数
+    BATCH_CHUNK_SIZE = 5000
+
+    # 拼音首字母整词缓存的最大条目数
+    PINYIN_CACHE_SIZE = 200000
+
+    # 输出文件写入缓冲：缓冲内容达到此字节数或距上次写入超过此秒数时提交一次
+    WRITER_BUFFER_SIZE = 256 * 1024
+    WRITER_FLUSH_INTERVAL = 5.0
+
+    # 文件批量处理时总是在终端显示进度条（默认只在标准错误输出为终端时显示；
+    # 各阶段耗时等统计总会写入记录文件旁的 .metrics.json）
+    SHOW_PROGRESS = False
+
+    # 输出详细程度：VERBOSITY_QUIET 只显示进度条和各类别计数，VERBOSITY_NORMAL 计数并列出几条示例，
+    # VERBOSITY_VERBOSE 逐行打印处理结果（不显示进度条）；逐行明细总会写入处理记录
+    VERBOSITY = VERBOSITY_NORMAL
+    
+    # 添加词组时报告新词条在同码候选中的预计位置（按权重从大到小），批量处理时汇总排在首位之后的重码
+    SHOW_CANDIDATE_RANK = True
+    # 查询编码前缀（如 aa*）时最多列出的编码数
+    CODE_QUERY_LIMIT = 20
     
     # 需要检查的Python包
     REQUIRED_PACKAGES = ["pypinyin"]
@@ -87,6 +161,142 @@ def check_and_install_packages():
     
     print("-" * 30)
 
+class PinyinInitialsProvider:
+    """
+    拼音首字母提供器
+    - 预先为单字编码表中的每个汉字计算拼音首字母，并标记有多个首字母的多音字
+    - 读取duoyin.dict.yaml中的多音字词组读音，作为整词的首字母覆盖表
+    - 整词结果缓存在LRU中；只有含多音字且不在覆盖表中的词才调用pypinyin按整词取音
+    """
+
+    def __init__(self, chars: Iterable[str] = (), override_file: str = DUOYIN_FILE,
+                 cache_size: Optional[int] = None):
+        self.available = True
+        self.char_initials: Dict[str, str] = {}
+        self.polyphonic_chars: Set[str] = set()
+        self.overrides: Dict[str, str] = {}
+        self._lazy_pinyin = None
+        self._first_letter_style = None
+        self._cache_size = Config.PINYIN_CACHE_SIZE if cache_size is None else cache_size
+        self._phrase_initials = functools.lru_cache(maxsize=self._cache_size)(self._compute_initials)
+
+        try:
+            # 动态导入pypinyin，避免没有安装时直接报错
+            from pypinyin import lazy_pinyin, pinyin, Style
+        except ImportError:
+            print("警告: pypinyin模块未安装，无法获取拼音首字母")
+            self.available = False
+            return
+
+        self._lazy_pinyin = lazy_pinyin
+        self._first_letter_style = Style.FIRST_LETTER
+        self._build_char_table(chars, pinyin)
+        self._load_overrides(override_file)
+
+    def __getstate__(self):
+        # pypinyin函数和LRU缓存无法序列化，传给其他进程后重新获取
+        state = self.__dict__.copy()
+        state['_lazy_pinyin'] = None
+        state['_first_letter_style'] = None
+        state['_phrase_initials'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._phrase_initials = functools.lru_cache(maxsize=self._cache_size)(self._compute_initials)
+        if self.available:
+            from pypinyin import lazy_pinyin, Style
+            self._lazy_pinyin = lazy_pinyin
+            self._first_letter_style = Style.FIRST_LETTER
+
+    def _build_char_table(self, chars: Iterable[str], pinyin) -> None:
+        """一次性计算所有汉字的默认首字母和多音字集合"""
+        chinese_chars = sorted({char for char in chars if len(char) == 1 and CHINESE_CHAR_RE.fullmatch(char)})
+        if not chinese_chars:
+            return
+        # 以列表传入时pypinyin逐字取音，不做分词
+        readings = pinyin(chinese_chars, style=self._first_letter_style, heteronym=True)
+        if len(readings) != len(chinese_chars):
+            return
+        for char, letters in zip(chinese_chars, readings):
+            letters = [letter.lower() for letter in letters if letter]
+            if not letters:
+                continue
+            self.char_initials[char] = letters[0]
+            if len(set(letters)) > 1:
+                self.polyphonic_chars.add(char)
+
+    def _load_overrides(self, filename: str) -> None:
+        """读取多音字词库中词组的拼音，生成整词首字母覆盖表"""
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                in_header = True
+                for line in f:
+                    line = line.rstrip('\n')
+                    if in_header:
+                        if line.strip() == '...':
+                            in_header = False
+                        continue
+                    parts = line.split('\t')
+                    if len(parts) < 2 or line.startswith('#'):
+                        continue
+                    chinese_chars = extract_chinese_chars(parts[0])
+                    initials = ''.join(syllable[0] for syllable in parts[1].split()).lower()
+                    if chinese_chars and len(initials) == len(chinese_chars):
+                        self.overrides.setdefault(chinese_chars, initials)
+        except Exception as e:
+            print(f"读取多音字词库 {filename} 时出错: {e}")
+
+    def _compute_initials(self, chinese_chars: str) -> str:
+        """计算只含中文字符的词组的首字母（未缓存）"""
+        override = self.overrides.get(chinese_chars)
+        if override is not None:
+            return override
+
+        table = self.char_initials
+        polyphonic = self.polyphonic_chars
+        if all(char in table and char not in polyphonic for char in chinese_chars):
+            return ''.join([table[char] for char in chinese_chars])
+
+        try:
+            return ''.join(self._lazy_pinyin(chinese_chars, style=self._first_letter_style)).lower()
+        except Exception as e:
+            print(f"获取拼音首字母时出错: {e}")
+            return ""
+
+    def initials(self, text: str) -> str:
+        """获取文本中中文字符的拼音首字母（小写），非中文字符忽略"""
+        if not self.available:
+            return ""
+        chinese_chars = extract_chinese_chars(text)
+        if not chinese_chars:
+            return ""
+        return self._phrase_initials(chinese_chars)
+
+    def initials_batch(self, texts: Iterable[str]) -> List[str]:
+        """批量获取拼音首字母，返回顺序与输入一致"""
+        return [self.initials(text) for text in texts]
+
+    def cache_info(self):
+        """整词LRU缓存的命中统计"""
+        return self._phrase_initials.cache_info()
+
+# 全局共用的拼音首字母提供器，首次使用时创建
+_pinyin_provider: Optional[PinyinInitialsProvider] = None
+
+def get_pinyin_provider(char_codes: Optional[Dict[str, str]] = None) -> PinyinInitialsProvider:
+    """
+    获取全局共用的拼音首字母提供器
+    首次传入单字编码表时按编码表中的汉字预先计算首字母表
+    """
+    global _pinyin_provider
+    if _pinyin_provider is None or (char_codes and not _pinyin_provider.char_initials
+                                    and _pinyin_provider.available):
+        _pinyin_provider = PinyinInitialsProvider(char_codes or ())
+    return _pinyin_provider
+
 def get_pinyin_initials(text):
     """
     获取中文字符的拼音首字母
@@ -97,26 +307,7 @@ def get_pinyin_initials(text):
     Returns:
         拼音首字母字符串（小写），非中文字符忽略
     """
-    try:
-        # 动态导入pypinyin，避免没有安装时直接报错
-        from pypinyin import lazy_pinyin, Style
-        
-        # 只提取中文字符
-        chinese_chars = extract_chinese_chars(text)
-        if not chinese_chars:
-            return ""
-        
-        # 获取拼音首字母
-        pinyin_initials = lazy_pinyin(chinese_chars, style=Style.FIRST_LETTER)
-        # 合并为字符串并转换为小写
-        initials = ''.join(pinyin_initials).lower()
-        return initials
-    except ImportError:
-        print("警告: pypinyin模块未安装，无法获取拼音首字母")
-        return ""
-    except Exception as e:
-        print(f"获取拼音首字母时出错: {e}")
-        return ""
+    return get_pinyin_provider().initials(text)
 
 def validate_wubi_code(code: str) -> bool:
     """
@@ -139,12 +330,76 @@ def is_valid_phrase(phrase: str) -> bool:
         return False
     return True
 
-def read_single_char_codes(filename: str = SINGLE_CHAR_FILE) -> Dict[str, str]:
+def _char_table_cache_path(filename: str) -> str:
+    """单字编码表对应的编译缓存文件路径（与源文件同目录）"""
+    return filename + CHAR_TABLE_CACHE_SUFFIX
+
+def _load_char_table_cache(filename: str) -> Optional[Dict[str, str]]:
+    """
+    读取单字编码表的编译缓存
+    仅当缓存头中记录的源文件大小和修改时间与当前源文件一致时才使用，否则返回None
+    """
+    cache_file = _char_table_cache_path(filename)
+    try:
+        stat = os.stat(filename)
+        with open(cache_file, 'rb') as f:
+            magic, version, size, mtime_ns, chars, codes = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if (magic != CHAR_TABLE_CACHE_MAGIC or version != CHAR_TABLE_CACHE_VERSION
+            or size != stat.st_size or mtime_ns != stat.st_mtime_ns):
+        return None
+    if not chars:
+        return {}
+    return dict(zip(chars.split('\n'), codes.split('\n')))
+
+def _write_char_table_cache(filename: str, char_codes: Dict[str, str]) -> None:
+    """
+    将单字编码表写入编译缓存
+    字和编码各自拼接为一个字符串保存，读取时只需一次读文件和两次分割
+    先写临时文件再替换，避免并发运行时读到半个缓存；写入失败不影响正常使用
+    """
+    cache_file = _char_table_cache_path(filename)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        stat = os.stat(filename)
+        payload = (CHAR_TABLE_CACHE_MAGIC, CHAR_TABLE_CACHE_VERSION,
+                   stat.st_size, stat.st_mtime_ns,
+                   '\n'.join(char_codes), '\n'.join(char_codes.values()))
+        with open(tmp_file, 'wb') as f:
+            f.write(marshal.dumps(payload))
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"警告: 无法写入编码表缓存 {cache_file}: {e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+def _parse_char_table(filename: str) -> Dict[str, str]:
+    """逐行解析单字编码表文本文件"""
+    char_codes = {}
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.split('\t')
+            if len(parts) >= 2:
+                char = parts[0]
+                code = parts[1].lower()  # 确保编码为小写
+                char_codes[char] = code
+    return char_codes
+
+def read_single_char_codes(filename: str = SINGLE_CHAR_FILE, use_cache: bool = True) -> Dict[str, str]:
     """
     读取单字编码表，返回字典：{汉字: 编码}
+    首次读取后会在源文件旁生成编译缓存，源文件大小或修改时间变化前直接读取缓存
     
     Args:
         filename: 编码表文件路径
+        use_cache: 是否使用编译缓存
         
     Returns:
         单字编码字典
@@ -154,74 +409,275 @@ def read_single_char_codes(filename: str = SINGLE_CHAR_FILE) -> Dict[str, str]:
         print(f"错误: 文件 {filename} 不存在！")
         return char_codes
 
+    if use_cache:
+        cached = _load_char_table_cache(filename)
+        session_metrics().cache("char_table_cache", hits=int(cached is not None), misses=int(cached is None))
+        if cached is not None:
+            print(f"已读取 {len(cached)} 个单字编码（编译缓存）")
+            return cached
+
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split('\t')
-                if len(parts) >= 2:
-                    char = parts[0]
-                    code = parts[1].lower()  # 确保编码为小写
-                    char_codes[char] = code
+        char_codes = _parse_char_table(filename)
         print(f"已读取 {len(char_codes)} 个单字编码")
-        return char_codes
     except Exception as e:
         print(f"读取文件 {filename} 时出错: {e}")
         return char_codes
 
-def read_phrase_weights(filename: str = PHRASE_WEIGHT_FILE) -> Dict[str, str]:
+    if use_cache and char_codes:
+        _write_char_table_cache(filename, char_codes)
+    return char_codes
+
+def read_char_tables(filenames: List[str], use_cache: bool = True) -> Dict[str, str]:
+    """
+    读取并合并多个单字编码表（如主码表和扩展B区补充表），每个表独立使用编译缓存
+    同一个字出现在多个表中时，以排在前面的表为准
+    
+    Args:
+        filenames: 编码表文件路径列表，第一个为主码表
+        use_cache: 是否使用编译缓存
+        
+    Returns:
+        合并后的单字编码字典
+    """
+    merged = {}
+    for filename in filenames:
+        table = read_single_char_codes(filename, use_cache)
+        if not merged:
+            merged = dict(table)
+            continue
+        for char, code in table.items():
+            merged.setdefault(char, code)
+    return merged
+
+class PhraseWeightStore(collections.abc.Mapping):
+    """
+    编译后的只读词语权重表，可代替 {词语: 权重(字符串)} 字典使用（支持 get、in、len 和遍历）
+    编译文件依次为文件头、首字分桶表（每桶第一个词语的序号）、词语的起始偏移数组（count+1 个 uint32，相对文件开头）、
+    整数权重数组（count 个 int64，按8字节对齐）和按UTF-8字节序排列的词语。
+    通常以内存映射方式打开，打开时只读文件头；查找时先由首字取得所在的桶，再在桶内二分，
+    只有被访问到的页才会读入内存
+    """
+
+    def __init__(self, buffer: Optional[Any] = None, source: str = ""):
+        self.source = source
+        self._buffer = buffer if buffer is not None else b""
+        self._count = 0
+        self._buckets: Sequence[int] = ()
+        self._offsets: Sequence[int] = ()
+        self._weights: Sequence[int] = ()
+        if buffer is not None:
+            count = PHRASE_WEIGHT_STORE_HEADER.unpack_from(buffer)[3]
+            buckets_start, offsets_start, weights_start, _ = self.layout(count)
+            view = memoryview(buffer)
+            self._buckets = view[buckets_start:offsets_start].cast('I')
+            self._offsets = view[offsets_start:offsets_start + 4 * (count + 1)].cast('I')
+            self._weights = view[weights_start:weights_start + 8 * count].cast('q')
+            self._count = count
+
+    @staticmethod
+    def layout(count: int) -> Tuple[int, int, int, int]:
+        """count个词语时分桶表、偏移数组、权重数组和词语数据的起始位置"""
+        buckets_start = PHRASE_WEIGHT_STORE_HEADER.size
+        offsets_start = buckets_start + 4 * (PHRASE_WEIGHT_STORE_BUCKETS + 1)
+        weights_start = (offsets_start + 4 * (count + 1) + 7) // 8 * 8
+        return buckets_start, offsets_start, weights_start, weights_start + 8 * count
+
+    @classmethod
+    def compile(cls, weights: Dict[str, int], size: int = 0, mtime_ns: int = 0) -> bytes:
+        """把 {词语: 整数权重} 编译为编译文件的内容，size和mtime_ns为源文件的大小和修改时间"""
+        phrases = sorted(weights)  # 按码位排序与按UTF-8字节排序的结果相同
+        encoded = [phrase.encode('utf-8') for phrase in phrases]
+        _, offsets_start, weights_start, data_start = cls.layout(len(phrases))
+        offsets = array('I', [data_start])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        # 各桶第一个词语的序号；没有词语的桶与下一个桶相同
+        buckets = array('I', bytes(4 * (PHRASE_WEIGHT_STORE_BUCKETS + 1)))
+        for phrase in phrases:
+            buckets[min(ord(phrase[0]), PHRASE_WEIGHT_STORE_BUCKETS - 1) + 1] += 1
+        for bucket in range(PHRASE_WEIGHT_STORE_BUCKETS):
+            buckets[bucket + 1] += buckets[bucket]
+        header = PHRASE_WEIGHT_STORE_HEADER.pack(PHRASE_WEIGHT_STORE_MAGIC, PHRASE_WEIGHT_STORE_VERSION,
+                                                 int(sys.byteorder == 'little'), len(phrases), size, mtime_ns)
+        padding = bytes(weights_start - offsets_start - 4 * len(offsets))
+        values = array('q', [weights[phrase] for phrase in phrases])
+        return b"".join([header, buckets.tobytes(), offsets.tobytes(), padding, values.tobytes()] + encoded)
+
+    def _find(self, phrase: str) -> int:
+        """在词语首字所在的桶内二分查找词语的序号，不存在时返回-1"""
+        if not phrase or not self._count:
+            return -1
+        bucket = min(ord(phrase[0]), PHRASE_WEIGHT_STORE_BUCKETS - 1)
+        low, high = self._buckets[bucket], self._buckets[bucket + 1]
+        if low == high:
+            return -1
+        key = phrase.encode('utf-8')
+        buffer, offsets = self._buffer, self._offsets
+        while low < high:
+            middle = (low + high) >> 1
+            probe = buffer[offsets[middle]:offsets[middle + 1]]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def weight(self, phrase: str) -> Optional[int]:
+        """词语的整数权重，不存在时返回None"""
+        index = self._find(phrase)
+        return self._weights[index] if index >= 0 else None
+
+    def get(self, phrase: str, default: Optional[str] = None) -> Optional[str]:
+        index = self._find(phrase)
+        return str(self._weights[index]) if index >= 0 else default
+
+    def __getitem__(self, phrase: str) -> str:
+        index = self._find(phrase)
+        if index < 0:
+            raise KeyError(phrase)
+        return str(self._weights[index])
+
+    def __contains__(self, phrase: object) -> bool:
+        return isinstance(phrase, str) and self._find(phrase) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        buffer, offsets = self._buffer, self._offsets
+        for index in range(self._count):
+            yield bytes(buffer[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def __len__(self) -> int:
+        return self._count
+
+def _phrase_weight_store_path(filename: str) -> str:
+    """词语权重表对应的编译文件路径（与源文件同目录）"""
+    return filename + PHRASE_WEIGHT_STORE_SUFFIX
+
+def _open_phrase_weight_store(filename: str) -> Optional[PhraseWeightStore]:
+    """
+    以内存映射方式打开词语权重表的编译文件
+    仅当文件头中记录的源文件大小和修改时间与当前源文件一致、且文件完整时才使用，否则返回None
+    """
+    store_file = _phrase_weight_store_path(filename)
+    try:
+        stat = os.stat(filename)
+        with open(store_file, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        magic, version, little_endian, count, size, mtime_ns = PHRASE_WEIGHT_STORE_HEADER.unpack_from(buffer)
+        _, offsets_start, _, data_start = PhraseWeightStore.layout(count)
+        # 最后一个偏移即文件长度，不相等说明文件不完整
+        valid = (magic == PHRASE_WEIGHT_STORE_MAGIC and version == PHRASE_WEIGHT_STORE_VERSION
+                 and little_endian == int(sys.byteorder == 'little')
+                 and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+                 and len(buffer) >= data_start
+                 and struct.unpack_from('=I', buffer, offsets_start + 4 * count)[0] == len(buffer))
+        store = PhraseWeightStore(buffer, filename) if valid else None
+    except struct.error:
+        store = None
+    if store is None:
+        buffer.close()
+    return store
+
+def _write_phrase_weight_store(filename: str, payload: bytes) -> bool:
+    """
+    写入词语权重表的编译文件
+    先写临时文件再替换，避免并发运行时读到半个文件；写入失败（如其他进程正映射着旧文件）不影响正常使用
+    """
+    store_file = _phrase_weight_store_path(filename)
+    tmp_file = f"{store_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_file, store_file)
+        return True
+    except OSError as e:
+        print(f"警告: 无法写入词语权重编译文件 {store_file}: {e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        return False
+
+def _parse_phrase_weights(filename: str, log: RowLog) -> Dict[str, int]:
+    """
+    逐行解析词语权重表文本文件，返回 {词语: 整数权重}，同一词语出现多次时保留最大权重
+    权重不是数字或超出编译文件可保存的范围的行记入log后跳过
+    """
+    phrase_weights: Dict[str, int] = {}
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.split('\t')
+            if len(parts) >= 2:
+                phrase = parts[0]
+                weight_str = parts[1].strip()
+
+                # 验证权重是否为纯数字；无效的行跳过，查询时使用默认权重
+                if not re.match(r'^\d+$', weight_str):
+                    log.add("权重不是有效数字", f"警告: 词语 '{phrase}' 的权重值 '{weight_str}' 不是有效数字，已跳过",
+                            record=False)
+                    continue
+                weight_int = int(weight_str)
+                if weight_int > PHRASE_WEIGHT_MAX:
+                    log.add("权重超出范围", f"警告: 词语 '{phrase}' 的权重值 '{weight_str}' 超出范围，已跳过",
+                            record=False)
+                    continue
+
+                # 如果词组已存在，保留最大值
+                if weight_int > phrase_weights.get(phrase, -1):
+                    phrase_weights[phrase] = weight_int
+    return phrase_weights
+
+def read_phrase_weights(filename: str = PHRASE_WEIGHT_FILE, use_cache: bool = True) -> PhraseWeightStore:
     """
-    读取词语权重表，返回字典：{词语: 权重(字符串)}
+    读取词语权重表，返回可按 {词语: 权重(字符串)} 字典查询的 PhraseWeightStore
     如果词组出现多次，保留最大权重值
+    首次读取后会在源文件旁生成编译文件，源文件大小或修改时间变化时自动重新编译；
+    编译文件以内存映射方式打开，启动耗时与权重表大小无关
     
     Args:
         filename: 权重表文件路径
+        use_cache: 是否使用编译文件（为False时每次解析源文件，结果只保存在内存中）
         
     Returns:
-        词语权重字典
+        词语权重表
     """
-    phrase_weights = {}
     if not os.path.exists(filename):
         print(f"警告: 文件 {filename} 不存在！将使用默认权重")
-        return phrase_weights
+        return PhraseWeightStore()
 
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split('\t')
-                if len(parts) >= 2:
-                    phrase = parts[0]
-                    weight_str = parts[1].strip()
-
-                    # 验证权重是否为纯数字
-                    if not re.match(r'^\d+$', weight_str):
-                        print(f"警告: 权重值 '{weight_str}' 不是有效数字，将按0处理")
-                        weight_int = 0
-                    else:
-                        weight_int = int(weight_str)
-
-                    # 如果词组已存在，比较并保留最大值
-                    if phrase in phrase_weights:
-                        try:
-                            existing_weight = int(phrase_weights[phrase])
-                            if weight_int > existing_weight:
-                                phrase_weights[phrase] = weight_str
-                        except ValueError:
-                            # 如果现有权重无法转换，使用新的
-                            phrase_weights[phrase] = weight_str
-                    else:
-                        phrase_weights[phrase] = weight_str
+    if use_cache:
+        store = _open_phrase_weight_store(filename)
+        session_metrics().cache("phrase_weight_store", hits=int(store is not None), misses=int(store is None))
+        if store is not None:
+            print(f"已读取 {len(store)} 个词语权重（编译文件）")
+            return store
 
+    log = RowLog(Config.VERBOSITY)
+    try:
+        stat = os.stat(filename)
+        phrase_weights = _parse_phrase_weights(filename, log)
         print(f"已读取 {len(phrase_weights)} 个词语权重（已去重，保留最大权重）")
-        return phrase_weights
+        payload = PhraseWeightStore.compile(phrase_weights, stat.st_size, stat.st_mtime_ns)
     except Exception as e:
         print(f"读取文件 {filename} 时出错: {e}")
-        return phrase_weights
+        return PhraseWeightStore()
+    finally:
+        log.summary("读取词语权重时的警告")
+        log.close()
+
+    if use_cache and _write_phrase_weight_store(filename, payload):
+        store = _open_phrase_weight_store(filename)
+        if store is not None:
+            return store
+    return PhraseWeightStore(payload, filename)
 
 def get_first_code(char: str, char_codes: Dict[str, str]) -> str:
     """获取汉字的第一码，返回小写字母"""
@@ -357,7 +813,7 @@ def rule_wubi_pinyin_initials(phrase: str, char_codes: Dict[str, str]) -> str:
     wubi_code = rule_standard_wubi(phrase, char_codes)
     
     # 获取拼音首字母
-    pinyin_initials = get_pinyin_initials(phrase)
+    pinyin_initials = get_pinyin_provider(char_codes).initials(phrase)
     
     # 组合编码
     if pinyin_initials:
@@ -365,6 +821,16 @@ def rule_wubi_pinyin_initials(phrase: str, char_codes: Dict[str, str]) -> str:
     else:
         return wubi_code
 
+# 编码规则编号到规则函数的映射，未知编号按规则一处理
+RULE_FUNCTIONS: Dict[int, Callable[[str, Dict[str, str]], str]] = {
+    1: rule_standard_wubi,
+    2: rule_one_code_per_char,
+    3: rule_first_two_chars_two_codes_rest_one,
+    4: rule_all_two_codes,
+    5: rule_free_coding,
+    6: rule_wubi_pinyin_initials,
+}
+
 def generate_wubi_code(phrase: str, char_codes: Dict[str, str], rule: int = 1) -> str:
     """
     根据指定规则为词语生成编码
@@ -377,26 +843,114 @@ def generate_wubi_code(phrase: str, char_codes: Dict[str, str], rule: int = 1) -
     Returns:
         生成的编码字符串（小写）
     """
-    if rule == 1:
-        code = rule_standard_wubi(phrase, char_codes)
-    elif rule == 2:
-        code = rule_one_code_per_char(phrase, char_codes)
-    elif rule == 3:
-        code = rule_first_two_chars_two_codes_rest_one(phrase, char_codes)
-    elif rule == 4:
-        code = rule_all_two_codes(phrase, char_codes)
-    elif rule == 5:
-        code = rule_free_coding(phrase, char_codes)
-    elif rule == 6:
-        code = rule_wubi_pinyin_initials(phrase, char_codes)
-    else:
-        code = rule_standard_wubi(phrase, char_codes)
+    rule_function = RULE_FUNCTIONS.get(rule, rule_standard_wubi)
+    return rule_function(phrase, char_codes).lower()
+
+class BatchEncoder:
+    """
+    批量编码引擎
+    一次性预先计算每个字的第一码表和前两码表（均已转为小写），再按词长选择对应的编码函数，
+    编码时只做查表和字符串拼接，结果与逐条调用generate_wubi_code一致
+    """
+
+    def __init__(self, char_codes: Dict[str, str], rule: int = 1):
+        self.char_codes = char_codes
+        self.rule = rule if rule in RULE_FUNCTIONS else 1
+        self.full_codes = {char: code.lower() for char, code in char_codes.items()}
+        self.first_codes = {char: code[0:1].lower() or "x" for char, code in char_codes.items()}
+        self.first_two_codes = {char: get_first_two_codes(char, char_codes)
+                                for char in char_codes}
+        self._length_encoders: Dict[int, Callable[[str], str]] = {}
+        # 规则六在创建时即准备好首字母表，并行处理时随编码引擎一起传给工作进程
+        self.pinyin_provider = get_pinyin_provider(char_codes) if self.rule == 6 else None
+
+    def __getstate__(self):
+        # 按词长生成的编码函数是闭包，无法序列化，传给其他进程后按需重建
+        state = self.__dict__.copy()
+        state['_length_encoders'] = {}
+        return state
+
+    def _make_length_encoder(self, length: int) -> Callable[[str], str]:
+        """为指定词长生成只做查表的编码函数"""
+        rule = self.rule
+        full = self.full_codes.get
+        f1 = self.first_codes.get
+        f2 = self.first_two_codes.get
+
+        if rule == 5:
+            return lambda phrase: ""
+        if length == 0:
+            return lambda phrase: "xxxx" if rule == 4 else ""
+
+        if rule == 4:
+            if length == 1:
+                return lambda phrase: f2(phrase[0], "xx") + "xx"
+            return lambda phrase: f2(phrase[0], "xx") + f2(phrase[1], "xx")
+
+        # 规则一、二、三（以及规则六的五笔部分）对单字和二字词的处理相同
+        if length == 1:
+            encode = lambda phrase: full(phrase, "xxxx")
+        elif length == 2 or rule == 3:
+            encode = lambda phrase: f2(phrase[0], "xx") + f2(phrase[1], "xx")
+        elif length == 3:
+            encode = lambda phrase: f1(phrase[0], "x") + f1(phrase[1], "x") + f2(phrase[2], "xx")
+        elif length == 4 or rule == 2:
+            encode = lambda phrase: f1(phrase[0], "x") + f1(phrase[1], "x") + f1(phrase[2], "x") + f1(phrase[3], "x")
+        else:
+            encode = lambda phrase: f1(phrase[0], "x") + f1(phrase[1], "x") + f1(phrase[2], "x") + f1(phrase[-1], "x")
+
+        if rule == 6:
+            initials = self.pinyin_provider.initials
+            return lambda phrase: encode(phrase) + initials(phrase)
+        return encode
+
+    def encode(self, phrase: str) -> str:
+        """编码单个词语"""
+        length = len(phrase)
+        encoder = self._length_encoders.get(length)
+        if encoder is None:
+            encoder = self._make_length_encoder(length)
+            self._length_encoders[length] = encoder
+        return encoder(phrase)
+
+    def encode_batch(self, phrases: Iterable[str]) -> List[str]:
+        """
+        批量编码，按词长分组后使用同一个编码函数处理整组
+        返回的编码顺序与输入顺序一致
+        """
+        phrases = list(phrases)
+        groups: Dict[int, List[int]] = {}
+        for i, phrase in enumerate(phrases):
+            groups.setdefault(len(phrase), []).append(i)
+
+        codes = [""] * len(phrases)
+        for length, indices in groups.items():
+            encoder = self._length_encoders.get(length)
+            if encoder is None:
+                encoder = self._make_length_encoder(length)
+                self._length_encoders[length] = encoder
+            for i, code in zip(indices, map(encoder, [phrases[i] for i in indices])):
+                codes[i] = code
+        return codes
+
+def generate_wubi_codes(phrases: Iterable[str], char_codes: Dict[str, str], rule: int = 1) -> List[str]:
+    """
+    批量为词语生成编码
     
-    return code.lower()
+    Args:
+        phrases: 待编码的词语列表或迭代器
+        char_codes: 单字编码字典
+        rule: 编码规则，1-6分别对应六种规则
+        
+    Returns:
+        与输入顺序一致的编码列表（小写）
+    """
+    return BatchEncoder(char_codes, rule).encode_batch(phrases)
 
 def read_existing_entries(filename: str = OUTPUT_FILE) -> Set[str]:
     """
     读取已存在的词库条目，返回已存在的词语集合
+    文件包含'...'结束的YAML文件头时，只读取其后的数据行
     """
     existing_phrases = set()
     if os.path.exists(filename):
@@ -404,6 +958,10 @@ def read_existing_entries(filename: str = OUTPUT_FILE) -> Set[str]:
             with open(filename, 'r', encoding='utf-8') as f:
                 for line in f:
                     line = line.strip()
+                    if line == '...':
+                        # 之前读到的都是文件头
+                        existing_phrases.clear()
+                        continue
                     if line:
                         parts = line.split('\t')
                         if parts:
@@ -413,20 +971,376 @@ def read_existing_entries(filename: str = OUTPUT_FILE) -> Set[str]:
             print(f"读取已有词库 {filename} 时出错: {e}")
     return existing_phrases
 
-def clean_output_file(filename: str) -> None:
+def read_table_entries(filename: str) -> List[Tuple[str, str, int]]:
     """
-    清理输出文件，确保没有空行
+    读取词库的数据行，返回 [(词语, 编码, 权重)]，缺少的编码为空字符串、权重为0
+    与read_existing_entries相同，文件包含'...'时只读取其后的数据行；以#开头的注释行被跳过
     """
-    if os.path.exists(filename):
+    rows = []
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line == '...':
+                    # 之前读到的都是文件头
+                    rows.clear()
+                    continue
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split('\t')
+                code = parts[1].strip() if len(parts) > 1 else ""
+                weight = parts[2].strip() if len(parts) > 2 else ""
+                rows.append((parts[0], code, int(weight) if weight.isdigit() else 0))
+    except Exception as e:
+        print(f"读取已有词库 {filename} 时出错: {e}")
+    return rows
+
+def read_import_tables(dict_file: str = MAIN_DICT_FILE) -> List[str]:
+    """
+    读取主词库文件头中的import_tables，返回主词库及其导入的各词库文件路径
+    导入名按Rime规则解析为主词库所在目录下的 <名称>.dict.yaml
+    """
+    if not os.path.exists(dict_file):
+        return []
+
+    base_dir = os.path.dirname(dict_file)
+    table_files = [dict_file]
+    in_import_tables = False
+    try:
+        with open(dict_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                content = line.split('#', 1)[0].rstrip()
+                if content.strip() == '...':
+                    break
+                if not content.strip():
+                    continue
+                if not content[0].isspace():
+                    in_import_tables = content.startswith('import_tables:')
+                    continue
+                item = content.strip()
+                if in_import_tables and item.startswith('- '):
+                    table_files.append(os.path.join(base_dir, item[2:].strip() + ".dict.yaml"))
+    except Exception as e:
+        print(f"读取主词库 {dict_file} 时出错: {e}")
+    return table_files
+
+def _same_file(path1: str, path2: str) -> bool:
+    """判断两个路径是否指向同一文件"""
+    return os.path.normcase(os.path.abspath(path1)) == os.path.normcase(os.path.abspath(path2))
+
+class CodeTrie:
+    """
+    编码到候选（词语, 权重）的前缀树
+    每个节点是以编码字符为键的字典，键None下保存以该节点结尾的编码的候选（按加入顺序）。
+    精确编码的查询和加入直接通过编码到候选列表的字典完成，树节点在第一次按前缀查询时才建立，
+    之后随加入的词条同步更新，批量编码时不必为每个新编码逐字符建立节点。
+    预计位置按Rime的 sort: by_weight 计算：权重从大到小，权重相同时先加入的在前；
+    不考虑用户词典的调频和简码、补全带来的候选
+    """
+
+    def __init__(self):
+        self._codes: Dict[str, List[Tuple[str, int]]] = {}
+        self._root: Optional[Dict[Optional[str], Any]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _insert_node(root: Dict[Optional[str], Any], code: str, candidates: List[Tuple[str, int]]) -> None:
+        node = root
+        for char in code:
+            child = node.get(char)
+            if child is None:
+                child = node[char] = {}
+            node = child
+        node[None] = candidates
+
+    def _trie(self) -> Dict[Optional[str], Any]:
+        if self._root is None:
+            root: Dict[Optional[str], Any] = {}
+            for code, candidates in self._codes.items():
+                self._insert_node(root, code, candidates)
+            self._root = root
+        return self._root
+
+    def add(self, code: str, phrase: str, weight: int) -> None:
+        candidates = self._codes.get(code)
+        if candidates is None:
+            candidates = self._codes[code] = []
+            if self._root is not None:
+                self._insert_node(self._root, code, candidates)
+        candidates.append((phrase, weight))
+        self._size += 1
+
+    def candidates(self, code: str) -> List[Tuple[str, int]]:
+        """编码的全部候选，按预计的候选顺序排列"""
+        return sorted(self._codes.get(code, ()), key=lambda candidate: -candidate[1])
+
+    def rank(self, code: str, weight: int) -> Tuple[int, int]:
+        """
+        以weight加入code时的预计位置（从1开始）和该编码已有的候选数
+        新词条排在权重不低于它的已有候选之后
+        """
+        candidates = self._codes.get(code)
+        if not candidates:
+            return 1, 0
+        return 1 + sum(1 for _, existing in candidates if existing >= weight), len(candidates)
+
+    def iter_prefix(self, prefix: str = "") -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+        """按编码顺序产出以prefix开头的全部编码及其候选（候选按加入顺序）"""
+        node = self._trie()
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return
+        stack = [(prefix, node)]
+        while stack:
+            code, node = stack.pop()
+            candidates = node.get(None)
+            if candidates:
+                yield code, candidates
+            stack.extend((code + char, child) for char, child in sorted(
+                ((char, child) for char, child in node.items() if char is not None), reverse=True))
+
+    def busiest(self, count: int, prefix: str = "") -> List[Tuple[str, int]]:
+        """候选最多的count个编码 [(编码, 候选数)]，候选数相同时按编码顺序"""
+        return heapq.nsmallest(count, ((code, len(candidates)) for code, candidates in self.iter_prefix(prefix)),
+                               key=lambda item: (-item[1], item[0]))
+
+class PhraseIndex:
+    """
+    覆盖主词库及其全部导入词库的持久化词语索引
+    索引按文件保存每个词库的大小、修改时间和 (词语, 编码, 权重) 列表，加载时只重新扫描有变化的文件；
+    本次运行追加到输出文件的词语同步记入索引，保存时无需重新扫描输出文件。
+    可直接代替已有词语集合使用（支持 in、add 和 len）；code_trie 为全部词条的编码前缀树
+    """
+
+    def __init__(self, table_files: List[str], index_file: str = PHRASE_INDEX_FILE,
+                 output_file: str = OUTPUT_FILE):
+        self.table_files = table_files
+        self.index_file = index_file
+        self.output_file = output_file
+        self.phrases: Set[str] = set()
+        self.rebuilt_files: List[str] = []
+        self._entries: Dict[str, Tuple[int, int, Tuple[Tuple[str, str, int], ...]]] = {}
+        self._appended: List[Tuple[str, str, int]] = []
+        self._code_trie: Optional[CodeTrie] = None
+
+    def _read_index(self) -> Dict[str, Tuple[int, int, Tuple[Tuple[str, str, int], ...]]]:
+        """读取索引文件，格式不符时视为空索引"""
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                lines = [line.rstrip('\n') for line in f if line.strip()]
+            with open(self.index_file, 'rb') as f:
+                magic, version, entries = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+        if magic != PHRASE_INDEX_MAGIC or version != PHRASE_INDEX_VERSION:
+            return {}
+        return entries
+
+    def load(self) -> 'PhraseIndex':
+        """加载索引，重新扫描大小或修改时间有变化的词库文件"""
+        cached = self._read_index()
+        self._entries = {}
+        self.rebuilt_files = []
+        for filename in self.table_files:
+            key = os.path.abspath(filename)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entry = cached.get(key)
+            if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                rows = tuple(read_table_entries(filename))
+                entry = (stat.st_size, stat.st_mtime_ns, rows)
+                self.rebuilt_files.append(filename)
+            self._entries[key] = entry
+
+        self.phrases = {phrase for entry in self._entries.values() for phrase, _, _ in entry[2]}
+        self._code_trie = None
+        if self.rebuilt_files or len(cached) != len(self._entries):
+            self.save()
+        return self
+
+    def __contains__(self, phrase: str) -> bool:
+        return phrase in self.phrases
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    @property
+    def file_count(self) -> int:
+        """已索引的词库文件数"""
+        return len(self._entries)
+
+    @property
+    def code_trie(self) -> CodeTrie:
+        """全部词条（含本次运行追加的）的编码前缀树，首次使用时建立"""
+        if self._code_trie is None:
+            trie = CodeTrie()
+            for entry in self._entries.values():
+                for phrase, code, weight in entry[2]:
+                    if code:
+                        trie.add(code, phrase, weight)
+            for phrase, code, weight in self._appended:
+                if code:
+                    trie.add(code, phrase, weight)
+            self._code_trie = trie
+        return self._code_trie
+
+    def add(self, phrase: str, code: str = "", weight: int = 0) -> None:
+        """记录本次运行追加到输出文件的词条"""
+        if phrase not in self.phrases:
+            self.phrases.add(phrase)
+            self._appended.append((phrase, code, weight))
+            if self._code_trie is not None and code:
+                self._code_trie.add(code, phrase, weight)
+
+    def _stat_after_append(self, indexed_size: int) -> Optional[os.stat_result]:
+        """
+        输出文件在索引记录的大小之后恰好是本次运行追加的词条时，返回其当前状态；
+        否则（运行期间在外部被修改过，或写入失败）返回None
+        """
+        try:
+            stat = os.stat(self.output_file)
+            if stat.st_size < indexed_size:
+                return None
+            with open(self.output_file, 'rb') as f:
+                f.seek(indexed_size)
+                tail = f.read(stat.st_size - indexed_size).decode('utf-8')
+        except (OSError, UnicodeDecodeError):
+            return None
+        if not tail.endswith('\n'):
+            return None
+        # 原文件未以换行结尾时，写入时先补了一个换行
+        if tail.startswith('\n'):
+            tail = tail[1:]
+        rows = [line.split('\t') for line in tail.splitlines()]
+        actual = [(row[0], row[1], int(row[2])) if len(row) == 3 and row[2].isdigit() else None for row in rows]
+        return stat if actual == self._appended else None
+
+    def save(self) -> None:
+        """
+        保存索引。调用前应先提交输出文件的写入，以便记录输出文件当前的大小和修改时间
+        输出文件在运行期间被外部修改过时不沿用其索引，下次加载时重新扫描
+        """
+        if self._appended:
+            key = os.path.abspath(self.output_file)
+            size, _, rows = self._entries.get(key, (0, 0, ()))
+            stat = self._stat_after_append(size)
+            if stat is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = (stat.st_size, stat.st_mtime_ns, rows + tuple(self._appended))
+            self._appended = []
 
-            with open(filename, 'w', encoding='utf-8') as f:
-                for line in lines:
-                    f.write(line + '\n')
-        except Exception as e:
-            print(f"清理输出文件 {filename} 时出错: {e}")
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(marshal.dumps((PHRASE_INDEX_MAGIC, PHRASE_INDEX_VERSION, self._entries)))
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            print(f"警告: 无法保存词语索引 {self.index_file}: {e}")
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+
+def load_phrase_index(output_file: str = OUTPUT_FILE, metrics: Optional[RunMetrics] = None) -> PhraseIndex:
+    """
+    加载覆盖主词库和全部导入词库的词语索引；找不到主词库时只索引输出文件
+    索引中未变化（命中）和重新扫描的词库数记入metrics，未指定时记入会话统计
+    """
+    table_files = read_import_tables(MAIN_DICT_FILE)
+    if not any(_same_file(f, output_file) for f in table_files):
+        table_files.append(output_file)
+    index = PhraseIndex(table_files, output_file=output_file).load()
+    rebuilt = len(index.rebuilt_files)
+    (metrics or session_metrics()).cache("phrase_index", hits=index.file_count - rebuilt, misses=rebuilt)
+    if index.rebuilt_files:
+        print(f"已更新词语索引: {', '.join(os.path.basename(f) for f in index.rebuilt_files)}")
+    return index
+
+class BufferedLineWriter:
+    """
+    按行追加写入的缓冲写入器
+    整个运行期间文件只打开一次，缓冲内容达到设定大小或超过设定时间间隔时提交一次；
+    每次提交以一次写入完成，失败时截断回上次提交的位置，文件中不会留下半行
+    """
+
+    def __init__(self, filename: str, buffer_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None):
+        self.filename = filename
+        self.buffer_size = Config.WRITER_BUFFER_SIZE if buffer_size is None else buffer_size
+        self.flush_interval = Config.WRITER_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._file = None
+        self._buffer: List[str] = []
+        self._buffered_size = 0
+        self._last_flush = time.monotonic()
+        self._needs_newline = False
+
+    def _open(self) -> None:
+        """首次写入时才打开文件，已有内容未以换行结尾时先补一个换行"""
+        self._file = open(self.filename, 'ab')
+        end = self._file.seek(0, os.SEEK_END)
+        if end > 0:
+            with open(self.filename, 'rb') as f:
+                f.seek(end - 1)
+                self._needs_newline = f.read(1) != b'\n'
+
+    def write_line(self, line: str) -> None:
+        """写入一行（不含换行符），必要时先提交已缓冲的内容"""
+        if self._buffer and (self._buffered_size >= self.buffer_size
+                             or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+        self._buffer.append(line + '\n')
+        self._buffered_size += len(line) + 1
+
+    def flush(self) -> None:
+        """提交已缓冲的内容；写入失败时文件恢复到上次提交的状态，缓冲内容保留以便重试"""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._open()
+
+        data = ''.join(self._buffer).encode('utf-8')
+        if self._needs_newline:
+            data = b'\n' + data
+        offset = self._file.tell()
+        try:
+            self._file.write(data)
+            self._file.flush()
+        except Exception:
+            self._file.truncate(offset)
+            self._file.seek(offset)
+            raise
+
+        self._needs_newline = False
+        self._buffer = []
+        self._buffered_size = 0
+
+    def discard(self) -> None:
+        """丢弃尚未提交的内容"""
+        self._buffer = []
+        self._buffered_size = 0
+
+    def close(self) -> None:
+        """提交剩余内容，同步到磁盘并关闭文件"""
+        try:
+            self.flush()
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> 'BufferedLineWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
 def open_file_with_default_app(filename: str) -> None:
     """
@@ -502,7 +1416,7 @@ def extract_chinese_chars(text: str) -> str:
     """
     从文本中提取中文字符（忽略标点符号和其他字符）
     """
-    chinese_chars = re.findall(r'[\u4e00-\u9fff]', text)
+    chinese_chars = CHINESE_CHAR_RE.findall(text)
     return ''.join(chinese_chars)
 
 def check_all_chars_exist(phrase: str, char_codes: Dict[str, str]) -> bool:
@@ -533,10 +1447,50 @@ def is_file_path(input_str: str) -> bool:
 
     return os.path.exists(cleaned_input)
 
+# 编码查询：以*结尾的字母串（如 aa*）列出以其开头的编码及候选
+CODE_QUERY_RE = re.compile(r'^[a-z]*\*$')
+
+def describe_candidate_rank(rank: int, total: int) -> str:
+    """预计候选位置的说明文字"""
+    if total == 0:
+        return "该编码无重码"
+    return f"候选第{rank}位，该编码已有{total}个候选"
+
+def print_code_query(code_trie: CodeTrie, pattern: str, limit: Optional[int] = None) -> None:
+    """打印以pattern（去掉末尾的*）开头的编码及其候选，最多limit个编码"""
+    limit = limit or Config.CODE_QUERY_LIMIT
+    prefix = pattern.rstrip('*')
+    matches = list(itertools.islice(code_trie.iter_prefix(prefix), limit + 1))
+    if not matches:
+        print(f"  没有以 '{prefix}' 开头的编码")
+        return
+    for code, _ in matches[:limit]:
+        candidates = code_trie.candidates(code)
+        print(f"  {code}\t" + "  ".join(f"{i}.{phrase}({weight})" for i, (phrase, weight) in enumerate(candidates, 1)))
+    if len(matches) > limit:
+        print(f"  ... 只显示前 {limit} 个编码")
+
+def print_busiest_codes(code_trie: CodeTrie, count: int, prefix: str = "") -> None:
+    """打印候选最多（重码最多）的count个编码及其前几个候选"""
+    busiest = code_trie.busiest(count, prefix)
+    if not busiest:
+        print(f"没有以 '{prefix}' 开头的编码")
+        return
+    print(f"重码最多的 {len(busiest)} 个编码（共 {len(code_trie)} 个词条）:")
+    for code, total in busiest:
+        candidates = code_trie.candidates(code)
+        shown = "  ".join(f"{phrase}({weight})" for phrase, weight in candidates[:5])
+        more = f"  ... 共{total}个" if total > 5 else ""
+        print(f"  {code}\t{total}\t{shown}{more}")
+
 def interactive_single_input(phrase: str, rule: int, char_codes: Dict[str, str], 
-                            phrase_weights: Dict[str, str], existing_phrases: Set[str]) -> Tuple[bool, str]:
+                            phrase_weights: Mapping[str, str], existing_phrases: PhraseIndex,
+                            output_writer: Optional[BufferedLineWriter] = None) -> Tuple[bool, str]:
     """
     交互式单条输入模式：处理单个词组
+    
+    Args:
+        output_writer: 会话共用的输出写入器，为None时单独打开输出文件写入
     """
     output_filename = OUTPUT_FILE
     added = False
@@ -608,29 +1562,40 @@ def interactive_single_input(phrase: str, rule: int, char_codes: Dict[str, str],
         print(f"  警告: 权重值 '{weight}' 不是有效数字，使用默认值{Config.DEFAULT_WEIGHT}")
         weight = Config.DEFAULT_WEIGHT
 
-    # 追加到文件
+    # 新词条在同码候选中的预计位置（写入前计算，不含自身）
+    rank_note = ""
+    if Config.SHOW_CANDIDATE_RANK:
+        rank_note = "，" + describe_candidate_rank(*existing_phrases.code_trie.rank(code, int(weight)))
+
+    # 追加到文件（交互输入的词组立即提交）
     try:
-        with open(output_filename, 'a', encoding='utf-8') as f:
-            f.write(f"{phrase}\t{code}\t{weight}\n")
+        if output_writer is None:
+            with BufferedLineWriter(output_filename) as writer:
+                writer.write_line(f"{phrase}\t{code}\t{weight}")
+        else:
+            output_writer.write_line(f"{phrase}\t{code}\t{weight}")
+            output_writer.flush()
 
-        existing_phrases.add(phrase)
-        print(f"  ✓ 已添加: {phrase} -> {code} (权重: {weight})")
+        existing_phrases.add(phrase, code, int(weight))
+        print(f"  ✓ 已添加: {phrase} -> {code} (权重: {weight}{rank_note})")
         added = True
 
         return True, code
     except Exception as e:
+        if output_writer is not None:
+            output_writer.discard()
         print(f"  错误: 无法写入文件: {e}")
         return False, str(e)
 
 def interactive_input_mode(rule: int, char_codes: Dict[str, str], 
-                          phrase_weights: Dict[str, str]) -> Tuple[int, int, str]:
+                          phrase_weights: Mapping[str, str]) -> Tuple[int, int, str]:
     """
     交互式输入模式：用户输入词组，直到连续两个回车退出
     """
     output_filename = OUTPUT_FILE
 
-    # 读取已存在的词语
-    existing_phrases = read_existing_entries(output_filename)
+    # 加载词语索引（主词库及全部导入词库）
+    existing_phrases = load_phrase_index(output_filename)
     print(f"\n当前词库中已有 {len(existing_phrases)} 个词语")
 
     print("\n" + "=" * 50)
@@ -643,6 +1608,8 @@ def interactive_input_mode(rule: int, char_codes: Dict[str, str],
         print("注意: 您选择了五笔编码 + 拼音首字母规则")
         print("  编码 = 五笔编码(4码) + 拼音首字母")
     print("输入词组并回车，程序将自动编码并追加到词库")
+    if rule != 5:
+        print("输入以*结尾的编码前缀（如 aa*）可查询已有编码的候选")
     print("连续输入两个空行（直接按两次回车）退出程序")
     print("=" * 50)
 
@@ -650,6 +1617,7 @@ def interactive_input_mode(rule: int, char_codes: Dict[str, str],
     added_count = 0
     fail_count = 0
     success_records = []
+    output_writer = BufferedLineWriter(output_filename)
 
     while True:
         try:
@@ -666,12 +1634,17 @@ def interactive_input_mode(rule: int, char_codes: Dict[str, str],
             else:
                 empty_line_count = 0
 
+                if CODE_QUERY_RE.match(user_input) and rule != 5:
+                    print_code_query(existing_phrases.code_trie, user_input)
+                    continue
+
                 if is_file_path(user_input):
                     print(f"  检测到文件路径: {user_input}")
                     print("  请输入词组或连续两个空行退出")
                     continue
 
-                success, result = interactive_single_input(user_input, rule, char_codes, phrase_weights, existing_phrases)
+                success, result = interactive_single_input(user_input, rule, char_codes, phrase_weights,
+                                                           existing_phrases, output_writer)
                 if success:
                     added_count += 1
                     success_records.append({
@@ -689,10 +1662,13 @@ def interactive_input_mode(rule: int, char_codes: Dict[str, str],
             print(f"  错误: {e}")
             fail_count += 1
 
-    # 清理输出文件，确保没有空行
-    if added_count > 0:
-        clean_output_file(output_filename)
+    try:
+        output_writer.close()
+    except Exception as e:
+        print(f"  错误: 无法写入文件: {e}")
+    existing_phrases.save()
 
+    if added_count > 0:
         # 生成记录文件
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 
@@ -721,10 +1697,139 @@ def interactive_input_mode(rule: int, char_codes: Dict[str, str],
 
     return added_count, fail_count, output_filename
 
+def check_batch_phrase(phrase: str, rule: int, encoder: BatchEncoder) -> Optional[str]:
+    """
+    检查批量处理中的单个词组能否编码
+    
+    Returns:
+        失败原因，可以编码时返回None
+    """
+    if rule == 6:
+        # 对于规则六，需要检查是否有中文字符
+        if not extract_chinese_chars(phrase):
+            return '不包含中文字符'
+    elif not check_all_chars_exist(phrase, encoder.char_codes):
+        # 检查词组中的所有汉字是否都存在于编码表中
+        return '包含未编码的汉字'
+    return None
+
+def classify_batch_phrase(phrase: str, rule: int, encoder: BatchEncoder) -> Tuple[bool, str]:
+    """
+    检查并编码批量处理中的单个词组（不涉及查重和文件写入）
+    
+    Returns:
+        (是否成功, 成功时为编码，失败时为失败原因)
+    """
+    reason = check_batch_phrase(phrase, rule, encoder)
+    if reason is not None:
+        return False, reason
+
+    # 生成编码（只使用中文字符）
+    return True, encoder.encode(extract_chinese_chars(phrase))
+
+# 并行工作进程中的编码引擎，由进程初始化函数设置
+_worker_encoder: Optional[BatchEncoder] = None
+
+def _init_batch_worker(encoder: BatchEncoder) -> None:
+    """
+    工作进程初始化：每个进程只接收一次编码引擎（fork方式直接继承父进程内存）
+    """
+    global _worker_encoder
+    _worker_encoder = encoder
+
+def _classify_batch_chunk(lines: List[str]) -> List[Optional[Tuple[bool, str]]]:
+    """工作进程：检查并编码一块输入行，空行返回None"""
+    encoder = _worker_encoder
+    return [classify_batch_phrase(line, encoder.rule, encoder) if line else None
+            for line in lines]
+
+def _resolve_worker_count(workers: Optional[int], input_size: int) -> int:
+    """根据配置和输入文件大小（字节）确定实际使用的进程数"""
+    if workers is None:
+        workers = Config.BATCH_WORKERS
+    if workers == 0:
+        if input_size < Config.PARALLEL_MIN_BYTES:
+            return 1
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+def _read_batch_lines(input_file: str, metrics: Optional[RunMetrics] = None) -> Iterator[str]:
+    """流水线第一步：逐行读取输入文件，产出去除首尾空白后的行；按已读取的字节数更新metrics的进度条"""
+    with open(input_file, 'r', encoding='utf-8') as infile:
+        if metrics is not None:
+            metrics.track_file(infile)
+        for line in infile:
+            yield line.strip()
+
+def _serial_classify(lines: Iterable[str]) -> Iterator[Tuple[str, Optional[Tuple[bool, str]]]]:
+    """单进程时不预先编码，由主循环在查重之后按需编码"""
+    for line in lines:
+        yield line, None
+
+def _parallel_classify(pool, lines: Iterable[str], window: int) -> Iterator[Tuple[str, Optional[Tuple[bool, str]]]]:
+    """
+    将输入行分块交给进程池检查并编码，按输入顺序逐行产出 (行, 结果)
+    同时在途的块数不超过window，内存占用与输入大小无关
+    """
+    chunk_size = Config.BATCH_CHUNK_SIZE
+    lines = iter(lines)
+    pending = collections.deque()
+    while True:
+        while len(pending) < window:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            pending.append((chunk, pool.apply_async(_classify_batch_chunk, (chunk,))))
+        if not pending:
+            return
+        chunk, async_result = pending.popleft()
+        yield from zip(chunk, async_result.get())
+
+def _write_batch_record(record_file: str, header_lines: List[str],
+                        success_part: str, fail_part: str, skip_part: str) -> None:
+    """
+    组装批量处理记录文件：先写统计信息，再依次拼接处理过程中流式写出的成功、失败和跳过明细
+    """
+    with open(record_file, 'wb') as f:
+        f.write(''.join(line + '\n' for line in header_lines).encode('utf-8'))
+
+        if os.path.exists(success_part) and os.path.getsize(success_part) > 0:
+            f.write(("# 成功添加的词组:\n" + "=" * 60 + "\n").encode('utf-8'))
+            with open(success_part, 'rb') as part:
+                shutil.copyfileobj(part, f)
+            f.write(b"\n")
+
+        if os.path.exists(fail_part) and os.path.getsize(fail_part) > 0:
+            f.write(("# 失败的词组:\n" + "=" * 60 + "\n").encode('utf-8'))
+            with open(fail_part, 'rb') as part:
+                shutil.copyfileobj(part, f)
+
+        if os.path.exists(skip_part) and os.path.getsize(skip_part) > 0:
+            f.write(("\n# 跳过的词组:\n" + "=" * 60 + "\n").encode('utf-8'))
+            with open(skip_part, 'rb') as part:
+                shutil.copyfileobj(part, f)
+
 def file_batch_mode(rule: int, char_codes: Dict[str, str], 
-                   phrase_weights: Dict[str, str], input_file: str) -> Tuple[int, int, str, str]:
+                   phrase_weights: Mapping[str, str], input_file: str,
+                   workers: Optional[int] = None,
+                   output_writer: Optional[BufferedLineWriter] = None,
+                   existing_phrases: Optional[PhraseIndex] = None) -> Tuple[int, int, str, str]:
     """
     文件批量处理模式：对文件中的每一行进行编码
+    以生成器流水线（读取 → 检查 → 编码 → 写入）逐行处理，处理明细也边处理边写出，
+    内存占用不随输入文件大小增长
+    输入文件较大时将检查和编码分块交给多个进程并行处理，查重和写入仍在主进程按输入顺序进行，
+    输出文件、失败文件和处理记录与单进程处理完全一致
+    
+    输出文件和失败文件各只打开一次，按缓冲批量追加，处理结束后无需再整体重写
+    各阶段耗时、行数、峰值内存和缓存命中率写入处理记录旁的 .metrics.json；
+    并行处理时检查和编码在工作进程中完成，等待结果的时间计入classify阶段
+    逐行的处理结果只在详细模式（Config.VERBOSITY）下打印，否则结束时按类别汇总，明细见处理记录
+    
+    Args:
+        workers: 并行进程数，None表示使用Config.BATCH_WORKERS
+        output_writer: 会话共用的输出写入器，为None时本次处理单独打开输出文件
+        existing_phrases: 会话共用的词语索引，为None时本次处理单独加载并在结束时保存
     """
     output_filename = OUTPUT_FILE
     fail_filename = FAIL_FILE
@@ -737,170 +1842,227 @@ def file_batch_mode(rule: int, char_codes: Dict[str, str],
         print("请使用交互式输入模式为每个词组输入自定义编码")
         return 0, 0, output_filename, fail_filename
 
-    # 读取已存在的词语
-    existing_phrases = read_existing_entries(output_filename)
-    print(f"\n当前词库中已有 {len(existing_phrases)} 个词语")
+    metrics = RunMetrics("file_batch_mode", progress=progress_enabled(Config.VERBOSITY, Config.SHOW_PROGRESS))
+    verbose = Config.VERBOSITY >= VERBOSITY_VERBOSE
+    log = RowLog(Config.VERBOSITY)
 
-    # 读取失败记录
-    existing_fail_phrases = set()
-    if os.path.exists(fail_filename):
-        try:
-            with open(fail_filename, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        existing_fail_phrases.add(line)
-        except Exception as e:
-            print(f"读取失败文件 {fail_filename} 时出错: {e}")
+    with metrics.stage("index_build"):
+        # 加载词语索引（主词库及全部导入词库）
+        own_phrase_index = existing_phrases is None
+        if own_phrase_index:
+            existing_phrases = load_phrase_index(output_filename, metrics)
+        print(f"\n当前词库中已有 {len(existing_phrases)} 个词语")
+
+        # 读取失败记录
+        existing_fail_phrases = set()
+        if os.path.exists(fail_filename):
+            try:
+                with open(fail_filename, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            existing_fail_phrases.add(line)
+            except Exception as e:
+                print(f"读取失败文件 {fail_filename} 时出错: {e}")
+
+        # 批量编码引擎：预先计算查表，逐行编码时不再重复取码
+        encoder = BatchEncoder(char_codes, rule)
+
+        # 编码前缀树，用于报告新词条在同码候选中的预计位置
+        code_trie = existing_phrases.code_trie if Config.SHOW_CANDIDATE_RANK else None
 
     # 统计变量
     total_lines = 0
     added_count = 0
     fail_count = 0
     skipped_count = 0
-    success_records = []
-    fail_records = []
+    ranked_after_first = 0
+
+    # 确保记录目录存在
+    if not os.path.exists(Config.RECORD_DIR):
+        os.makedirs(Config.RECORD_DIR)
+        print(f"已创建记录目录: {Config.RECORD_DIR}")
+
+    # 处理明细边处理边写入临时文件，结束时再与统计信息拼成记录文件
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    record_file = os.path.join(Config.RECORD_DIR, f"{base_name}_processed_{timestamp}.txt")
+    success_part = record_file + ".success.part"
+    fail_part = record_file + ".fail.part"
+    skip_part = record_file + ".skip.part"
 
     print(f"\n开始处理文件: {input_file}")
     print("-" * 50)
 
-    try:
-        with open(input_file, 'r', encoding='utf-8') as infile:
-            lines = infile.readlines()
+    own_output_writer = output_writer is None
+    if own_output_writer:
+        output_writer = BufferedLineWriter(output_filename)
+    fail_writer = BufferedLineWriter(fail_filename)
+    success_record_writer = BufferedLineWriter(success_part)
+    fail_record_writer = BufferedLineWriter(fail_part)
+    skip_record_writer = BufferedLineWriter(skip_part)
+    record_writers = [success_record_writer, fail_record_writer, skip_record_writer]
 
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
-            total_lines += 1
+    try:
+        worker_count = _resolve_worker_count(workers, os.path.getsize(input_file))
+        pool = None
+        lines = metrics.timed_iter(_read_batch_lines(input_file, metrics), "parse", count_rows=True)
+        if worker_count > 1:
+            print(f"使用 {worker_count} 个进程并行编码")
+            pool = multiprocessing.Pool(worker_count, initializer=_init_batch_worker,
+                                        initargs=(encoder,))
+            classified = metrics.timed_iter(_parallel_classify(pool, lines, worker_count * 2), "classify")
+        else:
+            classified = _serial_classify(lines)
+        metrics.count("workers", worker_count)
 
-            if not line:
-                continue
+        # 读取和并行编码按块计时；循环体每隔metrics.lap_interval行抽取一行分段计时
+        lap = metrics.lap
+        try:
+            for line_num, (line, result) in enumerate(classified, 1):
+                total_lines += 1
 
-            # 检查是否已存在于词库中
-            if line in existing_phrases:
-                skipped_count += 1
-                print(f"  行 {line_num}: 词组 '{line}' 已存在于词库中，跳过")
-                continue
+                if not line:
+                    continue
 
-            # 检查是否已存在于失败文件中
-            if line in existing_fail_phrases:
-                skipped_count += 1
-                print(f"  行 {line_num}: 词组 '{line}' 已在失败文件中，跳过")
-                continue
+                sampled = metrics.sampled(line_num)
+                if sampled:
+                    metrics.mark()
+
+                # 检查是否已存在于词库中
+                if line in existing_phrases:
+                    skipped_count += 1
+                    skip_record_writer.write_line(f"{line}\t已存在于词库中")
+                    log.add("已存在于词库中", f"  行 {line_num}: 词组 '{line}' 已存在于词库中，跳过", record=False)
+                    if sampled:
+                        lap("classify")
+                    continue
 
-            # 对于规则六，需要检查是否有中文字符
-            if rule == 6:
-                chinese_chars = extract_chinese_chars(line)
-                if not chinese_chars:
-                    try:
-                        with open(fail_filename, 'a', encoding='utf-8') as fail_file:
-                            fail_file.write(f"{line}\n")
-                        fail_count += 1
-                        existing_fail_phrases.add(line)
-                        fail_records.append({'phrase': line, 'reason': '不包含中文字符'})
-                        print(f"  行 {line_num}: 词组 '{line}' 中不包含中文字符，保存到失败文件")
-                    except Exception as e:
-                        print(f"  行 {line_num}: 错误: 无法写入失败文件: {e}")
+                # 检查是否已存在于失败文件中
+                if line in existing_fail_phrases:
+                    skipped_count += 1
+                    skip_record_writer.write_line(f"{line}\t已在失败文件中")
+                    log.add("已在失败文件中", f"  行 {line_num}: 词组 '{line}' 已在失败文件中，跳过", record=False)
+                    if sampled:
+                        lap("classify")
                     continue
-            else:
-                # 检查词组中的所有汉字是否都存在于编码表中
-                if not check_all_chars_exist(line, char_codes):
+
+                if result is None:
+                    reason = check_batch_phrase(line, rule, encoder)
+                    if sampled:
+                        lap("classify")
+                    if reason is None:
+                        result = True, encoder.encode(extract_chinese_chars(line))
+                        if sampled:
+                            lap("encode")
+                    else:
+                        result = False, reason
+                success, code = result
+
+                if not success:
+                    reason = code
                     try:
-                        with open(fail_filename, 'a', encoding='utf-8') as fail_file:
-                            fail_file.write(f"{line}\n")
+                        fail_writer.write_line(line)
                         fail_count += 1
                         existing_fail_phrases.add(line)
-                        fail_records.append({'phrase': line, 'reason': '包含未编码的汉字'})
-                        print(f"  行 {line_num}: 词组 '{line}' 中包含未编码的汉字，保存到失败文件")
+                        fail_record_writer.write_line(f"{line}\t{reason}")
+                        log.add(reason, f"  行 {line_num}: 词组 '{line}' 中{reason}，保存到失败文件", record=False)
                     except Exception as e:
-                        print(f"  行 {line_num}: 错误: 无法写入失败文件: {e}")
+                        log.add("无法写入失败文件", f"  行 {line_num}: 错误: 无法写入失败文件: {e}", record=False)
+                    if sampled:
+                        lap("write")
                     continue
 
-            # 提取中文字符用于编码
-            chinese_chars = extract_chinese_chars(line)
-
-            if not chinese_chars:
-                fail_count += 1
-                fail_records.append({'phrase': line, 'reason': '不包含中文字符'})
-                print(f"  行 {line_num}: 词组 '{line}' 中不包含中文字符，跳过")
-                continue
-
-            # 生成编码（只使用中文字符）
-            code = generate_wubi_code(chinese_chars, char_codes, rule)
-
-            # 获取权重（使用最大权重）
-            weight = phrase_weights.get(line, Config.DEFAULT_WEIGHT)
-            
-            # 验证权重是否为数字
-            if not re.match(r'^\d+$', str(weight)):
-                weight = Config.DEFAULT_WEIGHT
-
-            # 追加到输出文件
-            try:
-                with open(output_filename, 'a', encoding='utf-8') as outfile:
-                    outfile.write(f"{line}\t{code}\t{weight}\n")
-
-                added_count += 1
-                existing_phrases.add(line)
-                success_records.append({'phrase': line, 'code': code, 'weight': weight})
-                print(f"  ✓ 行 {line_num}: 已添加: {line} -> {code} (权重: {weight})")
-
-            except Exception as e:
-                print(f"  行 {line_num}: 错误: 无法写入输出文件: {e}")
+                # 获取权重（使用最大权重）
+                weight = phrase_weights.get(line, Config.DEFAULT_WEIGHT)
+                
+                # 验证权重是否为数字
+                if not re.match(r'^\d+$', str(weight)):
+                    weight = Config.DEFAULT_WEIGHT
+
+                # 新词条在同码候选中的预计位置（加入前计算），只报告排在首位之后的重码
+                rank_note = ""
+                if code_trie is not None:
+                    rank, total = code_trie.rank(code, int(weight))
+                    if rank > 1:
+                        ranked_after_first += 1
+                        rank_note = describe_candidate_rank(rank, total)
+                        log.add("排在首位之后", f"  行 {line_num}: 词组 '{line}' -> {code} 预计为{rank_note}",
+                                record=False)
+
+                # 追加到输出文件
                 try:
-                    with open(fail_filename, 'a', encoding='utf-8') as fail_file:
-                        fail_file.write(f"{line}\n")
-                    fail_count += 1
-                    existing_fail_phrases.add(line)
-                    fail_records.append({'phrase': line, 'reason': '文件写入错误'})
-                except Exception as e2:
-                    print(f"  行 {line_num}: 错误: 无法写入失败文件: {e2}")
-
-        # 清理输出文件，确保没有空行
-        if added_count > 0:
-            clean_output_file(output_filename)
-
-        # 清理失败文件，确保没有空行
-        if fail_count > 0:
-            clean_output_file(fail_filename)
-
-        # 生成记录文件
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_name = os.path.splitext(os.path.basename(input_file))[0]
-
-        # 确保记录目录存在
-        if not os.path.exists(Config.RECORD_DIR):
-            os.makedirs(Config.RECORD_DIR)
-            print(f"已创建记录目录: {Config.RECORD_DIR}")
-
-        record_file = os.path.join(Config.RECORD_DIR, f"{base_name}_processed_{timestamp}.txt")
-
-        with open(record_file, 'w', encoding='utf-8') as f:
-            f.write(f"# 批量处理记录 - {timestamp}\n")
-            f.write(f"# 源文件: {os.path.basename(input_file)}\n")
-            f.write(f"# 编码规则: {rule}\n")
-            f.write(f"# 总行数: {total_lines}\n")
-            f.write(f"# 成功添加: {added_count} 行\n")
-            f.write(f"# 失败: {fail_count} 行\n")
-            f.write(f"# 跳过: {skipped_count} 行\n")
-            f.write(f"# 输出文件: {output_filename}\n")
-            f.write(f"# 失败文件: {fail_filename}\n")
-            f.write("="*60 + "\n\n")
-
-            if success_records:
-                f.write("# 成功添加的词组:\n")
-                f.write("="*60 + "\n")
-                for record in success_records:
-                    f.write(f"{record['phrase']}\t{record['code']}\t{record['weight']}\n")
-                f.write("\n")
-
-            if fail_records:
-                f.write("# 失败的词组:\n")
-                f.write("="*60 + "\n")
-                for record in fail_records:
-                    f.write(f"{record['phrase']}\t{record['reason']}\n")
+                    entry = f"{line}\t{code}\t{weight}"
+                    output_writer.write_line(entry)
 
+                    added_count += 1
+                    existing_phrases.add(line, code, int(weight))
+                    success_record_writer.write_line(f"{entry}\t{rank_note}" if rank_note else entry)
+                    if verbose:
+                        print(f"  ✓ 行 {line_num}: 已添加: {line} -> {code} (权重: {weight}"
+                              f"{'，' + rank_note if rank_note else ''})")
+
+                except Exception as e:
+                    log.add("无法写入输出文件", f"  行 {line_num}: 错误: 无法写入输出文件: {e}", record=False)
+                    try:
+                        fail_writer.write_line(line)
+                        fail_count += 1
+                        existing_fail_phrases.add(line)
+                        fail_record_writer.write_line(f"{line}\t文件写入错误")
+                    except Exception as e2:
+                        log.add("无法写入失败文件", f"  行 {line_num}: 错误: 无法写入失败文件: {e2}", record=False)
+                if sampled:
+                    lap("write")
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        # 提交剩余的缓冲内容
+        with metrics.stage("write"):
+            if own_output_writer:
+                output_writer.close()
+            else:
+                output_writer.flush()
+            fail_writer.close()
+        with metrics.stage("record"):
+            for writer in record_writers:
+                writer.close()
+            if own_phrase_index:
+                existing_phrases.save()
+
+            # 生成记录文件
+            header_lines = [
+                f"# 批量处理记录 - {timestamp}",
+                f"# 源文件: {os.path.basename(input_file)}",
+                f"# 编码规则: {rule}",
+                f"# 总行数: {total_lines}",
+                f"# 成功添加: {added_count} 行",
+                f"# 失败: {fail_count} 行",
+                f"# 跳过: {skipped_count} 行",
+                *([f"# 同码候选中排在首位之后: {ranked_after_first} 行"] if code_trie is not None else []),
+                f"# 输出文件: {output_filename}",
+                f"# 失败文件: {fail_filename}",
+                "=" * 60,
+                "",
+            ]
+            _write_batch_record(record_file, header_lines, success_part, fail_part, skip_part)
+
+        metrics.finish_progress()
+        log.summary("逐行处理汇总")
         print(f"处理记录已保存到: {record_file}")
 
+        metrics.count("added", added_count)
+        metrics.count("failed", fail_count)
+        metrics.count("skipped", skipped_count)
+        metrics.count("ranked_after_first", ranked_after_first)
+        if encoder.pinyin_provider is not None and worker_count == 1:
+            cache_info = encoder.pinyin_provider.cache_info()
+            metrics.cache("pinyin_initials", hits=cache_info.hits, misses=cache_info.misses)
+        metrics_file = metrics.write(record_file, session_metrics())
+        if metrics_file:
+            print(f"运行统计已保存到: {metrics_file}")
+
         print("\n" + "=" * 50)
         print(f"文件处理完成:")
         print(f"  总行数: {total_lines}")
@@ -916,7 +2078,23 @@ def file_batch_mode(rule: int, char_codes: Dict[str, str],
         print(f"处理文件时出错: {e}")
         return 0, 0, output_filename, fail_filename
 
-def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, str]) -> Tuple[int, int, int]:
+    finally:
+        metrics.finish_progress()
+        log.close()
+        for writer in ([output_writer] if own_output_writer else []) + [fail_writer]:
+            try:
+                writer.close()
+            except Exception as e:
+                print(f"错误: 无法写入文件 {writer.filename}: {e}")
+        for writer in record_writers:
+            try:
+                writer.close()
+            except Exception:
+                pass
+            if os.path.exists(writer.filename):
+                os.remove(writer.filename)
+
+def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Mapping[str, str]) -> Tuple[int, int, int]:
     """
     自动模式：根据用户输入自动判断是交互式还是文件批量处理
     """
@@ -925,13 +2103,15 @@ def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, s
     print("请输入词组或文件路径（可直接拖入文件）")
     print("输入词组：对单个词组进行编码")
     print("输入文件路径：对文件中的每一行进行批量编码")
+    if rule != 5:
+        print("输入以*结尾的编码前缀（如 aa*）：查询已有编码的候选")
 
     if rule == 5:
         print("注意: 您选择了自由编码规则，不支持文件批量处理")
         print("文件路径将被视为普通词组处理")
     elif rule == 6:
         print("注意: 您选择了五笔编码 + 拼音首字母规则")
-        print("编码将包含五笔编码(4码) + 拼音首字母")
+        print("编码将包含五笔编码(4码) + 拼音首字母，支持文件批量处理")
 
     print("连续输入两个空行退出程序")
     print("=" * 50)
@@ -941,10 +2121,14 @@ def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, s
     file_count = 0
     fail_count = 0
 
-    # 读取已存在的词语
-    existing_phrases = read_existing_entries(OUTPUT_FILE)
+    # 加载词语索引（主词库及全部导入词库），整个会话共用
+    with session_metrics().stage("index_build"):
+        existing_phrases = load_phrase_index(OUTPUT_FILE)
     print(f"当前词库中已有 {len(existing_phrases)} 个词语")
 
+    # 整个会话共用一个输出写入器
+    output_writer = BufferedLineWriter(OUTPUT_FILE)
+
     while True:
         try:
             user_input = input(f"[输入词组或文件路径]: ").strip()
@@ -960,9 +2144,13 @@ def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, s
             else:
                 empty_line_count = 0
 
+                if CODE_QUERY_RE.match(user_input) and rule != 5:
+                    print_code_query(existing_phrases.code_trie, user_input)
+                    continue
+
                 is_file = is_file_path(user_input)
 
-                if is_file and rule not in [5, 6]:
+                if is_file and rule != 5:
                     print(f"✓ 检测到文件路径，进入文件批量处理模式")
                     file_path = user_input
                     if file_path.startswith('"') and file_path.endswith('"'):
@@ -970,7 +2158,9 @@ def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, s
                     elif file_path.startswith("'") and file_path.endswith("'"):
                         file_path = file_path[1:-1]
 
-                    added, failed, output_file, fail_file = file_batch_mode(rule, char_codes, phrase_weights, file_path)
+                    added, failed, output_file, fail_file = file_batch_mode(
+                        rule, char_codes, phrase_weights, file_path,
+                        output_writer=output_writer, existing_phrases=existing_phrases)
                     file_count += 1
                     if added > 0 or failed > 0:
                         print(f"  文件处理完成: 成功 {added} 条，失败 {failed} 条")
@@ -978,12 +2168,13 @@ def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, s
                         if failed > 0:
                             print(f"  失败条目已保存到: {fail_file}")
                 else:
-                    if is_file and rule in [5, 6]:
+                    if is_file and rule == 5:
                         print(f"⚠ 检测到文件路径，但规则{rule}不支持批量处理")
                         print(f"  将文件路径作为普通词组处理")
 
                     print(f"✓ 检测到词组，进入交互式处理模式")
-                    success, result = interactive_single_input(user_input, rule, char_codes, phrase_weights, existing_phrases)
+                    success, result = interactive_single_input(user_input, rule, char_codes, phrase_weights,
+                                                               existing_phrases, output_writer)
                     interactive_count += 1
                     if not success and result != "已存在":
                         fail_count += 1
@@ -995,14 +2186,336 @@ def auto_mode(rule: int, char_codes: Dict[str, str], phrase_weights: Dict[str, s
             print(f"  错误: {e}")
             fail_count += 1
 
-    # 清理输出文件，确保没有空行
-    if interactive_count > 0 or file_count > 0:
-        clean_output_file(OUTPUT_FILE)
+    try:
+        output_writer.close()
+    except Exception as e:
+        print(f"  错误: 无法写入文件: {e}")
+    existing_phrases.save()
 
     return interactive_count, file_count, fail_count
 
+# 编码一致性检查默认检查的词库，以及参与匹配的编码规则（规则五为自由编码，无从校验）
+AUDIT_FILES = ["wubi.phrase.dict.yaml", "wubi.user.dict.yaml", "wubi.long.dict.yaml"]
+AUDIT_RULES = (1, 2, 3, 4, 6)
+# 汉字（基本区、扩展A区及以后各区、兼容汉字），用于区分汉字词条和符号等自由编码的词条
+CJK_IDEOGRAPHS_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0003134f]+')
+# 编码一致性检查终端汇总中每类原因最多列出的分组数（详细模式列出全部），完整明细见检查报告
+AUDIT_SUMMARY_GROUPS = 10
+
+def rule_code_sources(rule: int, length: int) -> List[Tuple[int, int]]:
+    """
+    规则在给定词长下每一位五笔编码的来源 [(字的位置, 取该字编码的第几码)]，与BatchEncoder的取码方式一致
+    字的位置为-1表示末字；规则六的五笔部分与规则一相同，其后依次为各字的拼音首字母
+    """
+    if length == 1:
+        return [(0, 0), (0, 1)] if rule == 4 else [(0, k) for k in range(4)]
+    if length == 2 or rule in (3, 4):
+        return [(0, 0), (0, 1), (1, 0), (1, 1)]
+    if length == 3:
+        return [(0, 0), (1, 0), (2, 0), (2, 1)]
+    if length == 4 or rule == 2:
+        return [(0, 0), (1, 0), (2, 0), (3, 0)]
+    return [(0, 0), (1, 0), (2, 0), (-1, 0)]
+
+def is_free_coded_entry(phrase: str, code: str) -> bool:
+    """词条是否只能按自由编码处理（含汉字以外字符的词语或非纯小写字母的编码），一致性检查时跳过"""
+    return not code or not code.isascii() or not code.isalpha() or not code.islower() \
+        or not CJK_IDEOGRAPHS_RE.fullmatch(phrase)
+
+def _initials_unchecked(rule: int, encoder: BatchEncoder) -> bool:
+    """规则六在pypinyin不可用时编码只有五笔部分，其后的拼音首字母只能校验位数"""
+    return rule == 6 and not encoder.pinyin_provider.available
+
+def _code_distance(code: str, expected: str, unchecked_initials: int) -> int:
+    """编码与应有编码的差异位数；unchecked_initials为其后应有的未校验拼音首字母位数"""
+    distance = sum(1 for stored, wanted in zip(code, expected) if stored != wanted)
+    return distance + abs(len(code) - len(expected) - unchecked_initials)
+
+def match_entry_rules(phrase: str, code: str, rules: Sequence[Tuple[int, bool]],
+                      expected_codes: Sequence[str]) -> Tuple[int, Tuple[int, ...]]:
+    """
+    将词库中的编码与各规则重新编码的结果比较
+    
+    Args:
+        rules: [(规则, 是否还应有未校验的拼音首字母)]
+        expected_codes: 与rules一一对应的应有编码
+        
+    Returns:
+        (差异位数, 规则)：差异位数为0时为与编码一致的全部规则，否则为差异最少的各规则
+    """
+    unchecked_length = len(code) - len(phrase)
+    matched = tuple(rule for (rule, unchecked), expected in zip(rules, expected_codes)
+                    if code == expected or unchecked and len(expected) == unchecked_length and code.startswith(expected))
+    if matched:
+        return 0, matched
+
+    distances = [(_code_distance(code, expected, len(phrase) if unchecked else 0), rule)
+                 for (rule, unchecked), expected in zip(rules, expected_codes)]
+    best_distance = min(distances)[0]
+    return best_distance, tuple(rule for distance, rule in distances if distance == best_distance)
+
+def diagnose_mismatch(phrase: str, code: str, rule: int, encoder: BatchEncoder) -> List[Tuple[str, str]]:
+    """
+    找出词条编码与规则不一致的原因，返回 [(原因, 分组)]，一个词条可能同时涉及多个字
+    - 单字编码表中缺字：分组为缺少的字
+    - 单字编码变化：只有一个字的取码与码表不同（码表改过该字的字根编码），分组为该字及新旧取码
+    - 不符合任何规则：多个字的取码都与码表不同，多为自由编码或缩写，分组为最接近的规则
+    - 拼音首字母不符：规则六的拼音部分与多音字读音不一致，分组为该字及新旧首字母
+    - 编码长度不符：取码都一致但编码多出或缺少若干位
+    """
+    char_codes = encoder.char_codes
+    missing = [char for char in dict.fromkeys(phrase) if char not in char_codes]
+    if missing:
+        return [("单字编码表中缺字", char) for char in missing]
+
+    expected = encoder.encode(phrase)
+    unchecked_initials = _initials_unchecked(rule, encoder)
+    initials = "" if rule != 6 or unchecked_initials else encoder.pinyin_provider.initials(phrase)
+    wubi_length = len(expected) - len(initials)
+    sources = rule_code_sources(rule, len(phrase))
+
+    # 按字收集词库编码中取自该字的各位，与码表中的对应各位比较
+    taken: Dict[int, Dict[int, str]] = {}
+    changed_chars: List[int] = []
+    causes: List[Tuple[str, str]] = []
+    # 规则四的单字词编码末尾补x，补位不对应任何字
+    for position, stored in enumerate(code[:min(wubi_length, len(sources))]):
+        char_index, offset = sources[position]
+        char_index %= len(phrase)
+        taken.setdefault(char_index, {})[offset] = stored
+        if stored != expected[position] and char_index not in changed_chars:
+            changed_chars.append(char_index)
+    if len(changed_chars) > 1:
+        return [("不符合任何规则", f"最接近规则{rule}")]
+    for char_index in changed_chars:
+        char = phrase[char_index]
+        offsets = sorted(taken[char_index])
+        table_part = "".join(char_codes[char].lower()[offset:offset + 1] or "x" for offset in offsets)
+        stored_part = "".join(taken[char_index][offset] for offset in offsets)
+        causes.append(("单字编码变化", f"{char}：码表 {char_codes[char].lower()} 取 {table_part}，词库取 {stored_part}"))
+    for char_index, (stored, wanted) in enumerate(zip(code[wubi_length:], initials)):
+        if stored != wanted:
+            causes.append(("拼音首字母不符", f"{phrase[char_index]}：应为 {wanted}，词库为 {stored}"))
+
+    wanted_length = len(expected) + (len(phrase) if unchecked_initials else 0)
+    if not causes:
+        if len(code) != wanted_length:
+            causes.append(("编码长度不符", f"{len(code)} 码，应为 {wanted_length} 码"))
+        else:
+            causes.append(("不符合任何规则", f"最接近规则{rule}"))
+    return causes
+
+# 一致性检查工作进程中的各规则编码引擎，由进程初始化函数设置
+_worker_audit_encoders: Optional[Dict[int, BatchEncoder]] = None
+
+def _init_audit_worker(encoders: Dict[int, BatchEncoder]) -> None:
+    """工作进程初始化：每个进程只接收一次各规则的编码引擎"""
+    global _worker_audit_encoders
+    _worker_audit_encoders = encoders
+
+def _audit_chunk(entries: List[Tuple[str, str]]) -> List[Tuple[int, Tuple[int, ...]]]:
+    """工作进程：按各规则批量重新编码一块词条，再逐条比较"""
+    phrases = [phrase for phrase, _ in entries]
+    encoders = _worker_audit_encoders
+    rules = [(rule, _initials_unchecked(rule, encoder)) for rule, encoder in encoders.items()]
+    columns = [encoder.encode_batch(phrases) for encoder in encoders.values()]
+    return [match_entry_rules(phrase, code, rules, expected_codes)
+            for (phrase, code), expected_codes in zip(entries, zip(*columns))]
+
+def _iter_chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    """按size切分列表"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def code_audit(files: Optional[List[str]] = None, workers: Optional[int] = None) -> Optional[int]:
+    """
+    编码一致性检查：按当前单字编码表，用各编码规则重新编码词库中的每个词条
+    词条较多时分块交给多个进程并行编码；每个词条对应到与其编码一致的规则（有多个时优先该词库中最常见的规则），
+    都不一致时对应到差异最少的规则，并按原因（缺字、单字编码变化等）分组报告
+    检查报告和运行统计保存在Config.RECORD_DIR中
+    
+    Args:
+        files: 要检查的词库，None表示AUDIT_FILES中存在的词库
+        workers: 并行进程数，None表示使用Config.BATCH_WORKERS
+        
+    Returns:
+        编码不一致的词条数；没有可检查的词库或无法读取单字编码表时返回None
+    """
+    existing_files = []
+    for filename in files or AUDIT_FILES:
+        if os.path.exists(filename):
+            existing_files.append(filename)
+        else:
+            print(f"跳过不存在的词库: {filename}")
+    if not existing_files:
+        print("错误: 没有可检查的词库")
+        return None
+    files = existing_files
+    metrics = RunMetrics("code_audit", progress=progress_enabled(Config.VERBOSITY, Config.SHOW_PROGRESS))
+
+    with metrics.stage("table_load"):
+        extra_files = [f for f in Config.EXTRA_CHAR_FILES if os.path.exists(f)]
+        char_codes = read_char_tables([SINGLE_CHAR_FILE] + extra_files)
+        if not char_codes:
+            print("错误: 无法读取单字编码表，无法检查编码")
+            return None
+        encoders = {rule: BatchEncoder(char_codes, rule) for rule in AUDIT_RULES}
+    pinyin_checked = encoders[6].pinyin_provider.available
+
+    # 读取各词库的词条，自由编码的词条不参与检查
+    with metrics.stage("parse"):
+        file_entries: Dict[str, List[Tuple[str, str]]] = {}
+        free_coded: Dict[str, int] = {}
+        for filename in files:
+            entries = []
+            skipped = 0
+            for phrase, code, _ in read_table_entries(filename):
+                if is_free_coded_entry(phrase, code):
+                    skipped += 1
+                else:
+                    entries.append((phrase, code))
+            file_entries[filename] = entries
+            free_coded[filename] = skipped
+    all_entries = [(filename, entry) for filename, entries in file_entries.items() for entry in entries]
+    metrics.set_total_rows(len(all_entries))
+
+    # 按各规则重新编码
+    worker_count = _resolve_worker_count(workers, sum(os.path.getsize(f) for f in files))
+    metrics.count("workers", worker_count)
+    results: List[Tuple[int, Tuple[int, ...]]] = []
+    with metrics.stage("classify"):
+        chunks = _iter_chunks([entry for _, entry in all_entries], Config.BATCH_CHUNK_SIZE)
+        if worker_count > 1:
+            print(f"使用 {worker_count} 个进程并行编码")
+            with multiprocessing.Pool(worker_count, initializer=_init_audit_worker, initargs=(encoders,)) as pool:
+                for chunk_results in pool.imap(_audit_chunk, chunks):
+                    results.extend(chunk_results)
+                    metrics.tick(len(chunk_results))
+        else:
+            _init_audit_worker(encoders)
+            for chunk in chunks:
+                results.extend(_audit_chunk(chunk))
+                metrics.tick(len(chunk))
+    metrics.finish_progress()
+
+    with metrics.stage("report"):
+        # 每个词库中与编码一致的词条最多的规则，作为多个规则都一致（或差异相同）时的首选
+        rule_votes: Dict[str, collections.Counter] = {filename: collections.Counter() for filename in files}
+        for (filename, _), (distance, rules) in zip(all_entries, results):
+            if distance == 0:
+                rule_votes[filename].update(rules)
+        preferred = {filename: min(AUDIT_RULES, key=lambda rule: (-votes[rule], rule))
+                     for filename, votes in rule_votes.items()}
+
+        # 按原因和分组汇总不一致的词条
+        matched_rules: Dict[str, collections.Counter] = {filename: collections.Counter() for filename in files}
+        mismatched: Dict[str, int] = collections.Counter()
+        groups: Dict[str, Dict[str, List[str]]] = {}
+        for (filename, (phrase, code)), (distance, rules) in zip(all_entries, results):
+            rule = preferred[filename] if preferred[filename] in rules else rules[0]
+            if distance == 0:
+                matched_rules[filename][rule] += 1
+                continue
+            mismatched[filename] += 1
+            expected = encoders[rule].encode(phrase)
+            detail = f"{os.path.basename(filename)}\t{phrase}\t{code}\t规则{rule}应为 {expected}"
+            for cause, group in diagnose_mismatch(phrase, code, rule, encoders[rule]):
+                groups.setdefault(cause, {}).setdefault(group, []).append(detail)
+        mismatch_count = sum(mismatched.values())
+
+        summary_lines = []
+        for filename in files:
+            rule_counts = "，".join(f"规则{rule} {count}" for rule, count in sorted(matched_rules[filename].items()))
+            summary_lines.append(f"{os.path.basename(filename)}: {len(file_entries[filename])} 条，"
+                                 f"不一致 {mismatched[filename]} 条，自由编码跳过 {free_coded[filename]} 条"
+                                 + (f"（一致: {rule_counts}）" if rule_counts else ""))
+
+        if not os.path.exists(Config.RECORD_DIR):
+            os.makedirs(Config.RECORD_DIR)
+            print(f"已创建记录目录: {Config.RECORD_DIR}")
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_file = os.path.join(Config.RECORD_DIR, f"code_audit_{timestamp}.txt")
+        try:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                f.write(f"# 编码一致性检查 - {timestamp}\n")
+                f.write(f"# 单字编码表: {', '.join([SINGLE_CHAR_FILE] + extra_files)}\n")
+                if not pinyin_checked:
+                    f.write("# 未安装pypinyin，规则六只校验五笔部分和拼音首字母的位数\n")
+                for line in summary_lines:
+                    f.write(f"# {line}\n")
+                f.write("=" * 60 + "\n")
+                for cause, cause_groups in groups.items():
+                    f.write(f"\n## {cause}（{sum(len(details) for details in cause_groups.values())} 条）\n")
+                    for group, details in sorted(cause_groups.items(), key=lambda item: (-len(item[1]), item[0])):
+                        f.write(f"\n{group}（{len(details)} 条）\n")
+                        f.writelines(f"  {detail}\n" for detail in details)
+        except Exception as e:
+            print(f"写入检查报告 {report_file} 时出错: {e}")
+            report_file = ""
+
+    metrics.count("entries", len(all_entries))
+    metrics.count("mismatched", mismatch_count)
+    metrics.count("free_coded", sum(free_coded.values()))
+
+    print("\n" + "=" * 50)
+    print("编码一致性检查完成:")
+    for line in summary_lines:
+        print(f"  {line}")
+    if not pinyin_checked:
+        print("  注意: 未安装pypinyin，规则六只校验五笔部分和拼音首字母的位数")
+    limit = None if Config.VERBOSITY >= VERBOSITY_VERBOSE else AUDIT_SUMMARY_GROUPS
+    for cause, cause_groups in groups.items():
+        ordered = sorted(cause_groups.items(), key=lambda item: (-len(item[1]), item[0]))
+        print(f"\n{cause}: {sum(len(details) for details in cause_groups.values())} 条，{len(ordered)} 组")
+        if Config.VERBOSITY == VERBOSITY_QUIET:
+            continue
+        for group, details in ordered[:limit]:
+            print(f"  {group}（{len(details)} 条，如 {details[0].split(chr(9))[1]}）")
+        if limit is not None and len(ordered) > limit:
+            print(f"  ... 其余 {len(ordered) - limit} 组见检查报告")
+    if report_file:
+        print(f"\n检查报告: {report_file}")
+        metrics_file = metrics.write(report_file, session_metrics())
+        if metrics_file:
+            print(f"运行统计已保存到: {metrics_file}")
+    print("=" * 50)
+    return mismatch_count
+
+def code_report(busiest: Optional[int], prefix: str = "", query: Optional[str] = None) -> None:
+    """非交互地查询编码前缀树：列出重码最多的编码，或列出以query开头的编码及候选"""
+    index = load_phrase_index(OUTPUT_FILE)
+    start = time.perf_counter()
+    code_trie = index.code_trie
+    print(f"已索引 {index.file_count} 个词库，{len(code_trie)} 个词条"
+          f"（建立前缀树用时 {time.perf_counter() - start:.2f} 秒）")
+    if query is not None:
+        print_code_query(code_trie, query)
+    if busiest is not None:
+        print_busiest_codes(code_trie, busiest, prefix)
+
 def main() -> None:
-    """主函数"""
+    """主函数：指定查询参数时只输出编码统计，否则进入交互模式"""
+    parser = argparse.ArgumentParser(description="五笔词库生成工具：不带参数时进入交互模式")
+    parser.add_argument("--busiest-codes", type=int, metavar="N",
+                        help="列出主词库及其导入词库中候选最多（重码最多）的N个编码后退出")
+    parser.add_argument("--prefix", default="",
+                        help="与--busiest-codes一起使用，只统计以此开头的编码")
+    parser.add_argument("--query", metavar="PREFIX",
+                        help="列出以PREFIX开头的编码及其候选后退出")
+    parser.add_argument("--audit", nargs="*", metavar="DICT",
+                        help="按当前单字编码表检查词库编码与编码规则是否一致后退出，"
+                             f"不指定词库时检查 {'、'.join(AUDIT_FILES)}；有不一致的词条时退出码为1，"
+                             "没有可检查的词库或无法读取单字编码表时退出码为2")
+    parser.add_argument("--workers", type=int,
+                        help="与--audit一起使用：并行进程数（默认按Config.BATCH_WORKERS，0表示自动）")
+    args = parser.parse_args()
+    if args.audit is not None:
+        mismatch_count = code_audit(args.audit, args.workers)
+        sys.exit(2 if mismatch_count is None else 1 if mismatch_count else 0)
+    if args.busiest_codes is not None or args.query is not None:
+        code_report(args.busiest_codes, args.prefix, args.query)
+        return
+
     print("五笔词库生成工具 - 自动判断输入模式")
     print("-" * 50)
     
@@ -1032,15 +2545,18 @@ def main() -> None:
     print("所有必要文件都存在")
     print("-" * 30)
 
-    # 读取单字编码表
-    char_codes = read_single_char_codes()
+    # 读取单字编码表（存在补充字表时一并合并）
+    extra_files = [f for f in Config.EXTRA_CHAR_FILES if os.path.exists(f)]
+    with session_metrics().stage("table_load"):
+        char_codes = read_char_tables([SINGLE_CHAR_FILE] + extra_files)
     if not char_codes:
         print("错误: 无法读取单字编码表，程序终止")
         input("\n按Enter键退出...")
         return
 
     # 读取词语权重表（保留最大权重）
-    phrase_weights = read_phrase_weights()
+    with session_metrics().stage("table_load"):
+        phrase_weights = read_phrase_weights()
     if not phrase_weights:
         print("警告: 词语权重表为空或无法读取，将使用默认权重")
 
@@ -0,0 +1,23 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+CN_DICTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cn_dicts")
+sys.path.insert(0, CN_DICTS_DIR)
+
+
+def load_wubi_encoded():
+    """wubi.encoded.py的文件名含点号，不能直接import，按文件路径加载"""
+    spec = importlib.util.spec_from_file_location("wubi_encoded", os.path.join(CN_DICTS_DIR, "wubi.encoded.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def wubi_encoded(tmp_path, monkeypatch):
+    """在临时目录中加载wubi.encoded.py（其中的相对路径都指向临时目录）"""
+    monkeypatch.chdir(tmp_path)
+    return load_wubi_encoded()
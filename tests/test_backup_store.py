@@ -0,0 +1,44 @@
+"""table_io.BackupStore 读取旧版（版本1）备份对象"""
+import marshal
+import os
+import zlib
+import hashlib
+
+from table_io import BackupStore, BACKUP_OBJECT_MAGIC, BACKUP_OBJECT_LEGACY_VERSION
+
+
+def write_legacy_object(store: BackupStore, file_path: str, content: str, *payload: object) -> str:
+    """按版本1的格式写入对象：zlib压缩的 marshal((魔数, 版本, 类型, ...))，并追加目录记录"""
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    path = store._object_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(zlib.compress(marshal.dumps((BACKUP_OBJECT_MAGIC, BACKUP_OBJECT_LEGACY_VERSION) + payload)))
+    with open(store.catalog_file, 'a', encoding='utf-8') as f:
+        f.write(f"20240101000000\t{digest}\t{file_path}\n")
+    return digest
+
+
+def test_restore_legacy_objects(tmp_path):
+    target = tmp_path / "test.dict.yaml"
+    store = BackupStore(str(tmp_path / "store"))
+    os.makedirs(store.store_dir)
+
+    first = "---\n...\n中国\taaaa\t10\n美国\tbbbb\t20\n"
+    second = "---\n...\n中国\taaaa\t30\n美国\tbbbb\t20\n"
+    first_digest = write_legacy_object(store, str(target), first, "full", first)
+    ops = BackupStore._line_delta(first.splitlines(True), second.splitlines(True))
+    second_digest = write_legacy_object(store, str(target), second, "delta", first_digest, 1, ops)
+
+    assert store._read_header(first_digest) == ("full", None, 0)
+    assert store._read_header(second_digest) == ("delta", first_digest, 1)
+    assert store.load(first_digest) == first
+
+    assert store.restore(second_digest[:12]) == str(target)
+    assert target.read_text(encoding='utf-8') == second
+
+    # 旧版对象之后仍可保存新版本
+    third = "---\n...\n中国\taaaa\t30\n美国\tbbbb\t40\n"
+    target.write_text(third, encoding='utf-8')
+    third_digest = store.save(str(target), "20240102000000")
+    assert store.load(third_digest) == third
@@ -0,0 +1,26 @@
+"""wubi.encoded.py --audit 在缺少输入时的退出码"""
+import os
+import sys
+
+import pytest
+
+
+def run_audit_main(module, monkeypatch, *dicts):
+    monkeypatch.setattr(sys, "argv", ["wubi.encoded.py", "--audit", *dicts])
+    with pytest.raises(SystemExit) as exc_info:
+        module.main()
+    return exc_info.value.code
+
+
+def test_missing_char_table_fails(wubi_encoded, tmp_path, monkeypatch):
+    (tmp_path / "test.dict.yaml").write_text("---\nname: test\n...\n中国\taaaa\t1\n", encoding="utf-8")
+    assert not os.path.exists(wubi_encoded.SINGLE_CHAR_FILE)
+    assert wubi_encoded.code_audit(["test.dict.yaml"], 1) is None
+    assert run_audit_main(wubi_encoded, monkeypatch, "test.dict.yaml") == 2
+
+
+def test_no_existing_dicts_fails(wubi_encoded, tmp_path, monkeypatch):
+    (tmp_path / wubi_encoded.SINGLE_CHAR_FILE).write_text("中\tkhk\n国\tlgyi\n", encoding="utf-8")
+    assert wubi_encoded.code_audit(["missing.dict.yaml"], 1) is None
+    assert wubi_encoded.code_audit(None, 1) is None
+    assert run_audit_main(wubi_encoded, monkeypatch, "missing.dict.yaml") == 2
@@ -0,0 +1,151 @@
+"""replace_weight.py --incremental 与完整同步的结果一致，已是最新的目标文件被跳过"""
+import os
+
+import pytest
+
+import replace_weight
+
+BASE = (
+    "中国\t10\n"
+    "美国\t20\n"
+    "德国\t40\n"
+    "日本\t50\n"
+)
+
+TARGET_A = (
+    "---\n"
+    "name: a\n"
+    "columns:\n"
+    "  - text\n"
+    "  - code\n"
+    "  - weight\n"
+    "...\n"
+    "中国\tkhlg\t1\n"
+    "美国\tugl\t2\n"
+    "德国\tfdlg\t3\n"
+    "巴西\tawsv\t5\n"
+)
+
+TARGET_B = (
+    "美国\tugl\t7\n"
+    "日本\tjfsv\t8\n"
+    "俄国\twwlg\t9\n"
+)
+
+
+def write_file(path, content, mode='w'):
+    with open(path, mode, encoding='utf-8') as f:
+        f.write(content)
+
+
+def replace_in_file(path, old, new):
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    assert old in content
+    write_file(path, content.replace(old, new))
+
+
+class Tree:
+    """一份基础文件和两个目标文件"""
+
+    def __init__(self, root, incremental):
+        self.root = str(root)
+        self.incremental = incremental
+        os.makedirs(self.root)
+        self.base = os.path.join(self.root, "phrase_weight.txt")
+        self.targets = [os.path.join(self.root, "a.dict.yaml"), os.path.join(self.root, "b.dict.yaml")]
+        for path, content in zip([self.base] + self.targets, (BASE, TARGET_A, TARGET_B)):
+            write_file(path, content)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def sync(self, direction):
+        failed = replace_weight.batch_main(self.base, direction, self.targets, 1, os.path.join(self.root, "records"),
+                                           "hash", replace_weight.JOIN_MEMORY_LIMIT, self.incremental)
+        assert failed == 0
+
+    def contents(self):
+        result = {}
+        for path in [self.base] + self.targets:
+            with open(path, encoding='utf-8') as f:
+                result[os.path.basename(path)] = f.read()
+        return result
+
+    def stats(self):
+        return [(os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in [self.base] + self.targets]
+
+
+@pytest.fixture
+def trees(tmp_path):
+    return Tree(tmp_path / "incremental", True), Tree(tmp_path / "full", False)
+
+
+def edit_base_weight(tree):
+    replace_in_file(tree.base, "美国\t20\n", "美国\t25\n")
+
+
+def append_base_phrase(tree):
+    write_file(tree.base, "巴西\t70\n俄国\t80\n", 'a')
+
+
+def edit_target_weight(tree):
+    replace_in_file(tree.path("a.dict.yaml"), "德国\tfdlg\t40\n", "德国\tfdlg\t99\n")
+
+
+def edit_target_b(tree):
+    replace_in_file(tree.path("b.dict.yaml"), "日本\tjfsv\t8\n", "日本\tjfsv\t55\n")
+
+
+def edit_synced_base(tree):
+    replace_in_file(tree.base, "中国\t1\n", "中国\t11\n")
+
+
+def test_direction1_matches_full_sync(trees, capsys):
+    incremental, full = trees
+    for tree in trees:
+        tree.sync(1)
+    assert incremental.contents() == full.contents()
+
+    for edit in (edit_base_weight, append_base_phrase, edit_target_weight):
+        for tree in trees:
+            edit(tree)
+            tree.sync(1)
+        assert incremental.contents() == full.contents(), edit.__name__
+    assert "美国\tugl\t25\n" in incremental.contents()["b.dict.yaml"]
+    assert "巴西\tawsv\t70\n" in incremental.contents()["a.dict.yaml"]
+    assert "德国\tfdlg\t40\n" in incremental.contents()["a.dict.yaml"]
+
+    # 没有任何变化时跳过全部目标文件，不改写文件
+    stats = incremental.stats()
+    capsys.readouterr()
+    incremental.sync(1)
+    output = capsys.readouterr().out
+    for target in incremental.targets:
+        assert f"已是最新，跳过: {target}" in output
+    assert "正在加载基础文件" not in output
+    assert incremental.stats() == stats
+
+
+def test_direction2_matches_full_sync(trees, capsys):
+    incremental, full = trees
+    for tree in trees:
+        tree.sync(2)
+    assert incremental.contents() == full.contents()
+
+    stats = incremental.stats()
+    capsys.readouterr()
+    incremental.sync(2)
+    output = capsys.readouterr().out
+    for target in incremental.targets:
+        assert f"已是最新，跳过: {target}" in output
+    assert incremental.stats() == stats
+
+    for edit in (edit_target_b, edit_synced_base, append_base_phrase):
+        for tree in trees:
+            edit(tree)
+            tree.sync(2)
+        assert incremental.contents() == full.contents(), edit.__name__
+    base = incremental.contents()["phrase_weight.txt"]
+    for line in ("日本\t55\n", "中国\t1\n", "巴西\t5\n", "俄国\t9\n"):
+        assert line in base
@@ -0,0 +1,124 @@
+"""replace_weight.py 的外部排序合并连接与内存连接结果一致"""
+import os
+import re
+import shutil
+
+import pytest
+
+import replace_weight
+import table_io
+
+BASE = (
+    "中国\t10\n"
+    "美国\t20\n"
+    "中国\t30\n"        # 重复词组
+    "英国\tabc\n"       # 权重无效
+    "法国\n"            # 列数不足
+    "\n"
+    "德国\t40\n"
+    "日本\t50\n"
+    "俄国\t60\n"
+)
+
+TARGET_WITH_COLUMNS = (
+    "# Rime dictionary\n"
+    "---\n"
+    "name: a\n"
+    "columns:\n"
+    "  - text\n"
+    "  - code\n"
+    "  - weight\n"
+    "...\n"
+    "中国\tkhlg\t1\n"
+    "美国\tugl\t2\n"
+    "中国\tkhlg\t3\n"   # 重复词组
+    "巴西\tawsv\t5\n"   # 基础文件中没有
+    "英国\tamlg\txx\n"  # 权重无效
+    "短行\n"            # 没有Tab
+    "德国\tfdlg\t40\n"  # 权重相同
+    "\n"
+    "俄国\twwlg\t6\n"
+)
+
+TARGET_DETECTED = (
+    "美国\tugl\t7\n"
+    "德国\tfdlg\t8\n"
+    "日本\tjfsv\n"      # 缺少权重
+    "法国\tifbr\t9\n"
+    "日本\tjfsv\t1\n"
+)
+
+
+def write_tree(root):
+    os.makedirs(root)
+    files = {"phrase_weight.txt": BASE, "a.dict.yaml": TARGET_WITH_COLUMNS, "b.dict.yaml": TARGET_DETECTED}
+    for name, content in files.items():
+        with open(os.path.join(root, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def read_tree(root):
+    contents = {}
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                contents[name] = f.read()
+    return contents
+
+
+def read_records(record_dir, tree):
+    """更新记录的内容，去掉时间戳和目录路径后按文件名顺序排列"""
+    records = []
+    for name in sorted(os.listdir(record_dir)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(record_dir, name), encoding='utf-8') as f:
+            text = f.read()
+        text = text.replace(os.path.abspath(tree), "<tree>").replace(record_dir, "<records>")
+        records.append(re.sub(r"\d{14}", "<timestamp>", text))
+    return records
+
+
+def sync(tmp_path, direction, join_engine, memory_limit):
+    tree = str(tmp_path / f"{join_engine}_{direction}")
+    record_dir = str(tmp_path / f"records_{join_engine}_{direction}")
+    write_tree(tree)
+    targets = [os.path.join(tree, "a.dict.yaml"), os.path.join(tree, "b.dict.yaml")]
+    failed = replace_weight.batch_main(os.path.join(tree, "phrase_weight.txt"), direction, targets, 1,
+                                       record_dir, join_engine, memory_limit)
+    assert failed == 0
+    return read_tree(tree), read_records(record_dir, tree)
+
+
+@pytest.fixture
+def spilled_runs(monkeypatch):
+    """让外部排序每两条记录就落盘一段，记录写出的段数"""
+    runs = []
+    write_run = table_io._write_run
+
+    def counting_write_run(records, tmp_dir):
+        runs.append(len(records))
+        return write_run(records, tmp_dir)
+
+    monkeypatch.setattr(table_io, "SORT_RUN_MIN_RECORDS", 2)
+    monkeypatch.setattr(table_io, "_write_run", counting_write_run)
+    return runs
+
+
+@pytest.mark.parametrize("direction", [1, 2])
+def test_external_join_matches_hash_join(tmp_path, spilled_runs, direction):
+    hash_tree, hash_records = sync(tmp_path, direction, "hash", replace_weight.JOIN_MEMORY_LIMIT)
+    assert not spilled_runs
+
+    external_tree, external_records = sync(tmp_path, direction, "external", 1)
+    assert len(spilled_runs) > 2  # 多段归并
+
+    assert external_tree == hash_tree
+    assert external_records == hash_records
+    # 确实有行被替换，且各类警告都已记录
+    original = {"phrase_weight.txt": BASE, "a.dict.yaml": TARGET_WITH_COLUMNS, "b.dict.yaml": TARGET_DETECTED}
+    assert hash_tree != original
+    log = "".join(hash_records)
+    for warning in ("数据验证失败", "列数不足", "未找到Tab分隔符"):
+        assert warning in log
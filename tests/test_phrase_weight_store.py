@@ -0,0 +1,93 @@
+"""wubi.encoded.py 的词语权重编译文件（PhraseWeightStore）与逐行解析的结果一致"""
+import os
+
+import pytest
+
+PHRASE_WEIGHTS = (
+    "中国\t5\n"
+    "美国\t99999999999999999999\n"  # 超出int64，跳过
+    "人民\tabc\n"                   # 不是数字，跳过
+    "人民\t7\n"
+    "中国\t3\n"                     # 重复，保留较大的5
+    "英国\t9223372036854775807\n"
+    "法国\tabc\n"                   # 只有无效权重，不收录
+    "\n"
+    "𠀀字\t12\n"                    # 基本多文种平面以外的首字
+    "只有一列\n"
+)
+
+
+def parse_plain(text: str) -> dict:
+    """按读取规则逐行解析为普通字典：跳过无效和超出范围的权重，重复的词语保留最大权重"""
+    weights = {}
+    for line in text.splitlines():
+        parts = line.strip().split('\t')
+        if len(parts) < 2 or not parts[1].strip().isdigit() or int(parts[1]) >= 2 ** 63:
+            continue
+        weights[parts[0]] = max(weights.get(parts[0], -1), int(parts[1]))
+    return {phrase: str(weight) for phrase, weight in weights.items()}
+
+
+@pytest.fixture
+def weight_file(tmp_path):
+    path = tmp_path / "phrase_weight.txt"
+    path.write_text(PHRASE_WEIGHTS, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_store_matches_plain_parse(wubi_encoded, weight_file, use_cache):
+    expected = parse_plain(PHRASE_WEIGHTS)
+    assert expected == {"中国": "5", "人民": "7", "英国": "9223372036854775807", "𠀀字": "12"}
+    for _ in range(2):  # 第二次读取使用编译文件（use_cache为True时）
+        store = wubi_encoded.read_phrase_weights(weight_file, use_cache)
+        assert dict(store.items()) == expected
+        assert len(store) == len(expected)
+        assert sorted(store) == sorted(expected)
+        for phrase in ("美国", "法国", "德国", "中", "中国人", ""):
+            assert phrase not in store
+            assert store.get(phrase, wubi_encoded.Config.DEFAULT_WEIGHT) == wubi_encoded.Config.DEFAULT_WEIGHT
+            assert store.weight(phrase) is None
+        with pytest.raises(KeyError):
+            store["美国"]
+    assert os.path.exists(weight_file + wubi_encoded.PHRASE_WEIGHT_STORE_SUFFIX) == use_cache
+
+
+def test_empty_and_missing_file(wubi_encoded, tmp_path):
+    empty = tmp_path / "empty.txt"
+    empty.write_text("", encoding='utf-8')
+    for _ in range(2):
+        store = wubi_encoded.read_phrase_weights(str(empty))
+        assert len(store) == 0
+        assert "中国" not in store
+        assert list(store) == []
+    assert len(wubi_encoded.read_phrase_weights(str(tmp_path / "missing.txt"))) == 0
+
+
+def test_rebuild_when_source_changes(wubi_encoded, weight_file):
+    assert wubi_encoded.read_phrase_weights(weight_file)["中国"] == "5"
+    stat = os.stat(weight_file)
+
+    # 大小变化
+    with open(weight_file, 'a', encoding='utf-8') as f:
+        f.write("德国\t8\n")
+    store = wubi_encoded.read_phrase_weights(weight_file)
+    assert store["德国"] == "8"
+    assert dict(store.items()) == parse_plain(PHRASE_WEIGHTS + "德国\t8\n")
+
+    # 大小不变，只有修改时间变化
+    text = PHRASE_WEIGHTS.replace("中国\t5", "中国\t6") + "德国\t8\n"
+    with open(weight_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.utime(weight_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    store = wubi_encoded.read_phrase_weights(weight_file)
+    assert store["中国"] == "6"
+    assert dict(store.items()) == parse_plain(text)
+
+
+def test_corrupt_store_is_rebuilt(wubi_encoded, weight_file):
+    wubi_encoded.read_phrase_weights(weight_file)
+    store_file = weight_file + wubi_encoded.PHRASE_WEIGHT_STORE_SUFFIX
+    with open(store_file, 'r+b') as f:
+        f.truncate(os.path.getsize(store_file) - 3)
+    assert dict(wubi_encoded.read_phrase_weights(weight_file).items()) == parse_plain(PHRASE_WEIGHTS)